@@ -1,64 +1,117 @@
+import asyncio
+import json
 import logging
-from typing import Any, Dict, List, Optional
+import time
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Awaitable, Dict, Iterator, List, Optional, Tuple
 
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 
-from app.core.ollama_client import OllamaClient
+from app.core import metrics
+from app.core.ollama_client import AsyncOllamaClient
+from app.core.singleflight import SingleFlight
 from app.integrations import mcp
-from app.services.kb_service import search_kb
-from app.services.decision_service import should_scrape_arxiv, classify_intent
+from app.integrations.mcp.schemas import ArxivMetadataItem, ToolResponse
+from app.services.answer_cache import answer_cache
+from app.services.kb_service import search_kb_async
+from app.services.decision_service import should_scrape_arxiv, classify_intent_with_tier_async
+from app.services.intent_classifier import normalize_question, verdict_cache
+from app.services.session_store import Session, session_store
 from app.services.prompt_service import (
-    build_kb_context,
-    build_arxiv_context,
+    build_followup_prompt,
     build_strict_prompt,
+    context_budget,
     normalize_sources,
+    pack_context,
 )
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# Questions identiques en vol (même question normalisée, thème, modèle et
+# paramètres de recherche) : un seul pipeline, tous les appelants reçoivent son résultat
+_flights = SingleFlight()
+
+# Options de génération de la réponse finale (font partie de la clé du cache de réponses)
+_GENERATION = {"temperature": 0.2, "num_predict": 600}
+
 
 class AskRequest(BaseModel):
     question: str = Field(..., description="Question utilisateur")
     theme: Optional[str] = Field(default=None, description="Thème arXiv (optionnel)")
     kb_top_k: int = Field(default=5, ge=1, le=20)
     kb_min_score: float = Field(default=0.12, ge=0.0, le=1.0)
+    kb_mode: str = Field(default="lexical", description="lexical|dense")
 
     scrape_max_results: int = Field(default=8, ge=1, le=30)
     scrape_sort: str = Field(default="relevance", description="relevance|submitted_date")
 
     model: str = Field(default="qwen3:1.7b", description="Modèle Ollama")
+    pipeline: str = Field(default="sequential", description="sequential|parallel")
+    session_id: Optional[str] = Field(
+        default=None,
+        description="Session de conversation renvoyée par un tour précédent (absent ou \"\" = pas de session)",
+    )
+    new_session: bool = Field(
+        default=False,
+        description="Premier tour : ouvre une session, son session_id est renvoyé dans la réponse",
+    )
 
 
-@router.post("/ask")
-def ask(req: AskRequest) -> Dict[str, Any]:
-    client = OllamaClient()
+class _Timeline:
+    """
+    Start/end of each pipeline stage, in ms since the request started.
+    Each stage also feeds the ask_stage_latency_ms{stage} histogram and the
+    request's Server-Timing header.
+    """
+
+    def __init__(self) -> None:
+        self._t0 = time.perf_counter()
+        self.stages: List[Dict[str, Any]] = []
+
+    def _ms(self) -> float:
+        return round((time.perf_counter() - self._t0) * 1000, 1)
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        entry: Dict[str, Any] = {"stage": stage, "start_ms": self._ms()}
+        self.stages.append(entry)
+        try:
+            yield
+        except asyncio.CancelledError:
+            entry["status"] = "cancelled"
+            raise
+        except Exception:
+            entry["status"] = "error"
+            raise
+        else:
+            entry["status"] = "ok"
+        finally:
+            entry["end_ms"] = self._ms()
+            # Étapes annulées (prefetch arXiv spéculatif) hors histogramme
+            if entry["status"] != "cancelled":
+                metrics.observe("ask_stage_latency_ms", entry["end_ms"] - entry["start_ms"], timing=stage, stage=stage)
+
+    async def run(self, stage: str, awaitable: Awaitable[Any]) -> Any:
+        with self.span(stage):
+            return await awaitable
+
 
+async def _classify(req: AskRequest, client: AsyncOllamaClient) -> Tuple[str, str]:
     try:
-        intent = classify_intent(client, req.question)
+        return await classify_intent_with_tier_async(client, req.question)
     except Exception as e:
         logger.error(f"classify_intent failed, falling back to metier: {e}")
-        intent = "metier"
+        verdict_cache.put(req.question, "metier", "fallback")
+        return "metier", "fallback"
 
-    if intent == "social":
-        try:
-            answer = client.generate(req.question, model=req.model)
-        except Exception as e:
-            logger.error(f"Ollama generate failed: {e}")
-            raise HTTPException(503, f"Service Ollama indisponible: {e}")
-        return {
-            "ok": True,
-            "answer": answer,
-            "intent": intent,
-            "used_arxiv": False,
-            "sources": [],
-            "kb_hits": 0,
-            "arxiv_hits": 0,
-        }
 
+async def _search_kb(req: AskRequest) -> List[Dict[str, Any]]:
     try:
-        kb_response = search_kb(req.question, req.kb_top_k, req.kb_min_score)
+        # Calcul NumPy dans un thread ; embedding (mode dense) via le scheduler partagé
+        kb_response = await search_kb_async(req.question, req.kb_top_k, req.kb_min_score, mode=req.kb_mode)
     except Exception as e:
         logger.error(f"KB search failed: {e}")
         raise HTTPException(503, f"Service KB indisponible: {e}")
@@ -66,43 +119,337 @@ def ask(req: AskRequest) -> Dict[str, Any]:
     if not kb_response.get("ok", False):
         logger.error(f"KB search returned an error: {kb_response.get('errors')}")
         raise HTTPException(503, f"Service KB indisponible: {kb_response.get('errors')}")
+    return kb_response.get("results", [])
 
-    kb_results = kb_response.get("results", [])
-    used_arxiv = should_scrape_arxiv(kb_results)
 
-    arxiv_items: List[Dict[str, Any]] = []
-    if used_arxiv:
-        tool_response = mcp.run_tool("arxiv_metadata", {
-            "query": req.question,
-            "theme": req.theme,
-            "max_results": req.scrape_max_results,
-            "sort": req.scrape_sort
-        })
-        if not tool_response.ok:
-            logger.error(f"arXiv tool returned an error: {tool_response.errors}")
-            raise HTTPException(503, f"Service arXiv indisponible: {tool_response.errors}")
-        arxiv_items = [item.dict() for item in tool_response.items]
+async def _fetch_arxiv(req: AskRequest) -> ToolResponse:
+    return await mcp.run_tool_async("arxiv_metadata", {
+        "query": req.question,
+        "theme": req.theme,
+        "max_results": req.scrape_max_results,
+        "sort": req.scrape_sort
+    })
 
-    context = build_kb_context(kb_results)
-    if arxiv_items:
-        context += "\n\n" + build_arxiv_context(arxiv_items)
 
-    prompt = build_strict_prompt(req.question, context)
+def _arxiv_items(tool_response: ToolResponse) -> List[ArxivMetadataItem]:
+    if not tool_response.ok:
+        logger.error(f"arXiv tool returned an error: {tool_response.errors}")
+        raise HTTPException(503, f"Service arXiv indisponible: {tool_response.errors}")
+    return tool_response.items
 
+
+async def _discard(task: "asyncio.Task[Any]") -> None:
+    task.cancel()
     try:
-        answer = client.generate(prompt, model=req.model)
-    except Exception as e:
-        logger.error(f"Ollama generate failed: {e}")
-        raise HTTPException(503, f"Service Ollama indisponible: {e}")
+        await task
+    except BaseException:
+        pass
+
 
-    sources = normalize_sources(kb_results, arxiv_items)
+async def _prepare(
+    req: AskRequest,
+    client: AsyncOllamaClient,
+    timeline: _Timeline,
+    retrieval: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    Everything before the final generation: intent, KB search, arXiv fallback
+    and prompt. Shared by /ask and /ask/stream.
+
+    pipeline="parallel": intent, KB search and a speculative arXiv prefetch
+    start together; the prefetch is cancelled if the intent is "social" or
+    the KB is enough.
+    retrieval: search results of a previous session turn on the same topic;
+    only the intent is recomputed, neither KB nor arXiv.
+    """
+    arxiv_task: Optional["asyncio.Task[ToolResponse]"] = None
+
+    if retrieval is not None:
+        intent, intent_tier = await timeline.run("classify_intent", _classify(req, client))
+        if intent != "social":
+            kb_results = retrieval["kb_results"]
+    elif req.pipeline == "parallel":
+        intent_task = asyncio.create_task(timeline.run("classify_intent", _classify(req, client)))
+        kb_task = asyncio.create_task(timeline.run("search_kb", _search_kb(req)))
+        arxiv_task = asyncio.create_task(timeline.run("arxiv_metadata", _fetch_arxiv(req)))
+        try:
+            intent, intent_tier = await intent_task
+            if intent == "social":
+                await _discard(kb_task)
+                await _discard(arxiv_task)
+            else:
+                kb_results = await kb_task
+        except BaseException:
+            # Erreur ou requête annulée : aucune tâche ne doit continuer seule
+            # (le fetch arXiv écrirait encore dans le log raw et la KB)
+            for task in (intent_task, kb_task, arxiv_task):
+                await _discard(task)
+            raise
+    else:
+        intent, intent_tier = await timeline.run("classify_intent", _classify(req, client))
+        if intent != "social":
+            kb_results = await timeline.run("search_kb", _search_kb(req))
+
+    if intent == "social":
+        return {
+            "intent": intent,
+            "intent_tier": intent_tier,
+            "prompt": req.question,
+            "kb_results": [],
+            "arxiv_items": [],
+            "used_arxiv": False,
+            "retrieval_reused": False,
+            "context_tokens": 0,
+            "timeline": timeline.stages,
+        }
+
+    arxiv_items: List[ArxivMetadataItem] = []
+    if retrieval is not None:
+        used_arxiv = retrieval["used_arxiv"]
+        arxiv_items = retrieval["arxiv_items"]
+    else:
+        used_arxiv = should_scrape_arxiv(kb_results)
+        if used_arxiv:
+            metrics.counter("ask_arxiv_fallbacks_total").inc()
+
+        if arxiv_task is not None and not used_arxiv:
+            await _discard(arxiv_task)
+        elif arxiv_task is not None:
+            arxiv_items = _arxiv_items(await arxiv_task)
+        elif used_arxiv:
+            arxiv_items = _arxiv_items(await timeline.run("arxiv_metadata", _fetch_arxiv(req)))
+
+    # Contexte borné en tokens pour le modèle, sans doublon KB / arXiv
+    with timeline.span("build_prompt"):
+        context, context_tokens = pack_context(kb_results, arxiv_items, context_budget(req.model))
+        prompt = build_strict_prompt(req.question, context)
 
     return {
-        "ok": True,
-        "answer": answer,
         "intent": intent,
+        "intent_tier": intent_tier,
+        "prompt": prompt,
+        "kb_results": kb_results,
+        "arxiv_items": arxiv_items,
         "used_arxiv": used_arxiv,
-        "sources": sources,
-        "kb_hits": len(kb_results),
-        "arxiv_hits": len(arxiv_items),
+        "retrieval_reused": retrieval is not None,
+        "context_tokens": context_tokens,
+        "timeline": timeline.stages,
     }
+
+
+def _flight_key(req: AskRequest) -> str:
+    # Un premier tour de session partage le calcul des requêtes sans état
+    fields = req.dict(exclude={"session_id", "new_session"})
+    fields["question"] = normalize_question(req.question)
+    return json.dumps(fields, sort_keys=True)
+
+
+def _answer_key(req: AskRequest, prepared: Dict[str, Any]) -> str:
+    return answer_cache.key(req.question, prepared["kb_results"], prepared["arxiv_items"], req.model, _GENERATION)
+
+
+def _metadata(prepared: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "intent": prepared["intent"],
+        "intent_tier": prepared["intent_tier"],
+        "used_arxiv": prepared["used_arxiv"],
+        "sources": normalize_sources(prepared["kb_results"], prepared["arxiv_items"]),
+        "kb_hits": len(prepared["kb_results"]),
+        "arxiv_hits": len(prepared["arxiv_items"]),
+        "context_tokens": prepared["context_tokens"],
+        "retrieval_reused": prepared["retrieval_reused"],
+        "timeline": prepared["timeline"],
+    }
+
+
+async def _prepare_turn(
+    req: AskRequest,
+    session: Session,
+    client: AsyncOllamaClient,
+    timeline: _Timeline,
+) -> Tuple[Dict[str, Any], str, Optional[List[int]]]:
+    """
+    Session turn: prepared pipeline, prompt to send and Ollama context to continue from.
+    On the same topic as the previous turn the search is reused and, while the
+    Ollama context is still valid, only the new question is sent.
+    """
+    prepared = await _prepare(req, client, timeline, retrieval=session.reusable_retrieval(req.question))
+    llm_context = None
+    if prepared["intent"] != "social":
+        llm_context = session.llm_context_for(req.model, prepared["retrieval_reused"])
+    prompt = build_followup_prompt(req.question) if llm_context else prepared["prompt"]
+    return prepared, prompt, llm_context
+
+
+def _session_metadata(session: Session, llm_context: Optional[List[int]]) -> Dict[str, Any]:
+    return {"session_id": session.id, "turn": len(session.turns), "llm_context_reused": bool(llm_context)}
+
+
+async def _session_answer(req: AskRequest) -> Dict[str, Any]:
+    """
+    /ask within a session: no coalescing and no answer cache, since the
+    answer depends on the previous turns.
+    """
+    session = session_store.get_or_create(req.session_id)
+    async with session.lock:
+        client = AsyncOllamaClient()
+        timeline = _Timeline()
+        prepared, prompt, llm_context = await _prepare_turn(req, session, client, timeline)
+        try:
+            answer, next_context = await timeline.run(
+                "generate",
+                client.generate_with_context(prompt, context=llm_context, model=req.model, **_GENERATION),
+            )
+        except Exception as e:
+            logger.error(f"Ollama generate failed: {e}")
+            raise HTTPException(503, f"Service Ollama indisponible: {e}")
+        session.record(req.question, answer, prepared, next_context, req.model)
+    return {
+        "ok": True,
+        "answer": answer,
+        "cached": False,
+        "coalesced": False,
+        **_metadata(prepared),
+        **_session_metadata(session, llm_context),
+    }
+
+
+async def _answer(req: AskRequest) -> Tuple[Dict[str, Any], Dict[str, Any], Optional[List[int]]]:
+    """Stateless /ask: (response, prepared pipeline, Ollama context or None for a cached answer)."""
+    client = AsyncOllamaClient()
+    timeline = _Timeline()
+    prepared = await _prepare(req, client, timeline)
+
+    with timeline.span("answer_cache"):
+        key = _answer_key(req, prepared)
+        # Niveau disque : lecture de fichier, hors de la boucle d'événements
+        answer = await asyncio.to_thread(answer_cache.get, key)
+    if answer is not None:
+        return {"ok": True, "answer": answer, "cached": True, **_metadata(prepared)}, prepared, None
+
+    try:
+        answer, llm_context = await timeline.run(
+            "generate", client.generate_with_context(prepared["prompt"], model=req.model, **_GENERATION)
+        )
+    except Exception as e:
+        logger.error(f"Ollama generate failed: {e}")
+        raise HTTPException(503, f"Service Ollama indisponible: {e}")
+
+    await asyncio.to_thread(answer_cache.put, key, answer)
+    return {"ok": True, "answer": answer, "cached": False, **_metadata(prepared)}, prepared, llm_context
+
+
+@router.post("/ask")
+async def ask(req: AskRequest) -> Dict[str, Any]:
+    if req.session_id:
+        return await _session_answer(req)
+    (result, prepared, llm_context), shared = await _flights.do(("ask", _flight_key(req)), lambda: _answer(req))
+    result = {**result, "coalesced": shared}
+    if req.new_session:
+        # Premier tour : fusion et cache de réponses comme sans session, puis la session démarre de ce tour
+        session = session_store.create()
+        session.record(req.question, result["answer"], prepared, llm_context, req.model)
+        result.update(_session_metadata(session, None))
+    return result
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.post("/ask/stream")
+async def ask_stream(req: AskRequest) -> StreamingResponse:
+    """
+    Same pipeline as /ask, answered as Server-Sent Events: one "meta" event
+    (intent, kb_hits, used_arxiv, sources...), one "token" event per generated
+    fragment, then "done" (or "error" if Ollama fails mid-stream).
+    """
+    if req.session_id:
+        return await _session_stream(req)
+
+    client = AsyncOllamaClient()
+    # Les erreurs KB / arXiv sortent en HTTP 503 avant le début du flux.
+    # Seule la préparation est partagée : chaque flux a sa propre génération.
+    # L'en-tête Server-Timing part avec la réponse : il couvre la préparation, pas la génération
+    timeline = _Timeline()
+    prepared, _ = await _flights.do(("prepare", _flight_key(req)), lambda: _prepare(req, client, timeline))
+
+    with timeline.span("answer_cache"):
+        key = _answer_key(req, prepared)
+        cached = await asyncio.to_thread(answer_cache.get, key)
+
+    # Premier tour d'une session : même chemin (cache compris), le tour est enregistré à la fin du flux
+    session = session_store.create() if req.new_session else None
+    opened = {"session_id": session.id} if session is not None else {}
+
+    async def events() -> AsyncIterator[str]:
+        yield _sse("meta", {"ok": True, "cached": cached is not None, **_metadata(prepared), **opened})
+        if cached is not None:
+            # Réponse en cache : un seul fragment
+            yield _sse("token", {"token": cached})
+            if session is not None:
+                session.record(req.question, cached, prepared, None, req.model)
+            yield _sse("done", {"ok": True, **opened})
+            return
+
+        tokens: List[str] = []
+        final: Dict[str, Any] = {}
+        t0 = time.perf_counter()
+        try:
+            async for token in client.generate_stream(prepared["prompt"], model=req.model, final=final, **_GENERATION):
+                tokens.append(token)
+                yield _sse("token", {"token": token})
+        except Exception as e:
+            logger.error(f"Ollama stream failed: {e}")
+            yield _sse("error", {"ok": False, "errors": [f"Service Ollama indisponible: {e}"]})
+            return
+        metrics.observe("ask_stage_latency_ms", (time.perf_counter() - t0) * 1000, stage="generate_stream")
+        # Même normalisation que generate() (strip) pour partager les entrées avec /ask
+        answer = "".join(tokens).strip()
+        await asyncio.to_thread(answer_cache.put, key, answer)
+        if session is not None:
+            session.record(req.question, answer, prepared, final.get("context"), req.model)
+        yield _sse("done", {"ok": True, **opened})
+
+    return _event_stream(events())
+
+
+async def _session_stream(req: AskRequest) -> StreamingResponse:
+    """
+    /ask/stream within a session. The session lock covers the preparation; the
+    turn is recorded when the stream ends, with the Ollama context of its last line.
+    """
+    session = session_store.get_or_create(req.session_id)
+    client = AsyncOllamaClient()
+    timeline = _Timeline()
+    async with session.lock:
+        prepared, prompt, llm_context = await _prepare_turn(req, session, client, timeline)
+
+    async def events() -> AsyncIterator[str]:
+        yield _sse("meta", {"ok": True, "cached": False, **_metadata(prepared), **_session_metadata(session, llm_context)})
+        tokens: List[str] = []
+        final: Dict[str, Any] = {}
+        t0 = time.perf_counter()
+        try:
+            async for token in client.generate_stream(
+                prompt, model=req.model, context=llm_context, final=final, **_GENERATION
+            ):
+                tokens.append(token)
+                yield _sse("token", {"token": token})
+        except Exception as e:
+            logger.error(f"Ollama stream failed: {e}")
+            yield _sse("error", {"ok": False, "errors": [f"Service Ollama indisponible: {e}"]})
+            return
+        metrics.observe("ask_stage_latency_ms", (time.perf_counter() - t0) * 1000, stage="generate_stream")
+        session.record(req.question, "".join(tokens).strip(), prepared, final.get("context"), req.model)
+        yield _sse("done", {"ok": True, "session_id": session.id})
+
+    return _event_stream(events())
+
+
+def _event_stream(events: AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -4,7 +4,8 @@ from typing import Any, Dict, List
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel, Field
 
-from app.integrations import mcp
+from app.core import metrics
+from app.services.email_queue import email_queue
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -16,16 +17,25 @@ class SendEmailRequest(BaseModel):
     conversation_history: List[Dict[str, str]] = Field(..., description="Historique de la conversation")
 
 
-@router.post("/send-email")
+@router.post("/send-email", status_code=202)
 def send_email(req: SendEmailRequest) -> Dict[str, Any]:
-    tool_response = mcp.run_tool("send_email", {
-        "recipient_email": req.recipient_email,
-        "subject": req.subject,
-        "conversation_history": req.conversation_history,
-    })
-
-    if not tool_response.ok:
-        logger.error(f"send_email tool returned an error: {tool_response.errors}")
-        raise HTTPException(503, f"Service email indisponible: {tool_response.errors}")
-
-    return {"ok": True, "sent_at": tool_response.scraped_at}
+    """
+    Queues the email (data_lake/email_queue) and answers 202 right away; the
+    background worker sends it. Track it with GET /api/send-email/{job_id}.
+    """
+    try:
+        with metrics.timed("email_stage_latency_ms", timing="enqueue", stage="enqueue"):
+            job_id = email_queue.enqueue(req.recipient_email, req.subject, req.conversation_history)
+    except OSError as e:
+        logger.error(f"email enqueue failed: {e}")
+        raise HTTPException(503, f"Service email indisponible: {e}")
+
+    return {"ok": True, "job_id": job_id, "status": "pending"}
+
+
+@router.get("/send-email/{job_id}")
+def send_email_status(job_id: str) -> Dict[str, Any]:
+    job = email_queue.status(job_id)
+    if job is None:
+        raise HTTPException(404, f"Job email inconnu: {job_id}")
+    return {"ok": True, **job}
@@ -1,7 +1,35 @@
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from app.core.llm_scheduler import get_scheduler
+from app.integrations.mcp.cache import arxiv_cache
+from app.integrations.mcp.registry import tool_stats
+from app.services.answer_cache import answer_cache
+from app.services.email_queue import email_queue
+from app.services.intent_classifier import verdict_cache
+from app.services.pdf_service import pdf_pipeline
+from app.services.raw_log import raw_log
+from app.services.session_store import session_store
+from app.services.warmup_service import readiness
 
 router = APIRouter()
 
+# async : les stats du scheduler LLM se lisent depuis la boucle d'événements
 @router.get("/health")
-def health_check():
-    return {"status": "ok"}
+async def health_check():
+    # 503 tant que le warm-up du worker n'est pas fini : pas de trafic sur un worker froid
+    if not readiness.ready:
+        return JSONResponse(status_code=503, content={"status": "warming_up", "warmup": readiness.stats()})
+    return {
+        "status": "degraded" if readiness.degraded else "ok",
+        "warmup": readiness.stats(),
+        "arxiv_cache": arxiv_cache.stats(),
+        "intent_tiers": verdict_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+        "sessions": session_store.stats(),
+        "raw_log": raw_log.stats(),
+        "email_queue": email_queue.stats(),
+        "pdf_pipeline": pdf_pipeline.stats(),
+        "tools": tool_stats(),
+        "llm_scheduler": get_scheduler().stats(),
+    }
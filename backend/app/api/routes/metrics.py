@@ -0,0 +1,30 @@
+from typing import Dict, Iterator, Tuple
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.core import metrics
+from app.integrations.mcp.cache import arxiv_cache
+from app.services.answer_cache import answer_cache
+from app.services.intent_classifier import verdict_cache
+
+router = APIRouter()
+
+
+def _service_counters() -> Iterator[Tuple[str, Dict[str, str], float]]:
+    # Compteurs déjà tenus par les caches (hits mémoire / disque, misses...) et l'intent
+    for cache, stats in (("arxiv", arxiv_cache.stats()), ("answer", answer_cache.stats())):
+        for event, value in stats.items():
+            if event != "memory_entries":
+                yield "cache_events_total", {"cache": cache, "event": event}, value
+    for tier, value in verdict_cache.stats().items():
+        yield "intent_verdicts_total", {"tier": tier}, value
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics() -> PlainTextResponse:
+    """Histograms (latency per stage) and counters in the Prometheus text format."""
+    return PlainTextResponse(
+        metrics.render(extra_counters=_service_counters()),
+        media_type="text/plain; version=0.0.4",
+    )
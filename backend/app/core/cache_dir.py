@@ -0,0 +1,46 @@
+"""
+Bounds for the on-disk cache tiers (one JSON file per key under
+data_lake/raw/cache/): expired files are deleted, then the oldest ones
+beyond a maximum count.
+"""
+from __future__ import annotations
+
+import os
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+
+def prune_cache_dir(directory: Path, max_files: int, max_age_s: float, pattern: str = "*.json") -> int:
+    """
+    Deletes the files of `directory` older than max_age_s (mtime = write time),
+    then the oldest ones beyond max_files. Returns how many were removed.
+    """
+    now = time.time()
+    files: List[Tuple[float, Path]] = []
+    removed = 0
+    for path in directory.glob(pattern):
+        try:
+            mtime = path.stat().st_mtime
+        except OSError:
+            continue  # supprimé par un autre worker
+        if now - mtime > max_age_s:
+            remove_quietly(path)
+            removed += 1
+        else:
+            files.append((mtime, path))
+
+    if len(files) > max_files:
+        files.sort()
+        for _, path in files[:len(files) - max_files]:
+            remove_quietly(path)
+            removed += 1
+    return removed
+
+
+def remove_quietly(path: Path) -> None:
+    """Unlinks a cache file, ignoring a concurrent removal or a busy file (Windows)."""
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
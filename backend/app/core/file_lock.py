@@ -0,0 +1,68 @@
+"""
+Inter-process lock on a file, for the writers shared by the uvicorn workers
+of app.serve (KB segments, vectors, raw log).
+
+Exclusive across processes (fcntl.flock) and threads, reentrant within a
+thread. Without fcntl (Windows) only the thread lock applies: run a single
+worker there.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class FileLock:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self._fh = None
+
+    def __enter__(self) -> "FileLock":
+        self._rlock.acquire()
+        if self._depth == 0:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                fh = open(self.path, "ab")
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+                    except BaseException:
+                        fh.close()
+                        raise
+            except BaseException:
+                self._rlock.release()
+                raise
+            self._fh = fh
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._depth -= 1
+        if self._depth == 0:
+            # Fermer le descripteur libère le flock
+            fh, self._fh = self._fh, None
+            fh.close()
+        self._rlock.release()
+
+
+_locks: Dict[str, FileLock] = {}
+_locks_guard = threading.Lock()
+
+
+def file_lock(path: Path) -> FileLock:
+    """The process-wide FileLock of `path` (one object per path, for reentrancy)."""
+    key = os.path.abspath(path)
+    with _locks_guard:
+        lock: Optional[FileLock] = _locks.get(key)
+        if lock is None:
+            lock = _locks[key] = FileLock(Path(key))
+        return lock
@@ -0,0 +1,49 @@
+"""
+Shared keep-alive HTTP connection pools (Ollama, arXiv).
+
+The async client is created at app startup (main.create_app) and closed at
+shutdown; outside the app (scripts, CLI) it is created on first use.
+"""
+import threading
+from typing import Optional
+
+import httpx
+import requests
+
+_POOL_LIMITS = httpx.Limits(max_connections=200, max_keepalive_connections=50, keepalive_expiry=60.0)
+
+_async_client: Optional[httpx.AsyncClient] = None
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+async def startup() -> None:
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(limits=_POOL_LIMITS)
+
+
+async def shutdown() -> None:
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+def get_async_client() -> httpx.AsyncClient:
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(limits=_POOL_LIMITS)
+    return _async_client
+
+
+def get_session() -> requests.Session:
+    """Process-wide requests.Session for the sync code paths (keep-alive)."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=10, pool_maxsize=50)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
@@ -0,0 +1,114 @@
+"""
+Process-wide scheduler for Ollama calls.
+
+Replaces the per-instance OllamaClient throttle (useless once a client is
+created per request) with state shared by the whole process:
+  - token bucket: average rate (rate_per_s) and maximum burst (burst);
+  - semaphore: maximum number of concurrent Ollama calls (size it to the CPU cores);
+  - priority queue: short classifications go before long generations.
+Waiters are asyncio futures, so no worker thread is blocked.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import statistics
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+PRIORITY_CLASSIFY = 0
+PRIORITY_EMBED = 5
+PRIORITY_GENERATE = 10
+
+
+class LLMScheduler:
+    def __init__(self, rate_per_s: float, burst: int, max_concurrency: int) -> None:
+        self.rate_per_s = float(rate_per_s)
+        self.burst = max(1, int(burst))
+        self.max_concurrency = max(1, int(max_concurrency))
+
+        self._tokens = float(self.burst)
+        self._refilled_at = time.monotonic()
+        self._in_flight = 0
+        self._queue: List[Tuple[int, int, float, "asyncio.Future[None]"]] = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+        self._waits_ms: Deque[float] = deque(maxlen=1024)
+        self._granted: Dict[int, int] = {}
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate_per_s)
+        self._refilled_at = now
+
+    def _dispatch(self) -> None:
+        self._timer = None
+        self._refill()
+        while self._queue and self._in_flight < self.max_concurrency and self._tokens >= 1.0:
+            priority, _, enqueued_at, fut = heapq.heappop(self._queue)
+            if fut.done():  # appelant annulé pendant l'attente
+                continue
+            self._tokens -= 1.0
+            self._in_flight += 1
+            self._waits_ms.append((time.monotonic() - enqueued_at) * 1000)
+            self._granted[priority] = self._granted.get(priority, 0) + 1
+            fut.set_result(None)
+
+        if self._queue and self._in_flight < self.max_concurrency and self._timer is None:
+            # Plus de jeton : on repasse quand le prochain sera disponible
+            delay = (1.0 - self._tokens) / self.rate_per_s if self.rate_per_s > 0 else 1.0
+            self._timer = asyncio.get_running_loop().call_later(max(delay, 0.001), self._dispatch)
+
+    async def acquire(self, priority: int = PRIORITY_GENERATE) -> None:
+        fut: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), time.monotonic(), fut))
+        self._dispatch()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release()  # slot accordé juste avant l'annulation
+            raise
+
+    def release(self) -> None:
+        self._in_flight -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_GENERATE) -> AsyncIterator[None]:
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict[str, Any]:
+        waits = list(self._waits_ms)
+        return {
+            "queue_depth": sum(1 for *_, fut in self._queue if not fut.done()),
+            "in_flight": self._in_flight,
+            "max_concurrency": self.max_concurrency,
+            "rate_per_s": self.rate_per_s,
+            "granted_by_priority": dict(self._granted),
+            "wait_ms_p50": round(statistics.median(waits), 1) if waits else 0.0,
+            "wait_ms_p95": round(sorted(waits)[int(0.95 * (len(waits) - 1))], 1) if waits else 0.0,
+            "wait_ms_max": round(max(waits), 1) if waits else 0.0,
+        }
+
+
+_scheduler: Optional[LLMScheduler] = None
+
+
+def get_scheduler() -> LLMScheduler:
+    global _scheduler
+    if _scheduler is None:
+        concurrency = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "2"))
+        _scheduler = LLMScheduler(
+            rate_per_s=float(os.getenv("OLLAMA_RATE_PER_S", "1.0")),
+            burst=int(os.getenv("OLLAMA_BURST", str(concurrency))),
+            max_concurrency=concurrency,
+        )
+    return _scheduler
@@ -0,0 +1,194 @@
+"""
+In-process metrics: latency histograms and counters.
+
+Fixed-bucket histograms (in ms, Prometheus-compatible): observe() costs
+O(number of buckets) and keeps no samples; p50 / p95 / p99 are interpolated
+within the buckets. render() produces the Prometheus text format (/api/metrics).
+
+Each HTTP request also has its own list of per-stage durations (a contextvar
+filled by timed() / observe()), sent back as a Server-Timing header by the
+middleware.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 120000)
+
+_Labels = Tuple[Tuple[str, str], ...]
+
+# Étapes de la requête en cours : (nom, durée ms). None hors requête HTTP.
+_request_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_timings", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = _BUCKETS_MS) -> None:
+        self.buckets = tuple(buckets)
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)  # dernier = +Inf
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value_ms: float) -> None:
+        i = bisect.bisect_left(self.buckets, value_ms)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value_ms
+
+    def quantile(self, q: float) -> float:
+        with self._lock:
+            counts = list(self.counts)
+            total = self.count
+        if total == 0:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for i, c in enumerate(counts):
+            if seen + c >= rank and c:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / c
+            seen += c
+        return float(self.buckets[-1])
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "sum_ms": round(self.sum, 1),
+            "p50_ms": round(self.quantile(0.50), 1),
+            "p95_ms": round(self.quantile(0.95), 1),
+            "p99_ms": round(self.quantile(0.99), 1),
+        }
+
+
+class Counter:
+    def __init__(self) -> None:
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+
+_lock = threading.Lock()
+_histograms: Dict[Tuple[str, _Labels], Histogram] = {}
+_counters: Dict[Tuple[str, _Labels], Counter] = {}
+
+
+def _key(name: str, labels: Dict[str, str]) -> Tuple[str, _Labels]:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def histogram(name: str, **labels: str) -> Histogram:
+    key = _key(name, labels)
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = Histogram()
+        return h
+
+
+def counter(name: str, **labels: str) -> Counter:
+    key = _key(name, labels)
+    with _lock:
+        c = _counters.get(key)
+        if c is None:
+            c = _counters[key] = Counter()
+        return c
+
+
+def snapshot(prefix: str = "") -> Dict[str, Dict[str, float]]:
+    """Histograms whose name starts with `prefix`, keyed "name{label=value,...}"."""
+    with _lock:
+        items = [(k, h) for k, h in _histograms.items() if k[0].startswith(prefix)]
+    out = {}
+    for (name, labels), h in sorted(items):
+        label_str = ",".join(f"{k}={v}" for k, v in labels)
+        out[f"{name}{{{label_str}}}" if label_str else name] = h.snapshot()
+    return out
+
+
+def observe(name: str, value_ms: float, timing: Optional[str] = None, **labels: str) -> None:
+    """Records `value_ms` in histogram `name`; with `timing`, also in the request's Server-Timing."""
+    histogram(name, **labels).observe(value_ms)
+    if timing:
+        record_timing(timing, value_ms)
+
+
+@contextmanager
+def timed(name: str, timing: Optional[str] = None, **labels: str) -> Iterator[None]:
+    """Times the block (even when it raises) into histogram `name`."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, (time.perf_counter() - t0) * 1000, timing, **labels)
+
+
+# ---- Server-Timing ----
+
+def begin_request() -> List[Tuple[str, float]]:
+    """New timing list for the current request (child tasks share the same list)."""
+    timings: List[Tuple[str, float]] = []
+    _request_timings.set(timings)
+    return timings
+
+
+def record_timing(stage: str, value_ms: float) -> None:
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((stage, value_ms))
+
+
+def server_timing(timings: List[Tuple[str, float]]) -> str:
+    """Server-Timing header value: "classify_intent;dur=12.3, search_kb;dur=4.1"."""
+    return ", ".join(f"{stage};dur={value_ms:.1f}" for stage, value_ms in timings)
+
+
+# ---- exposition Prometheus ----
+
+def _label_str(labels: Iterable[Tuple[str, str]]) -> str:
+    parts = []
+    for k, v in labels:
+        v = v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def render(extra_counters: Iterable[Tuple[str, Dict[str, str], float]] = ()) -> str:
+    """
+    Prometheus text format (version 0.0.4) of every histogram and counter.
+    extra_counters: counters kept elsewhere (cache stats), as (name, labels, value).
+    """
+    with _lock:
+        histograms = sorted(_histograms.items())
+        counters = [(name, labels, c.value) for (name, labels), c in _counters.items()]
+    counters += [(name, _key(name, labels)[1], value) for name, labels, value in extra_counters]
+
+    lines: List[str] = []
+    typed = set()
+    for (name, labels), h in histograms:
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        with h._lock:
+            counts = list(h.counts)
+            total, total_sum = h.count, h.sum
+        cumulative = 0
+        for bound, c in zip(list(h.buckets) + ["+Inf"], counts):
+            cumulative += c
+            lines.append(f"{name}_bucket{_label_str(labels + (('le', str(bound)),))} {cumulative}")
+        lines.append(f"{name}_sum{_label_str(labels)} {total_sum:.3f}")
+        lines.append(f"{name}_count{_label_str(labels)} {total}")
+
+    for name, labels, value in sorted(counters):
+        if name not in typed:
+            lines.append(f"# TYPE {name} counter")
+            typed.add(name)
+        lines.append(f"{name}{_label_str(labels)} {value}")
+    return "\n".join(lines) + "\n"
@@ -1,35 +1,117 @@
+import json
 import os
+import threading
 import time
+import httpx
 import requests
-from typing import Any, Dict, Optional
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
 
+from app.core import metrics
+from app.core.http_pool import get_async_client, get_session
+from app.core.llm_scheduler import PRIORITY_EMBED, PRIORITY_GENERATE, get_scheduler
 
-class OllamaClient:
-    """
-    Minimal Ollama HTTP client.
-    Default endpoint: http://127.0.0.1:11434
-    """
+# Throttle du client sync partagé par tout le process (scripts, ingestion) ;
+# le client async passe par core.llm_scheduler.
+_sync_lock = threading.Lock()
+_sync_last_call_ts = 0.0
+
+
+def _error(op: str, message: str) -> RuntimeError:
+    # Compté dans ollama_errors_total{op=...} (/api/metrics)
+    metrics.counter("ollama_errors_total", op=op).inc()
+    return RuntimeError(message)
+
+
+class _BaseOllamaClient:
+    """Configuration + payloads shared by the sync and async clients."""
 
     def __init__(
         self,
         base_url: Optional[str] = None,
         model: Optional[str] = None,
         timeout_s: float = 60.0,
-        min_interval_s: float = 1.0,  # rate limit: 1 req/s
+        min_interval_s: float = 1.0,  # rate limit du client sync: 1 req/s
     ) -> None:
         self.base_url = (base_url or os.getenv("OLLAMA_BASE_URL") or "http://127.0.0.1:11434").rstrip("/")
         self.model = model or os.getenv("OLLAMA_MODEL") or "qwen3:1.7b"
+        self.embed_model = os.getenv("OLLAMA_EMBED_MODEL") or "nomic-embed-text"
         self.timeout_s = float(timeout_s)
         self.min_interval_s = float(min_interval_s)
+        self.keep_alive = self._keep_alive(os.getenv("OLLAMA_KEEP_ALIVE") or "30m")
+
+    @staticmethod
+    def _keep_alive(value: str) -> Any:
+        # Ollama attend une durée ("30m") ou un nombre de secondes (-1 = toujours chargé)
+        try:
+            return int(value)
+        except ValueError:
+            return value
+
+    def _generate_payload(
+        self,
+        prompt: str,
+        system: Optional[str],
+        temperature: float,
+        num_predict: int,
+        model: Optional[str],
+        stream: bool,
+        think: Optional[bool] = None,
+        context: Optional[List[int]] = None,
+    ) -> Dict[str, Any]:
+        payload: Dict[str, Any] = {
+            "model": model or self.model,
+            "prompt": prompt,
+            "stream": stream,
+            # Modèle (et son cache de préfixe) gardé en mémoire entre deux requêtes
+            "keep_alive": self.keep_alive,
+            "options": {
+                "temperature": temperature,
+                "num_predict": num_predict,
+            },
+        }
+        if system:
+            payload["system"] = system
+        if think is not None:
+            # Modèles "thinking" (qwen3...) : think=False évite de payer le raisonnement
+            payload["think"] = think
+        if context:
+            # Tokens renvoyés par la réponse précédente : Ollama reprend la
+            # conversation sans re-préremplir les tours déjà vus
+            payload["context"] = context
+        return payload
 
-        self._last_call_ts = 0.0
+    @staticmethod
+    def _parse_stream_line(line: str) -> Optional[Dict[str, Any]]:
+        # Une ligne JSON par fragment, la dernière porte "done": true
+        if not line:
+            return None
+        data = json.loads(line)
+        if data.get("error"):
+            raise _error("generate_stream", f"Ollama error: {data['error']}")
+        return data
+
+    def _embeddings(self, data: Dict[str, Any], texts: List[str]) -> List[List[float]]:
+        embeddings = data.get("embeddings") or []
+        if len(embeddings) != len(texts):
+            raise _error("embed", f"Ollama returned {len(embeddings)} embeddings for {len(texts)} inputs")
+        return embeddings
+
+
+class OllamaClient(_BaseOllamaClient):
+    """
+    Minimal Ollama HTTP client.
+    Default endpoint: http://127.0.0.1:11434
+    Connections go through the shared requests.Session (keep-alive).
+    """
 
     def _throttle(self) -> None:
-        now = time.time()
-        elapsed = now - self._last_call_ts
-        if elapsed < self.min_interval_s:
-            time.sleep(self.min_interval_s - elapsed)
-        self._last_call_ts = time.time()
+        global _sync_last_call_ts
+        with _sync_lock:
+            now = time.time()
+            delay = max(0.0, self.min_interval_s - (now - _sync_last_call_ts))
+            _sync_last_call_ts = now + delay
+        if delay:
+            time.sleep(delay)
 
     def generate(
         self,
@@ -38,6 +120,7 @@ class OllamaClient:
         temperature: float = 0.2,
         num_predict: int = 600,
         model: Optional[str] = None,
+        think: Optional[bool] = None,
     ) -> str:
         """
         Calls Ollama /api/generate (non-stream).
@@ -46,26 +129,191 @@ class OllamaClient:
         self._throttle()
 
         url = f"{self.base_url}/api/generate"
-        payload: Dict[str, Any] = {
-            "model": model or self.model,
-            "prompt": prompt,
-            "stream": False,
-            "options": {
-                "temperature": temperature,
-                "num_predict": num_predict,
-            },
-        }
-        if system:
-            payload["system"] = system
+        payload = self._generate_payload(prompt, system, temperature, num_predict, model, stream=False, think=think)
 
         try:
-            r = requests.post(url, json=payload, timeout=self.timeout_s)
+            r = get_session().post(url, json=payload, timeout=self.timeout_s)
         except requests.RequestException as e:
-            raise RuntimeError(f"Ollama unreachable at {self.base_url} ({e})")
+            raise _error("generate", f"Ollama unreachable at {self.base_url} ({e})")
 
         if r.status_code != 200:
             # show concise error
-            raise RuntimeError(f"Ollama error {r.status_code}: {r.text}")
+            raise _error("generate", f"Ollama error {r.status_code}: {r.text}")
 
         data = r.json()
         return (data.get("response") or "").strip()
+
+    def generate_stream(
+        self,
+        prompt: str,
+        system: Optional[str] = None,
+        temperature: float = 0.2,
+        num_predict: int = 600,
+        model: Optional[str] = None,
+    ) -> Iterator[str]:
+        """
+        Calls Ollama /api/generate in stream mode.
+        Yields text fragments as Ollama produces them.
+        """
+        self._throttle()
+
+        url = f"{self.base_url}/api/generate"
+        payload = self._generate_payload(prompt, system, temperature, num_predict, model, stream=True)
+
+        try:
+            r = get_session().post(url, json=payload, timeout=self.timeout_s, stream=True)
+        except requests.RequestException as e:
+            raise _error("generate_stream", f"Ollama unreachable at {self.base_url} ({e})")
+
+        with r:
+            if r.status_code != 200:
+                raise _error("generate_stream", f"Ollama error {r.status_code}: {r.text}")
+            for line in r.iter_lines(decode_unicode=True):
+                data = self._parse_stream_line(line)
+                if data is None:
+                    continue
+                if data.get("response"):
+                    yield data["response"]
+                if data.get("done"):
+                    break
+
+    def embed(self, texts: List[str], model: Optional[str] = None) -> List[List[float]]:
+        """
+        Calls Ollama /api/embed with a batch of inputs.
+        Returns one embedding per input text, in order.
+        """
+        self._throttle()
+
+        url = f"{self.base_url}/api/embed"
+        payload: Dict[str, Any] = {
+            "model": model or self.embed_model,
+            "input": texts,
+            "keep_alive": self.keep_alive,
+        }
+
+        try:
+            r = get_session().post(url, json=payload, timeout=self.timeout_s)
+        except requests.RequestException as e:
+            raise _error("embed", f"Ollama unreachable at {self.base_url} ({e})")
+
+        if r.status_code != 200:
+            raise _error("embed", f"Ollama error {r.status_code}: {r.text}")
+
+        return self._embeddings(r.json(), texts)
+
+
+class AsyncOllamaClient(_BaseOllamaClient):
+    """
+    Async Ollama client over the shared httpx pool (core.http_pool).
+    Same interface as OllamaClient; every call takes a slot of the process-wide
+    scheduler (core.llm_scheduler), and waiting does not block a worker thread.
+    """
+
+    async def generate(
+        self,
+        prompt: str,
+        system: Optional[str] = None,
+        temperature: float = 0.2,
+        num_predict: int = 600,
+        model: Optional[str] = None,
+        think: Optional[bool] = None,
+        priority: int = PRIORITY_GENERATE,
+    ) -> str:
+        """
+        Async /api/generate (non-stream). Returns the generated text.
+        priority: PRIORITY_CLASSIFY goes ahead of queued generations.
+        """
+        payload = self._generate_payload(prompt, system, temperature, num_predict, model, stream=False, think=think)
+        data = await self._post_generate(payload, priority)
+        return (data.get("response") or "").strip()
+
+    async def generate_with_context(
+        self,
+        prompt: str,
+        context: Optional[List[int]] = None,
+        temperature: float = 0.2,
+        num_predict: int = 600,
+        model: Optional[str] = None,
+        priority: int = PRIORITY_GENERATE,
+    ) -> Tuple[str, List[int]]:
+        """
+        Conversation turn: continues from `context` (tokens of the previous
+        turn) and returns (text, context to pass to the next turn).
+        """
+        payload = self._generate_payload(prompt, None, temperature, num_predict, model, stream=False, context=context)
+        data = await self._post_generate(payload, priority)
+        return (data.get("response") or "").strip(), data.get("context") or []
+
+    async def _post_generate(self, payload: Dict[str, Any], priority: int) -> Dict[str, Any]:
+        url = f"{self.base_url}/api/generate"
+        try:
+            async with get_scheduler().slot(priority):
+                r = await get_async_client().post(url, json=payload, timeout=self.timeout_s)
+        except httpx.HTTPError as e:
+            raise _error("generate", f"Ollama unreachable at {self.base_url} ({e})")
+
+        if r.status_code != 200:
+            raise _error("generate", f"Ollama error {r.status_code}: {r.text}")
+        return r.json()
+
+    async def generate_stream(
+        self,
+        prompt: str,
+        system: Optional[str] = None,
+        temperature: float = 0.2,
+        num_predict: int = 600,
+        model: Optional[str] = None,
+        priority: int = PRIORITY_GENERATE,
+        context: Optional[List[int]] = None,
+        final: Optional[Dict[str, Any]] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Async /api/generate in stream mode. Yields text fragments (the slot is held until the stream ends).
+        final: filled with the last line of the stream ("context", counters) when it arrives.
+        """
+        url = f"{self.base_url}/api/generate"
+        payload = self._generate_payload(prompt, system, temperature, num_predict, model, stream=True, context=context)
+
+        try:
+            async with get_scheduler().slot(priority), \
+                    get_async_client().stream("POST", url, json=payload, timeout=self.timeout_s) as r:
+                if r.status_code != 200:
+                    body = (await r.aread()).decode("utf-8", errors="replace")
+                    raise _error("generate_stream", f"Ollama error {r.status_code}: {body}")
+                async for line in r.aiter_lines():
+                    data = self._parse_stream_line(line)
+                    if data is None:
+                        continue
+                    if data.get("response"):
+                        yield data["response"]
+                    if data.get("done"):
+                        if final is not None:
+                            final.update(data)
+                        break
+        except httpx.HTTPError as e:
+            raise _error("generate_stream", f"Ollama unreachable at {self.base_url} ({e})")
+
+    async def embed(
+        self,
+        texts: List[str],
+        model: Optional[str] = None,
+        priority: int = PRIORITY_EMBED,
+    ) -> List[List[float]]:
+        """Async /api/embed with a batch of inputs."""
+        url = f"{self.base_url}/api/embed"
+        payload: Dict[str, Any] = {
+            "model": model or self.embed_model,
+            "input": texts,
+            "keep_alive": self.keep_alive,
+        }
+
+        try:
+            async with get_scheduler().slot(priority):
+                r = await get_async_client().post(url, json=payload, timeout=self.timeout_s)
+        except httpx.HTTPError as e:
+            raise _error("embed", f"Ollama unreachable at {self.base_url} ({e})")
+
+        if r.status_code != 200:
+            raise _error("embed", f"Ollama error {r.status_code}: {r.text}")
+
+        return self._embeddings(r.json(), texts)
@@ -0,0 +1,10 @@
+import os
+from pathlib import Path
+
+
+def data_lake_dir() -> Path:
+    """
+    Root of the on-disk data (KB, caches, queues).
+    backend/data_lake by default; DATA_LAKE_DIR moves it (benchmarks, test KBs).
+    """
+    return Path(os.getenv("DATA_LAKE_DIR") or Path(__file__).resolve().parents[2] / "data_lake")
@@ -0,0 +1,88 @@
+"""
+Single-flight request coalescing.
+
+Concurrent calls with the same key attach to the computation already running
+and all receive its result (or its exception): a burst of identical questions
+costs a single classify / search / scrape / generate.
+"""
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+class SingleFlight:
+    """Async coalescing; the shared task is cancelled only when every caller has gone."""
+
+    def __init__(self) -> None:
+        self._calls: Dict[Hashable, Tuple["asyncio.Task[Any]", List[int]]] = {}
+        self.counters: Dict[str, int] = {"leaders": 0, "followers": 0}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Returns (result, shared); shared=True when an in-flight computation was joined."""
+        call = self._calls.get(key)
+        shared = call is not None
+        if call is None:
+            task = asyncio.ensure_future(fn())
+            call = (task, [0])
+            self._calls[key] = call
+            task.add_done_callback(lambda _t, k=key, c=call: self._forget(k, c))
+            self.counters["leaders"] += 1
+        else:
+            self.counters["followers"] += 1
+
+        task, waiters = call
+        waiters[0] += 1
+        try:
+            # shield : l'annulation d'un appelant ne tue pas le calcul des autres
+            return await asyncio.shield(task), shared
+        except asyncio.CancelledError:
+            if not task.done() and waiters[0] == 1:
+                task.cancel()
+            raise
+        finally:
+            waiters[0] -= 1
+
+    def _forget(self, key: Hashable, call: Tuple["asyncio.Task[Any]", List[int]]) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {**self.counters, "in_flight": len(self._calls)}
+
+
+class _Call:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SyncSingleFlight:
+    """Thread-based coalescing for the sync code paths (run_tool, scripts)."""
+
+    def __init__(self) -> None:
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        else:
+            call.done.wait()
+
+        if call.error is not None:
+            raise call.error
+        return call.result, not leader
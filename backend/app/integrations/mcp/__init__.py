@@ -1,3 +1,3 @@
-from app.integrations.mcp.registry import AVAILABLE_TOOLS, run_tool
+from app.integrations.mcp.registry import AVAILABLE_TOOLS, run_tool, run_tool_async, run_tools
 
-__all__ = ["run_tool", "AVAILABLE_TOOLS"]
+__all__ = ["run_tool", "run_tool_async", "run_tools", "AVAILABLE_TOOLS"]
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.cache_dir import prune_cache_dir, remove_quietly
+from app.integrations.mcp.schemas import ArxivMetadataItem, ArxivMetadataParams
+from app.services.scrape_service import _build_arxiv_query_url, _clean, _raw_cache_dir
+
+# TTL par mode de tri : les résultats "submitted_date" vieillissent plus vite
+_DEFAULT_TTL_S = {
+    "relevance": float(os.getenv("ARXIV_CACHE_TTL_RELEVANCE_S", 24 * 3600)),
+    "submitted_date": float(os.getenv("ARXIV_CACHE_TTL_SUBMITTED_S", 3600)),
+}
+# Le dossier est élagué (expirés, puis plus anciens au-delà de max_files) au
+# premier accès puis tous les _PRUNE_EVERY écritures
+_PRUNE_EVERY = 64
+
+
+class ArxivResultCache:
+    """
+    Two-tier cache for arxiv_metadata results: bounded in-memory LRU of the
+    typed items (served again without copying), then one JSON file per key
+    under data_lake/raw/cache/arxiv_cache (survives restarts). The disk tier
+    is bounded: an expired file is deleted when read, at most max_files files.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        ttl_s: Optional[Dict[str, float]] = None,
+        disk_dir: Optional[Path] = None,
+        max_files: int = 10000,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl_s = dict(ttl_s or _DEFAULT_TTL_S)
+        self.max_files = max_files
+        self._disk_dir = disk_dir
+        self._pruned = False
+        self._stores_since_prune = 0
+        self._mem: "OrderedDict[str, Tuple[float, List[ArxivMetadataItem]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "expired": 0, "stores": 0, "pruned": 0}
+
+    def _dir(self) -> Path:
+        if self._disk_dir is None:
+            self._disk_dir = _raw_cache_dir() / "arxiv_cache"
+        self._disk_dir.mkdir(parents=True, exist_ok=True)
+        if not self._pruned:
+            self._pruned = True
+            self._prune()
+        return self._disk_dir
+
+    def _prune(self) -> None:
+        # Âge maximal = TTL le plus long : un fichier plus vieux n'est plus servi quel que soit le tri
+        removed = prune_cache_dir(self._disk_dir, self.max_files, max(self.ttl_s.values()))
+        with self._lock:
+            self.counters["pruned"] += removed
+
+    @staticmethod
+    def key(params: ArxivMetadataParams) -> str:
+        """Hash of the normalized arXiv URL: same (query, theme, max_results, sort) => same key."""
+        sort = "relevance" if params.sort == "relevance" else "submitted_date"
+        url = _build_arxiv_query_url(_clean(params.query).lower(), params.theme, params.max_results, sort)
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def _ttl(self, params: ArxivMetadataParams) -> float:
+        sort = "relevance" if params.sort == "relevance" else "submitted_date"
+        return self.ttl_s[sort]
+
+    def get(self, params: ArxivMetadataParams) -> Optional[List[ArxivMetadataItem]]:
+        key = self.key(params)
+        ttl = self._ttl(params)
+        now = time.time()
+
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is not None:
+                if now - entry[0] <= ttl:
+                    self._mem.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return entry[1]
+                del self._mem[key]
+                self.counters["expired"] += 1
+
+        path = self._dir() / f"{key}.json"
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            data = None
+        if data is not None and now - data["stored_at"] <= ttl:
+            items = [ArxivMetadataItem(**it) for it in data["items"]]
+            self._remember(key, data["stored_at"], items)
+            with self._lock:
+                self.counters["disk_hits"] += 1
+            return items
+
+        if data is not None:
+            remove_quietly(path)
+        with self._lock:
+            if data is not None:
+                self.counters["expired"] += 1
+            self.counters["misses"] += 1
+        return None
+
+    def put(self, params: ArxivMetadataParams, items: List[ArxivMetadataItem]) -> None:
+        key = self.key(params)
+        stored_at = time.time()
+        self._remember(key, stored_at, items)
+
+        path = self._dir() / f"{key}.json"
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"stored_at": stored_at, "items": [it.dict() for it in items]}, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)
+        with self._lock:
+            self.counters["stores"] += 1
+            self._stores_since_prune += 1
+            prune = self._stores_since_prune >= _PRUNE_EVERY
+            if prune:
+                self._stores_since_prune = 0
+        if prune:
+            self._prune()
+
+    def _remember(self, key: str, stored_at: float, items: List[ArxivMetadataItem]) -> None:
+        with self._lock:
+            self._mem[key] = (stored_at, items)
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_entries:
+                self._mem.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.counters, "memory_entries": len(self._mem)}
+
+
+arxiv_cache = ArxivResultCache(
+    max_entries=int(os.getenv("ARXIV_CACHE_MAX_ENTRIES", 256)),
+    max_files=int(os.getenv("ARXIV_CACHE_MAX_FILES", 10000)),
+)
@@ -1,14 +1,46 @@
+import asyncio
+import json
+import os
+import time
 from datetime import datetime, timezone
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional
 
+from app.core import metrics
+from app.core.singleflight import SingleFlight, SyncSingleFlight
 from app.integrations.mcp.schemas import ArxivMetadataParams, SendEmailParams, ToolResponse
-from app.integrations.mcp.tools import get_arxiv_metadata, send_email
+from app.integrations.mcp.tools import get_arxiv_metadata, get_arxiv_metadata_async, send_email
 
 AVAILABLE_TOOLS = {
     "arxiv_metadata": get_arxiv_metadata,
     "send_email": send_email,
 }
 
+# Implémentations natives async ; les autres tools tournent dans un thread
+ASYNC_TOOLS = {
+    "arxiv_metadata": get_arxiv_metadata_async,
+}
+
+# Tools sans effet de bord : les appels identiques en vol sont fusionnés
+# (jamais send_email, chaque appel doit partir)
+COALESCED_TOOLS = {"arxiv_metadata"}
+
+_flights = SingleFlight()
+_sync_flights = SyncSingleFlight()
+
+# Appels simultanés et deadline par tool (run_tool_async / run_tools)
+TOOL_LIMITS = {
+    "arxiv_metadata": {
+        "concurrency": int(os.getenv("TOOL_ARXIV_CONCURRENCY", "4")),
+        "timeout_s": float(os.getenv("TOOL_ARXIV_TIMEOUT_S", "15")),
+    },
+    "send_email": {
+        "concurrency": int(os.getenv("TOOL_EMAIL_CONCURRENCY", "2")),
+        "timeout_s": float(os.getenv("TOOL_EMAIL_TIMEOUT_S", "30")),
+    },
+}
+
+_semaphores: Dict[str, asyncio.Semaphore] = {}
+
 _PARAM_SCHEMAS = {
     "arxiv_metadata": ArxivMetadataParams,
     "send_email": SendEmailParams,
@@ -28,4 +60,93 @@ def run_tool(name: str, params: Dict[str, Any]) -> ToolResponse:
     except Exception as e:
         return ToolResponse(tool=name, ok=False, items=[], scraped_at=scraped_at, errors=[f"invalid params: {e}"])
 
-    return AVAILABLE_TOOLS[name](validated_params)
+    with metrics.timed("tool_latency_ms", tool=name):
+        if name in COALESCED_TOOLS:
+            result, _ = _sync_flights.do(_flight_key(name, validated_params), lambda: AVAILABLE_TOOLS[name](validated_params))
+        else:
+            result = AVAILABLE_TOOLS[name](validated_params)
+    metrics.counter("tool_calls_total", tool=name, outcome="ok" if result.ok else "error").inc()
+    return result
+
+
+def _flight_key(name: str, validated_params: Any) -> str:
+    return name + ":" + json.dumps(validated_params.dict(), sort_keys=True, default=str)
+
+
+async def _call_tool(name: str, validated_params: Any) -> ToolResponse:
+    # Le sémaphore borne les appels réels ; les appels fusionnés n'en prennent pas
+    async with _semaphore(name):
+        if name in ASYNC_TOOLS:
+            return await ASYNC_TOOLS[name](validated_params)
+        return await asyncio.to_thread(AVAILABLE_TOOLS[name], validated_params)
+
+
+def _semaphore(name: str) -> asyncio.Semaphore:
+    sem = _semaphores.get(name)
+    if sem is None:
+        sem = _semaphores[name] = asyncio.Semaphore(TOOL_LIMITS[name]["concurrency"])
+    return sem
+
+
+async def _execute(name: str, validated_params: Any, timeout_s: float, scraped_at: str) -> ToolResponse:
+    t0 = time.perf_counter()
+    outcome = "ok"
+    try:
+        if name in COALESCED_TOOLS:
+            call = _flights.do(_flight_key(name, validated_params), lambda: _call_tool(name, validated_params))
+            result, _ = await asyncio.wait_for(call, timeout_s)
+        else:
+            result = await asyncio.wait_for(_call_tool(name, validated_params), timeout_s)
+        if not result.ok:
+            outcome = "error"
+        return result
+    except asyncio.TimeoutError:
+        # Les tools en thread (to_thread) finissent en arrière-plan, sans bloquer l'appelant
+        outcome = "timeout"
+        return ToolResponse(tool=name, ok=False, items=[], scraped_at=scraped_at, errors=[f"timeout after {timeout_s}s"])
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    except Exception as e:
+        outcome = "error"
+        return ToolResponse(tool=name, ok=False, items=[], scraped_at=scraped_at, errors=[str(e)])
+    finally:
+        metrics.histogram("tool_latency_ms", tool=name).observe((time.perf_counter() - t0) * 1000)
+        metrics.counter("tool_calls_total", tool=name, outcome=outcome).inc()
+
+
+async def run_tool_async(name: str, params: Dict[str, Any], timeout_s: Optional[float] = None) -> ToolResponse:
+    """
+    Async run_tool : sémaphore par tool, deadline (timeout_s, défaut TOOL_LIMITS),
+    annulation propagée. N'occupe pas de worker du threadpool pendant les I/O des tools async.
+    """
+    scraped_at = datetime.now(timezone.utc).isoformat()
+
+    if name not in AVAILABLE_TOOLS:
+        return ToolResponse(tool=name, ok=False, items=[], scraped_at=scraped_at, errors=[f"unknown tool: {name}"])
+
+    schema = _PARAM_SCHEMAS[name]
+    try:
+        validated_params = schema(**params)
+    except Exception as e:
+        return ToolResponse(tool=name, ok=False, items=[], scraped_at=scraped_at, errors=[f"invalid params: {e}"])
+
+    if timeout_s is None:
+        timeout_s = TOOL_LIMITS[name]["timeout_s"]
+    return await _execute(name, validated_params, timeout_s, scraped_at)
+
+
+async def run_tools(calls: List[Dict[str, Any]], timeout_s: Optional[float] = None) -> List[ToolResponse]:
+    """
+    Exécute des appels de tools indépendants en parallèle ; un ToolResponse par appel, dans l'ordre.
+    calls : [{"name": "arxiv_metadata", "params": {...}}, ...]
+    La latence du lot suit l'appel le plus lent, pas la somme des appels.
+    """
+    return list(await asyncio.gather(*(
+        run_tool_async(call["name"], call.get("params", {}), timeout_s=timeout_s)
+        for call in calls
+    )))
+
+
+def tool_stats() -> Dict[str, Dict[str, float]]:
+    return metrics.snapshot("tool_latency_ms")
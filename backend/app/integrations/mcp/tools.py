@@ -1,16 +1,23 @@
+import asyncio
 import json
 from datetime import datetime, timezone
-from pathlib import Path
+from typing import Any, Dict
 
-from app.integrations.mcp.schemas import ArxivMetadataItem, ArxivMetadataParams, SendEmailParams, ToolResponse
+from app.core.paths import data_lake_dir
+from app.integrations.mcp.cache import arxiv_cache
+from app.integrations.mcp.schemas import ArxivMetadataParams, SendEmailParams, ToolResponse
 from app.services.email_service import send_email_smtp
-from app.services.scrape_service import scrape_arxiv
+from app.services.scrape_service import scrape_arxiv, scrape_arxiv_async
 
 
 def get_arxiv_metadata(params: ArxivMetadataParams) -> ToolResponse:
     """Tool Niveau 1 - métadonnées arXiv. Wrappe scrape_service."""
     scraped_at = datetime.now(timezone.utc).isoformat()
 
+    cached = arxiv_cache.get(params)
+    if cached is not None:
+        return ToolResponse(tool="arxiv_metadata", ok=True, items=cached, scraped_at=scraped_at, errors=[])
+
     try:
         result = scrape_arxiv(
             query=params.query,
@@ -21,6 +28,31 @@ def get_arxiv_metadata(params: ArxivMetadataParams) -> ToolResponse:
     except Exception as e:
         return ToolResponse(tool="arxiv_metadata", ok=False, items=[], scraped_at=scraped_at, errors=[str(e)])
 
+    return _arxiv_tool_response(params, result, scraped_at)
+
+
+async def get_arxiv_metadata_async(params: ArxivMetadataParams) -> ToolResponse:
+    """Variante async de get_arxiv_metadata (pool HTTP partagé, I/O disque en thread)."""
+    scraped_at = datetime.now(timezone.utc).isoformat()
+
+    cached = await asyncio.to_thread(arxiv_cache.get, params)
+    if cached is not None:
+        return ToolResponse(tool="arxiv_metadata", ok=True, items=cached, scraped_at=scraped_at, errors=[])
+
+    try:
+        result = await scrape_arxiv_async(
+            query=params.query,
+            theme=params.theme,
+            max_results=params.max_results,
+            sort=params.sort,
+        )
+    except Exception as e:
+        return ToolResponse(tool="arxiv_metadata", ok=False, items=[], scraped_at=scraped_at, errors=[str(e)])
+
+    return await asyncio.to_thread(_arxiv_tool_response, params, result, scraped_at)
+
+
+def _arxiv_tool_response(params: ArxivMetadataParams, result: Dict[str, Any], scraped_at: str) -> ToolResponse:
     if not result.get("ok", False):
         return ToolResponse(
             tool="arxiv_metadata",
@@ -30,19 +62,9 @@ def get_arxiv_metadata(params: ArxivMetadataParams) -> ToolResponse:
             errors=result.get("errors", ["unknown error"]),
         )
 
-    items = [
-        ArxivMetadataItem(
-            arxiv_id=it.get("arxiv_id", ""),
-            title=it.get("title", ""),
-            authors=it.get("authors", []),
-            abstract=it.get("abstract", ""),
-            submitted_date=it.get("submitted_date", ""),
-            categories=[],
-            abs_url=it.get("abs_url", ""),
-            pdf_url=it.get("pdf_url", ""),
-        )
-        for it in result.get("items", [])
-    ]
+    # scrape_arxiv renvoie déjà des ArxivMetadataItem (parser Atom incrémental)
+    items = result.get("items", [])
+    arxiv_cache.put(params, items)
 
     return ToolResponse(tool="arxiv_metadata", ok=True, items=items, scraped_at=scraped_at, errors=[])
 
@@ -60,8 +82,7 @@ def build_email_html_body(conversation_history):
 
 def save_conversation_copy(conversation_history):
     # Sauvegarde une copie JSON de l'historique avant l'envoi de l'email
-    backend_dir = Path(__file__).resolve().parents[3]
-    folder = backend_dir / "data_lake" / "raw" / "conversation_history"
+    folder = data_lake_dir() / "raw" / "conversation_history"
     folder.mkdir(parents=True, exist_ok=True)
 
     now = datetime.now()
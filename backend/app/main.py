@@ -1,21 +1,70 @@
-from fastapi import FastAPI
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 
+from app.core import http_pool, metrics
+
+# Origines du front (CORS + Timing-Allow-Origin)
+_FRONT_ORIGINS = ["http://localhost:5173"]
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pools de connexions keep-alive partagés (Ollama, arXiv) pour tout le process
+    await http_pool.startup()
+    # Worker de la file d'emails (reprend les jobs en attente d'un run précédent)
+    from app.services.email_queue import email_queue
+    email_queue.start()
+    # Warm-up (index KB, modèles) en fond : /api/health reste à 503 jusqu'à la fin
+    from app.services.warmup_service import warm_up
+    warmup_task = asyncio.create_task(warm_up())
+    # Téléchargement / indexation des PDF des papiers scrapés (si PDF_INGEST=1)
+    from app.services.pdf_service import pdf_pipeline
+    pdf_pipeline.start()
+    yield
+    warmup_task.cancel()
+    await pdf_pipeline.stop()
+    await asyncio.to_thread(email_queue.stop)
+    await http_pool.shutdown()
+    # Vide la file du writer de log raw avant de quitter
+    from app.services.raw_log import raw_log
+    await asyncio.to_thread(raw_log.close)
+
+
 def create_app() -> FastAPI:
     app = FastAPI(
         title="DIXITBOT API",
         version="0.1.0",
         description="Backend for DIXITBOT (scraping, KB, MCP, QA via Ollama).",
+        lifespan=lifespan,
     )
 
     # CORS (DEV) — en prod, remplace par le domaine front réel
     app.add_middleware(
         CORSMiddleware,
-        allow_origins=["http://localhost:5173"],
+        allow_origins=_FRONT_ORIGINS,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["Server-Timing"],
     )
 
+    @app.middleware("http")
+    async def server_timing(request: Request, call_next):
+        # Détail par étape (metrics.timed / observe) renvoyé en Server-Timing, visible dans les devtools
+        timings = metrics.begin_request()
+        t0 = time.perf_counter()
+        response = await call_next(request)
+        total_ms = (time.perf_counter() - t0) * 1000
+
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        metrics.histogram("http_request_latency_ms", route=route, method=request.method).observe(total_ms)
+        response.headers["Server-Timing"] = metrics.server_timing(timings + [("total", total_ms)])
+        response.headers["Timing-Allow-Origin"] = " ".join(_FRONT_ORIGINS)
+        return response
+
     # Import des routers ici (évite certains soucis d'import circulaire)
     try:
         from app.api.routes.health import router as health_router
@@ -41,6 +90,12 @@ def create_app() -> FastAPI:
     except ImportError:
         pass
 
+    try:
+        from app.api.routes.metrics import router as metrics_router
+        app.include_router(metrics_router, prefix="/api", tags=["metrics"])
+    except ImportError:
+        pass
+
     # plus tard si tu ajoutes :
     # from app.api.routes.mcp import router as mcp_router
     # from app.api.routes.analytics import router as analytics_router
@@ -0,0 +1,87 @@
+"""
+Production entry point: N uvicorn workers, KB index prepared once.
+
+    cd backend
+    python -m app.serve --workers 4 --host 0.0.0.0 --port 51234
+
+Before starting the workers, the parent process:
+  - converts kb.json into mmap segments if needed (kb_store);
+  - builds the BM25 index and writes it as a snapshot (data_lake/kb_bm25/);
+  - computes the MinHash sketches used for near-duplicate detection (data_lake/kb_minhash/).
+Each worker then opens the segments, snapshot and vectors as read-only mmaps:
+pages are shared through the OS cache instead of being copied N times, and no
+worker re-tokenizes the KB. The warm-up (index, Ollama models with keep_alive)
+runs when each worker starts; /api/health answers 503 until it is done.
+`python -m app.main` remains the dev mode (one process, reload).
+
+Each worker also does its own writes, which are safe across processes: KB
+segment appends, the MANIFEST and the vectors go through file locks (fcntl,
+app.core.file_lock), the raw log writes its batches under a lock, and the
+email queue claims each job with a pending/ -> inflight/ rename before sending
+it. Without fcntl (Windows), run a single worker.
+
+Conversation sessions (session_store) live in each worker's memory: with more
+than one worker, route a session to the same worker every time (sticky
+routing on session_id) or run --workers 1.
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import time
+from typing import Any, Dict
+
+import uvicorn
+
+from app.services.dedup_service import get_dedup_index
+from app.services.kb_index import save_kb_snapshot
+from app.services.kb_service import _kb_path
+from app.services.kb_store import convert_kb_json, segment_paths
+
+logger = logging.getLogger(__name__)
+
+
+def preload() -> Dict[str, Any]:
+    """Prepares the shared, read-only KB files before the workers start."""
+    kb_file = _kb_path()
+    t0 = time.perf_counter()
+    if not segment_paths(kb_file):
+        if not kb_file.exists():
+            logger.warning("no KB found, workers start with an empty KB")
+            return {"ok": False, "errors": ["KB_FILE_NOT_FOUND"]}
+        convert_kb_json(kb_file)
+    result = save_kb_snapshot(kb_file)
+    if os.getenv("DEDUP", "1") != "0":
+        # Sketches MinHash (data_lake/kb_minhash/) : la première ingestion ne les calcule pas pendant une requête
+        get_dedup_index(kb_file)
+    logger.info(f"KB preloaded in {time.perf_counter() - t0:.1f}s: {result}")
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the DIXITBOT API with several workers.")
+    parser.add_argument("--host", default=os.getenv("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "51234")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)))
+    parser.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "info"))
+    parser.add_argument("--no-preload", action="store_true", help="ne prépare pas le snapshot de l'index KB")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level.upper())
+    if not args.no_preload:
+        preload()
+
+    uvicorn.run(
+        "app.main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        log_level=args.log_level,
+        # Connexions keep-alive du front / du reverse proxy
+        timeout_keep_alive=30,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.cache_dir import prune_cache_dir, remove_quietly
+from app.integrations.mcp.schemas import ArxivMetadataItem
+from app.services.intent_classifier import normalize_question
+from app.services.scrape_service import _raw_cache_dir
+
+# Cache des réponses finales de /api/ask. La clé couvre le contexte récupéré
+# (id, score, empreinte du texte de chaque item KB / arXiv) : si un item
+# derrière une réponse change, la clé change et l'ancienne entrée n'est plus
+# servie (elle sort ensuite par LRU / TTL). Une reconstruction de la KB n'a donc
+# pas besoin de vider le cache. Sur disque : fichier expiré supprimé à la lecture,
+# dossier élagué au premier accès puis toutes les _PRUNE_EVERY écritures.
+
+_PRUNE_EVERY = 64
+
+
+def _digest(text: str) -> str:
+    return hashlib.blake2b((text or "").encode("utf-8"), digest_size=8).hexdigest()
+
+
+def context_fingerprint(
+    kb_results: List[Dict[str, Any]],
+    arxiv_items: List[ArxivMetadataItem],
+) -> List[Tuple[str, str, float, str]]:
+    fingerprint = [
+        ("kb", str(r.get("id", "")), round(float(r.get("score") or 0.0), 4), _digest(r.get("text", "")))
+        for r in kb_results
+    ]
+    fingerprint += [
+        ("arxiv", it.arxiv_id, 0.0, _digest(f"{it.title}\n{it.abstract}"))
+        for it in arxiv_items
+    ]
+    return fingerprint
+
+
+class AnswerCache:
+    """
+    Two-tier answer cache: bounded in-memory LRU, then (optionally) one JSON
+    file per key under data_lake/raw/cache/answer_cache, at most max_files files.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 512,
+        ttl_s: float = 7 * 24 * 3600,
+        disk: bool = True,
+        disk_dir: Optional[Path] = None,
+        max_files: int = 20000,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl_s = float(ttl_s)
+        self.disk = disk
+        self.max_files = max_files
+        self._disk_dir = disk_dir
+        self._pruned = False
+        self._stores_since_prune = 0
+        self._mem: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "expired": 0, "stores": 0, "pruned": 0}
+
+    def _dir(self) -> Path:
+        if self._disk_dir is None:
+            self._disk_dir = _raw_cache_dir() / "answer_cache"
+        self._disk_dir.mkdir(parents=True, exist_ok=True)
+        if not self._pruned:
+            self._pruned = True
+            self._prune()
+        return self._disk_dir
+
+    def _prune(self) -> None:
+        removed = prune_cache_dir(self._disk_dir, self.max_files, self.ttl_s)
+        with self._lock:
+            self.counters["pruned"] += removed
+
+    @staticmethod
+    def key(
+        question: str,
+        kb_results: List[Dict[str, Any]],
+        arxiv_items: List[ArxivMetadataItem],
+        model: str,
+        options: Dict[str, Any],
+    ) -> str:
+        payload = {
+            "question": normalize_question(question),
+            "context": context_fingerprint(kb_results, arxiv_items),
+            "model": model,
+            "options": options,
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is not None and now - entry[0] <= self.ttl_s:
+                self._mem.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return entry[1]
+            if entry is not None:
+                del self._mem[key]
+
+        data = None
+        if self.disk:
+            path = self._dir() / f"{key}.json"
+            try:
+                data = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                data = None
+        if data is not None and now - data["stored_at"] <= self.ttl_s:
+            self._remember(key, data["stored_at"], data["answer"])
+            with self._lock:
+                self.counters["disk_hits"] += 1
+            return data["answer"]
+
+        if data is not None:
+            remove_quietly(path)
+        with self._lock:
+            if data is not None:
+                self.counters["expired"] += 1
+            self.counters["misses"] += 1
+        return None
+
+    def put(self, key: str, answer: str) -> None:
+        if not answer:
+            return  # une génération vide n'est pas une réponse à resservir
+        stored_at = time.time()
+        self._remember(key, stored_at, answer)
+
+        if self.disk:
+            path = self._dir() / f"{key}.json"
+            tmp = path.with_suffix(".tmp")
+            tmp.write_text(
+                json.dumps({"stored_at": stored_at, "answer": answer}, ensure_ascii=False),
+                encoding="utf-8",
+            )
+            os.replace(tmp, path)
+        with self._lock:
+            self.counters["stores"] += 1
+            self._stores_since_prune += 1
+            prune = self.disk and self._stores_since_prune >= _PRUNE_EVERY
+            if prune:
+                self._stores_since_prune = 0
+        if prune:
+            self._prune()
+
+    def _remember(self, key: str, stored_at: float, answer: str) -> None:
+        with self._lock:
+            self._mem[key] = (stored_at, answer)
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.max_entries:
+                self._mem.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.counters, "memory_entries": len(self._mem)}
+
+
+answer_cache = AnswerCache(
+    max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 512)),
+    ttl_s=float(os.getenv("ANSWER_CACHE_TTL_S", 7 * 24 * 3600)),
+    disk=os.getenv("ANSWER_CACHE_DISK", "1") != "0",
+    max_files=int(os.getenv("ANSWER_CACHE_MAX_FILES", 20000)),
+)
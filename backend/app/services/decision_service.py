@@ -1,4 +1,21 @@
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Tuple
+
+from app.core.llm_scheduler import PRIORITY_CLASSIFY
+from app.services.intent_classifier import classify_local, verdict_cache
+
+
+_INTENT_SYSTEM_PROMPT = (
+    "Classify the user's question as exactly one of: social, metier. "
+    "Reply with a single word: social or metier."
+    "\n\nExamples:"
+    "\nUser: Bonjour -> social"
+    "\nUser: Salut, merci ! -> social"
+    "\nUser: Articles sur les transformers -> metier"
+    "\nUser: Qu'est-ce que le deep learning ? -> metier"
+)
+
+# Un seul mot attendu : quelques tokens suffisent (pas de raisonnement)
+_INTENT_NUM_PREDICT = 4
 
 
 def should_scrape_arxiv(kb_results: List[Dict[str, Any]], min_relevant_count: int = 2) -> bool:
@@ -6,20 +23,60 @@ def should_scrape_arxiv(kb_results: List[Dict[str, Any]], min_relevant_count: in
     return len(kb_results) < min_relevant_count
 
 
-def classify_intent(client, question: str) -> str:
-    system_prompt = (
-        "Classify the user's question as exactly one of: social, metier. "
-        "Reply with a single word: social or metier."
-        "\n\nExamples:"
-        "\nUser: Bonjour -> social"
-        "\nUser: Salut, merci ! -> social"
-        "\nUser: Articles sur les transformers -> metier"
-        "\nUser: Qu'est-ce que le deep learning ? -> metier"
-    )
-    response = client.generate(
-        question,
-        system=system_prompt,
-        temperature=0.0,
-        num_predict=200,
-    )
+def _parse_intent(response: str) -> str:
     return "social" if "social" in response.lower() else "metier"
+
+
+def classify_intent_with_tier(client, question: str) -> Tuple[str, str]:
+    """
+    (intent, tier) where tier says who decided: cache, lexicon, model
+    (local classifier) or llm. The LLM is only called for uncertain cases.
+    """
+    cached = verdict_cache.get(question)
+    if cached is not None:
+        return cached, "cache"
+
+    local = classify_local(question)
+    if local is None:
+        response = client.generate(
+            question,
+            system=_INTENT_SYSTEM_PROMPT,
+            temperature=0.0,
+            num_predict=_INTENT_NUM_PREDICT,
+            think=False,
+        )
+        local = (_parse_intent(response), "llm")
+
+    verdict_cache.put(question, *local)
+    return local
+
+
+async def classify_intent_with_tier_async(client, question: str) -> Tuple[str, str]:
+    """classify_intent_with_tier with an AsyncOllamaClient."""
+    cached = verdict_cache.get(question)
+    if cached is not None:
+        return cached, "cache"
+
+    local = classify_local(question)
+    if local is None:
+        response = await client.generate(
+            question,
+            system=_INTENT_SYSTEM_PROMPT,
+            temperature=0.0,
+            num_predict=_INTENT_NUM_PREDICT,
+            think=False,
+            priority=PRIORITY_CLASSIFY,
+        )
+        local = (_parse_intent(response), "llm")
+
+    verdict_cache.put(question, *local)
+    return local
+
+
+def classify_intent(client, question: str) -> str:
+    return classify_intent_with_tier(client, question)[0]
+
+
+async def classify_intent_async(client, question: str) -> str:
+    """classify_intent with an AsyncOllamaClient."""
+    return (await classify_intent_with_tier_async(client, question))[0]
@@ -0,0 +1,306 @@
+"""
+Near-duplicate detection for the KB: MinHash signatures + LSH banding.
+
+Each paper (title + abstract) is reduced to the set of its word 3-grams, then
+to a MinHash signature of NUM_PERM integers, computed with NumPy for a whole
+batch of items at once. The signature is cut into BANDS bands of ROWS rows;
+two papers sharing an identical band are candidates (likely above ~0.7
+Jaccard, unlikely below), then confirmed when the estimated similarity
+exceeds DEDUP_THRESHOLD.
+
+Sketches are written per KB segment under data_lake/kb_minhash/<segment>/
+(.npy files opened as mmaps): a lookup is one binary search per band and per
+segment, without scanning the KB. A segment without a sketch (converted KB,
+compaction) is sketched by the first ingestion that needs it.
+
+    cd backend
+    python -m app.services.dedup_service        # sketches the whole KB + counts near-duplicate pairs
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.services.kb_index import tokenize
+from app.services.kb_store import (
+    KBStore,
+    Segment,
+    Signature,
+    kb_signature,
+    open_kb,
+    split_passage_id,
+    write_lock,
+)
+
+logger = logging.getLogger(__name__)
+
+NUM_PERM = 128
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE = 3
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.85"))
+SKETCH_DIRNAME = "kb_minhash"
+# Items par bloc de calcul : la matrice (NUM_PERM, shingles du bloc) reste petite
+_CHUNK = 512
+_MAX_VERSION = 9
+
+_rng = np.random.default_rng(20240101)
+# Famille multiply-shift : h(x) = ((a*x + b) mod 2^64) >> 32, a impair
+_PERM_A = _rng.integers(1, 2 ** 63, NUM_PERM, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+_PERM_B = _rng.integers(0, 2 ** 63, NUM_PERM, dtype=np.uint64)
+_SHINGLE_MIX = _rng.integers(1, 2 ** 31, SHINGLE, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+_BAND_MIX = _rng.integers(1, 2 ** 63, ROWS, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+_ARXIV_VERSION_RE = re.compile(r"^(.+?)v(\d+)$")
+
+
+def item_text(item: Dict[str, Any]) -> str:
+    return f"{item.get('title') or ''} {item.get('abstract') or ''}"
+
+
+def _shingles(text: str) -> np.ndarray:
+    """uint64 hashes of the word 3-grams (single words for a very short text)."""
+    tokens = np.fromiter((zlib.crc32(t.encode("utf-8")) for t in tokenize(text)), dtype=np.uint64)
+    if tokens.size < SHINGLE:
+        return np.unique(tokens)
+    n = tokens.size - SHINGLE + 1
+    grams = sum(tokens[i:i + n] * _SHINGLE_MIX[i] for i in range(SHINGLE))
+    return np.unique(grams & np.uint64(0xFFFFFFFF))
+
+
+def minhash_signatures(texts: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    MinHash signatures (n, NUM_PERM) uint32 of `texts`, plus a mask of the
+    texts that have at least one shingle (the others never count as duplicates).
+    """
+    sigs = np.zeros((len(texts), NUM_PERM), dtype=np.uint32)
+    valid = np.zeros(len(texts), dtype=bool)
+    for start in range(0, len(texts), _CHUNK):
+        shingles = [_shingles(t) for t in texts[start:start + _CHUNK]]
+        rows = [i for i, s in enumerate(shingles) if s.size]
+        if not rows:
+            continue
+        flat = np.concatenate([shingles[i] for i in rows])
+        offsets = np.cumsum([0] + [shingles[i].size for i in rows[:-1]])
+        # (NUM_PERM, shingles) puis minimum par item, en un seul reduceat
+        hashed = (np.multiply.outer(_PERM_A, flat) + _PERM_B[:, None]) >> np.uint64(32)
+        mins = np.minimum.reduceat(hashed, offsets, axis=1)
+        idx = start + np.asarray(rows)
+        sigs[idx] = mins.T.astype(np.uint32)
+        valid[idx] = True
+    return sigs, valid
+
+
+def band_keys(sigs: np.ndarray) -> np.ndarray:
+    """One uint64 key per LSH band: (n, BANDS)."""
+    bands = sigs.astype(np.uint64).reshape(len(sigs), BANDS, ROWS)
+    # Somme modulo 2^64 (débordement voulu) de lignes pondérées
+    return (bands * _BAND_MIX).sum(axis=2, dtype=np.uint64)
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Estimated Jaccard similarity between signatures (fraction of equal minimums)."""
+    return (a == b).mean(axis=-1)
+
+
+class _Sketch:
+    """MinHash sketch of one KB segment: signatures + band keys sorted per band."""
+
+    def __init__(self, docs: np.ndarray, sigs: np.ndarray, sorted_keys: np.ndarray, order: np.ndarray) -> None:
+        self.docs = docs                  # docs locaux esquissés (hors passages, textes vides)
+        self.sigs = sigs                  # (len(docs), NUM_PERM)
+        self.sorted_keys = sorted_keys    # (BANDS, len(docs)), chaque bande triée
+        self.order = order                # (BANDS, len(docs)), position dans docs
+
+    @classmethod
+    def build(cls, docs: np.ndarray, sigs: np.ndarray) -> "_Sketch":
+        keys = band_keys(sigs).T
+        order = np.argsort(keys, axis=1, kind="stable").astype(np.uint32)
+        return cls(docs, sigs, np.take_along_axis(keys, order.astype(np.int64), axis=1), order)
+
+    @classmethod
+    def load(cls, d: Path) -> "_Sketch":
+        arrays = {name: np.load(d / f"{name}.npy", mmap_mode="r") for name in ("docs", "sigs", "sorted_keys", "order")}
+        return cls(**arrays)
+
+    def save(self, d: Path) -> None:
+        tmp = d.with_name(d.name + ".tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        for name in ("docs", "sigs", "sorted_keys", "order"):
+            np.save(tmp / f"{name}.npy", np.ascontiguousarray(getattr(self, name)))
+        shutil.rmtree(d, ignore_errors=True)
+        os.replace(tmp, d)
+
+    def candidates(self, keys: np.ndarray) -> List[np.ndarray]:
+        """For each query row of `keys` (n, BANDS): positions in docs sharing at least one band."""
+        found: List[List[np.ndarray]] = [[] for _ in range(len(keys))]
+        for band in range(BANDS):
+            column = self.sorted_keys[band]
+            lo = np.searchsorted(column, keys[:, band], side="left")
+            hi = np.searchsorted(column, keys[:, band], side="right")
+            for i in np.flatnonzero(hi > lo).tolist():
+                found[i].append(np.asarray(self.order[band, lo[i]:hi[i]], dtype=np.int64))
+        return [np.unique(np.concatenate(f)) if f else np.zeros(0, dtype=np.int64) for f in found]
+
+
+def sketch_dir(kb_file: Path) -> Path:
+    return kb_file.parent / SKETCH_DIRNAME
+
+
+def sketch_segment(segment: Segment) -> _Sketch:
+    docs = [
+        doc for doc in range(len(segment))
+        if split_passage_id(segment.get_field(doc, "id"))[1] is None
+    ]
+    texts = [f"{segment.get_field(doc, 'title')} {segment.get_field(doc, 'abstract')}" for doc in docs]
+    sigs, valid = minhash_signatures(texts)
+    return _Sketch.build(np.asarray(docs, dtype=np.int64)[valid], sigs[valid])
+
+
+def save_items_sketch(kb_file: Path, segment_path: Path, sigs: np.ndarray, valid: np.ndarray) -> None:
+    """Sketch of a segment just written from items whose signatures are already known."""
+    docs = np.flatnonzero(valid).astype(np.int64)
+    _Sketch.build(docs, sigs[valid]).save(sketch_dir(kb_file) / segment_path.stem)
+
+
+class DedupIndex:
+    """LSH index over the sketches of every KB segment, in doc order."""
+
+    def __init__(self, kb_file: Path, store: KBStore, signature: Signature) -> None:
+        self.store = store
+        self.signature = signature
+        self.sketches: List[Tuple[int, _Sketch]] = []
+        base = 0
+        root = sketch_dir(kb_file)
+        for seg in store.segments:
+            d = root / seg.path.stem
+            try:
+                sketch = _Sketch.load(d)
+            except (OSError, ValueError):
+                t0 = time.perf_counter()
+                sketch = sketch_segment(seg)
+                sketch.save(d)
+                logger.info(f"MinHash sketch of {seg.path.name} ({len(seg)} docs) in {time.perf_counter() - t0:.1f}s")
+                sketch = _Sketch.load(d)
+            self.sketches.append((base, sketch))
+            base += len(seg)
+        # Sketches de segments retirés par une compaction
+        active = {seg.path.stem for seg in store.segments}
+        if root.is_dir():
+            for d in root.iterdir():
+                if d.is_dir() and d.name not in active:
+                    shutil.rmtree(d, ignore_errors=True)
+
+    def find(
+        self,
+        sigs: np.ndarray,
+        threshold: float = DEDUP_THRESHOLD,
+        exclude: Optional[np.ndarray] = None,
+    ) -> List[Optional[Tuple[int, float]]]:
+        """
+        (global doc, similarity) of the closest KB item above `threshold`, per
+        signature, else None. exclude: doc to ignore for each signature (the doc itself).
+        """
+        best: List[Optional[Tuple[int, float]]] = [None] * len(sigs)
+        if len(sigs) == 0:
+            return best
+        keys = band_keys(sigs)
+        for base, sketch in self.sketches:
+            for i, cand in enumerate(sketch.candidates(keys)):
+                if cand.size == 0:
+                    continue
+                docs = base + np.asarray(sketch.docs[cand], dtype=np.int64)
+                sims = similarity(np.asarray(sketch.sigs[cand]), sigs[i])
+                if exclude is not None:
+                    sims[docs == exclude[i]] = -1.0
+                j = int(np.argmax(sims))
+                if sims[j] >= threshold and (best[i] is None or sims[j] > best[i][1]):
+                    best[i] = (int(docs[j]), float(sims[j]))
+        return best
+
+
+_lock = threading.Lock()
+_index: Optional[DedupIndex] = None
+
+
+def get_dedup_index(kb_file: Path) -> DedupIndex:
+    """Process-level index, rebuilt (sketches reopened as mmaps) when the KB segments change."""
+    global _index
+    # Sous le verrou des écritures KB : les sketches écrits / retirés ici suivent le MANIFEST courant
+    with write_lock(kb_file), _lock:
+        sig = kb_signature(kb_file)
+        if _index is None or _index.signature != sig:
+            store = open_kb(kb_file)
+            if not isinstance(store, KBStore):
+                raise ValueError("near-duplicate detection needs KB segments")
+            _index = DedupIndex(kb_file, store, sig)
+        return _index
+
+
+def arxiv_base_id(arxiv_id: str) -> str:
+    """arXiv id without its version suffix (2401.00001v2 -> 2401.00001)."""
+    match = _ARXIV_VERSION_RE.match(arxiv_id)
+    return match.group(1) if match else arxiv_id
+
+
+def known_version(store, arxiv_id: str) -> Optional[str]:
+    """Id of another version of the same arXiv paper already in the KB (2401.00001v1 / v2...)."""
+    base = arxiv_base_id(arxiv_id)
+    for candidate in [base] + [f"{base}v{n}" for n in range(1, _MAX_VERSION + 1)]:
+        if candidate != arxiv_id and store.find(candidate) is not None:
+            return candidate
+    return None
+
+
+def batch_duplicates(sigs: np.ndarray, valid: np.ndarray, threshold: float = DEDUP_THRESHOLD) -> List[Optional[int]]:
+    """For each item of a batch, index of an earlier item of the same batch it duplicates, else None."""
+    seen: Dict[Tuple[int, int], List[int]] = {}
+    keys = band_keys(sigs)
+    out: List[Optional[int]] = [None] * len(sigs)
+    for i in range(len(sigs)):
+        if not valid[i]:
+            continue
+        cands = {j for band in range(BANDS) for j in seen.get((band, int(keys[i, band])), ())}
+        match = next((j for j in sorted(cands) if similarity(sigs[j], sigs[i]) >= threshold), None)
+        if match is not None:
+            out[i] = match
+            continue
+        for band in range(BANDS):
+            seen.setdefault((band, int(keys[i, band])), []).append(i)
+    return out
+
+
+def main() -> None:
+    from app.services.kb_service import _kb_path
+
+    logging.basicConfig(level=logging.INFO)
+    kb_file = _kb_path()
+    t0 = time.perf_counter()
+    index = get_dedup_index(kb_file)
+    pairs = 0
+    for base, sketch in index.sketches:
+        sigs = np.asarray(sketch.sigs)
+        for start in range(0, len(sigs), _CHUNK):
+            docs = base + np.asarray(sketch.docs[start:start + _CHUNK], dtype=np.int64)
+            pairs += sum(hit is not None for hit in index.find(sigs[start:start + _CHUNK], exclude=docs))
+    print(json.dumps({
+        "ok": True,
+        "docs": len(index.store),
+        "sketched": sum(len(s.docs) for _, s in index.sketches),
+        "docs_with_near_duplicate": pairs,
+        "elapsed_s": round(time.perf_counter() - t0, 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""
+Durable outbound email queue.
+
+/api/send-email drops a JSON job into data_lake/email_queue/pending/ and
+answers 202; a background thread drains the queue over a reused SMTP
+connection (every due job at once), with retries and exponential backoff. A
+sent job moves to sent/, an exhausted one to failed/, without the conversation
+history (the save_conversation_copy copy is enough); sent/ is purged after
+EMAIL_SENT_RETENTION_DAYS. Pending jobs survive a restart.
+
+With several workers (app.serve), each process has its own sender thread: a
+job is claimed before sending by an atomic rename pending/ -> inflight/ (a
+single worker wins), then put back in pending/ (retry) or filed. A job left
+in inflight/ longer than EMAIL_INFLIGHT_TIMEOUT_S (worker died while sending)
+is put back in pending/.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core import metrics
+from app.core.paths import data_lake_dir
+from app.integrations.mcp.tools import build_email_html_body, save_conversation_copy
+from app.services.email_service import SMTPSender
+
+logger = logging.getLogger(__name__)
+
+_STATES = ("pending", "inflight", "sent", "failed")
+_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "5"))
+_BACKOFF_BASE_S = float(os.getenv("EMAIL_BACKOFF_BASE_S", "5"))
+_BACKOFF_MAX_S = 15 * 60
+# Connexion SMTP fermée après ce délai sans job
+_IDLE_CLOSE_S = 60.0
+_POLL_S = 5.0
+# Au-delà, un job réservé est considéré abandonné (bien plus long qu'un envoi SMTP)
+_INFLIGHT_TIMEOUT_S = float(os.getenv("EMAIL_INFLIGHT_TIMEOUT_S", "600"))
+_SENT_RETENTION_S = float(os.getenv("EMAIL_SENT_RETENTION_DAYS", "7")) * 24 * 3600
+_PURGE_INTERVAL_S = 3600.0
+
+
+def _queue_dir() -> Path:
+    return data_lake_dir() / "email_queue"
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _write_job(path: Path, job: Dict[str, Any]) -> None:
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(job, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+class EmailQueue:
+    def __init__(self, root: Optional[Path] = None) -> None:
+        self._root = root
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._sender = SMTPSender()
+        self._last_delivery = 0.0
+        self._last_purge = 0.0
+        self.counters = {"enqueued": 0, "sent": 0, "retried": 0, "failed": 0, "purged": 0}
+
+    def _dir(self, state: str) -> Path:
+        if self._root is None:
+            self._root = _queue_dir()
+        d = self._root / state
+        d.mkdir(parents=True, exist_ok=True)
+        return d
+
+    def enqueue(self, recipient_email: str, subject: str, conversation_history: List[Dict[str, str]]) -> str:
+        """Persists the job in pending/ and wakes the worker. Returns the job id."""
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "recipient_email": recipient_email,
+            "subject": subject,
+            "conversation_history": conversation_history,
+            "status": "pending",
+            "attempts": 0,
+            "created_at": _now_iso(),
+            "next_attempt_at": time.time(),
+            "last_error": None,
+            "sent_at": None,
+        }
+        _write_job(self._dir("pending") / f"{job_id}.json", job)
+        self.counters["enqueued"] += 1
+        self._wakeup.set()
+        return job_id
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        if not job_id.isalnum():
+            return None
+        for state in _STATES:
+            path = self._dir(state) / f"{job_id}.json"
+            try:
+                job = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                continue
+            job.pop("conversation_history", None)
+            return job
+        return None
+
+    # ---- worker ----
+
+    def start(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="email-queue", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._sender.close()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                next_due = self.drain()
+            except Exception as e:
+                logger.error(f"email queue drain failed: {e}")
+                next_due = None
+
+            if time.monotonic() - self._last_delivery > _IDLE_CLOSE_S:
+                self._sender.close()
+            if time.monotonic() - self._last_purge > _PURGE_INTERVAL_S:
+                self._last_purge = time.monotonic()
+                self.purge_sent()
+
+            wait = _POLL_S if next_due is None else min(_POLL_S, max(0.0, next_due - time.time()))
+            self._wakeup.wait(wait)
+            self._wakeup.clear()
+        self._sender.close()
+
+    def drain(self) -> Optional[float]:
+        """
+        Sends every due pending job over the shared connection, oldest first.
+        Returns when the next pending job is due, or None if the queue is empty.
+        """
+        self._recover_inflight()
+        jobs = []
+        for path in self._dir("pending").glob("*.json"):
+            try:
+                jobs.append((path, json.loads(path.read_text(encoding="utf-8"))))
+            except (OSError, ValueError):
+                continue
+        jobs.sort(key=lambda pj: pj[1]["created_at"])
+
+        next_due: Optional[float] = None
+        for path, job in jobs:
+            if self._stop.is_set():
+                break
+            if job["next_attempt_at"] > time.time():
+                next_due = min(next_due or job["next_attempt_at"], job["next_attempt_at"])
+                continue
+            claimed = self._claim(path)
+            if claimed is None:
+                continue  # réservé par un autre worker
+            claimed_path, job = claimed
+            if job["next_attempt_at"] > time.time():
+                # Réessayé entre-temps par un autre worker : pas encore dû
+                os.replace(claimed_path, path)
+            elif self._deliver(claimed_path, job) != "pending":
+                continue
+            next_due = min(next_due or job["next_attempt_at"], job["next_attempt_at"])
+        return next_due
+
+    def purge_sent(self) -> int:
+        """Deletes sent/ jobs older than EMAIL_SENT_RETENTION_DAYS. Returns how many were removed."""
+        now = time.time()
+        removed = 0
+        for path in self._dir("sent").glob("*.json"):
+            try:
+                if now - path.stat().st_mtime > _SENT_RETENTION_S:
+                    path.unlink()
+                    removed += 1
+            except OSError:
+                continue  # purgé par un autre worker
+        self.counters["purged"] += removed
+        return removed
+
+    def _claim(self, path: Path) -> Optional[Tuple[Path, Dict[str, Any]]]:
+        """Moves a pending job to inflight/ (atomically); None if another worker took it."""
+        claimed_path = self._dir("inflight") / path.name
+        try:
+            os.rename(path, claimed_path)
+            # mtime = heure de réservation (cf. _recover_inflight)
+            os.utime(claimed_path)
+            # Relu après réservation : la version lue avant peut dater d'avant un retry
+            return claimed_path, json.loads(claimed_path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.error(f"email job {path.stem} unreadable after claim: {e}")
+            return None
+
+    def _recover_inflight(self) -> None:
+        # Jobs réservés par un worker mort pendant l'envoi : remis en file
+        now = time.time()
+        for path in self._dir("inflight").glob("*.json"):
+            try:
+                if now - path.stat().st_mtime > _INFLIGHT_TIMEOUT_S:
+                    os.replace(path, self._dir("pending") / path.name)
+                    logger.warning(f"email job {path.stem} was stuck in inflight/, requeued")
+            except OSError:
+                continue
+
+    def _deliver(self, path: Path, job: Dict[str, Any]) -> str:
+        self._last_delivery = time.monotonic()
+        job["attempts"] += 1
+        t0 = time.perf_counter()
+        try:
+            if job["attempts"] == 1:
+                save_conversation_copy(job["conversation_history"])
+            html_body = build_email_html_body(job["conversation_history"])
+            self._sender.send(job["recipient_email"], job["subject"], html_body)
+        except Exception as e:
+            job["last_error"] = str(e)
+            if job["attempts"] >= _MAX_ATTEMPTS:
+                job["status"] = "failed"
+                self.counters["failed"] += 1
+                logger.error(f"email job {job['job_id']} failed after {job['attempts']} attempts: {e}")
+            else:
+                delay = min(_BACKOFF_MAX_S, _BACKOFF_BASE_S * (2 ** (job["attempts"] - 1)))
+                job["next_attempt_at"] = time.time() + delay
+                self.counters["retried"] += 1
+                logger.warning(f"email job {job['job_id']} attempt {job['attempts']} failed, retry in {delay:.0f}s: {e}")
+        else:
+            job["status"] = "sent"
+            job["sent_at"] = _now_iso()
+            job["last_error"] = None
+            self.counters["sent"] += 1
+
+        metrics.observe("email_stage_latency_ms", (time.perf_counter() - t0) * 1000, stage="deliver")
+        metrics.counter("email_deliveries_total", outcome="ok" if job["status"] == "sent" else "error").inc()
+
+        if job["status"] == "pending":
+            # Retry : mis à jour dans inflight/ puis rendu à pending/ (visible des autres workers)
+            _write_job(path, job)
+            os.replace(path, self._dir("pending") / path.name)
+        else:
+            # État final : l'historique de la conversation n'est plus nécessaire
+            job.pop("conversation_history", None)
+            _write_job(self._dir(job["status"]) / path.name, job)
+            path.unlink(missing_ok=True)
+        return job["status"]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "pending": sum(1 for _ in self._dir("pending").glob("*.json")),
+            "inflight": sum(1 for _ in self._dir("inflight").glob("*.json")),
+        }
+
+
+email_queue = EmailQueue()
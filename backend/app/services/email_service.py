@@ -4,11 +4,11 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
 
-def send_email_smtp(recipient_email, subject, html_body):
-    """Envoie un email via smtplib vers le serveur SMTP configuré (MailHog)."""
-    smtp_host = os.getenv("SMTP_HOST", "127.0.0.1")
-    smtp_port = os.getenv("SMTP_PORT", "1025")
+def _smtp_address():
+    return os.getenv("SMTP_HOST", "127.0.0.1"), int(os.getenv("SMTP_PORT", "1025"))
 
+
+def build_message(recipient_email, subject, html_body):
     message = MIMEMultipart("alternative")
     message["Subject"] = subject
     message["From"] = "dixitbot@localhost"
@@ -19,8 +19,53 @@ def send_email_smtp(recipient_email, subject, html_body):
     html_part = MIMEText(html_body, "html")
     message.attach(text_part)
     message.attach(html_part)
+    return message
+
+
+def send_email_smtp(recipient_email, subject, html_body):
+    """Envoie un email via smtplib vers le serveur SMTP configuré (MailHog)."""
+    smtp_host, smtp_port = _smtp_address()
+    message = build_message(recipient_email, subject, html_body)
 
     # Pas de try/except ici : si la connexion SMTP échoue, l'exception
     # remonte à l'appelant (cohérent avec le reste du projet).
-    with smtplib.SMTP(smtp_host, int(smtp_port)) as server:
+    with smtplib.SMTP(smtp_host, smtp_port) as server:
         server.sendmail(message["From"], recipient_email, message.as_string())
+
+
+class SMTPSender:
+    """
+    Une connexion SMTP réutilisée d'un message à l'autre (worker de la file d'emails).
+    Reconnecte si le serveur a fermé la connexion ; close() après inactivité.
+    """
+
+    def __init__(self, timeout_s=30.0):
+        self.timeout_s = timeout_s
+        self._server = None
+
+    def _connect(self):
+        smtp_host, smtp_port = _smtp_address()
+        self._server = smtplib.SMTP(smtp_host, smtp_port, timeout=self.timeout_s)
+
+    def send(self, recipient_email, subject, html_body):
+        message = build_message(recipient_email, subject, html_body)
+        if self._server is None:
+            self._connect()
+        try:
+            self._server.sendmail(message["From"], recipient_email, message.as_string())
+        except smtplib.SMTPServerDisconnected:
+            # Connexion fermée côté serveur pendant l'inactivité : une seule reconnexion
+            self._connect()
+            self._server.sendmail(message["From"], recipient_email, message.as_string())
+        except (TimeoutError, ConnectionError):
+            # Connexion inutilisable : la prochaine tentative repart d'une connexion neuve
+            self.close()
+            raise
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except OSError:
+                pass  # smtplib.SMTPException hérite d'OSError
+            self._server = None
@@ -0,0 +1,254 @@
+"""
+Offline arXiv harvester: pre-populates the KB, one category per theme.
+
+Usage:
+    cd backend
+    python -m app.services.harvest_service                     # every theme
+    python -m app.services.harvest_service --theme ai_ml --max-items 5000
+    ARXIV_API_URL=http://127.0.0.1:8081/api/query python -m app.services.harvest_service
+
+Each category is paged through (start parameter) in ascending submission
+date order: new papers land at the end of the list and do not shift the pages
+already read. A checkpoint (data_lake/harvest_checkpoint.json) is written
+after every KB write, so a rerun resumes at the first page not yet ingested.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import requests
+
+from app.core.http_pool import get_session
+from app.core.paths import data_lake_dir
+from app.services import ingest_service
+from app.services.scrape_service import _THEME_TO_ARXIV_CAT, arxiv_api_url, parse_arxiv_feed
+
+logger = logging.getLogger(__name__)
+
+# arXiv demande au moins 3 s entre deux appels à l'API
+_POLITENESS_DELAY_S = 3.0
+_PAGE_SIZE = 200
+_BATCH_SIZE = 1000
+# Pages téléchargées en avance sur le parsing / l'écriture KB
+_MAX_PENDING = 2
+_MAX_RETRIES = 4
+_TOTAL_RE = re.compile(rb"<opensearch:totalResults[^>]*>(\d+)<")
+
+
+def _checkpoint_path() -> Path:
+    return data_lake_dir() / "harvest_checkpoint.json"
+
+
+def load_checkpoint(path: Path) -> Dict[str, Dict[str, Any]]:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_checkpoint(path: Path, checkpoint: Dict[str, Dict[str, Any]]) -> None:
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(checkpoint, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _page_url(category: str, start: int, page_size: int) -> str:
+    return (
+        arxiv_api_url()
+        + f"?search_query=cat:{category}"
+        f"&start={start}&max_results={page_size}"
+        f"&sortBy=submittedDate&sortOrder=ascending"
+    )
+
+
+def _parse_page(body: bytes, theme: str) -> List[Dict[str, Any]]:
+    """Worker process: Atom page -> KB records (same shape as the raw files)."""
+    return [{**item.dict(), "theme": theme} for item in parse_arxiv_feed([body])]
+
+
+class _Fetcher:
+    """Sequential page downloads spaced by the politeness delay, with retries."""
+
+    def __init__(self, delay_s: float) -> None:
+        self.delay_s = delay_s
+        self._last_call = 0.0
+
+    def get(self, url: str) -> bytes:
+        for attempt in range(_MAX_RETRIES):
+            wait = self.delay_s - (time.monotonic() - self._last_call)
+            if wait > 0:
+                time.sleep(wait)
+            self._last_call = time.monotonic()
+            try:
+                r = get_session().get(url, timeout=60)
+            except requests.RequestException as e:
+                logger.warning(f"arXiv page failed ({e}), attempt {attempt + 1}/{_MAX_RETRIES}")
+                time.sleep(self.delay_s * (2 ** attempt))
+                continue
+            if r.status_code == 200:
+                return r.content
+            logger.warning(f"arXiv HTTP {r.status_code}, attempt {attempt + 1}/{_MAX_RETRIES}")
+            retry_after = r.headers.get("Retry-After", "")
+            time.sleep(float(retry_after) if retry_after.isdigit() else self.delay_s * (2 ** attempt))
+        raise RuntimeError(f"ARXIV_HTTP_ERROR: giving up on {url}")
+
+
+def harvest_category(
+    theme: str,
+    category: str,
+    fetcher: _Fetcher,
+    pool: ProcessPoolExecutor,
+    checkpoint: Dict[str, Dict[str, Any]],
+    checkpoint_path: Path,
+    max_items: Optional[int] = None,
+    page_size: int = _PAGE_SIZE,
+    batch_size: int = _BATCH_SIZE,
+) -> Dict[str, Any]:
+    """
+    Pages through one arXiv category from its checkpoint. Page N is parsed
+    in the pool while page N+1 downloads; parsed items are written to the KB
+    in batches of batch_size.
+    """
+    # Une catégorie terminée est reprise à son offset : seuls les papiers soumis depuis sont lus
+    state = checkpoint.setdefault(category, {"theme": theme, "start": 0, "ingested": 0, "done": False})
+    state["done"] = False
+    resumed_at = state["start"]
+    next_start = state["start"]
+    limit = None if max_items is None else state["start"] + max_items
+    pending: Deque[Tuple[int, int, "Future[List[Dict[str, Any]]]"]] = deque()
+    batch: List[Dict[str, Any]] = []
+    batch_end = state["start"]
+    added = skipped = 0
+    total: Optional[int] = None
+    empty_retries = 0
+
+    def flush() -> None:
+        nonlocal added, skipped
+        if batch:
+            result = ingest_service.ingest_arxiv_items(batch)
+            if not result["ok"]:
+                raise RuntimeError(f"KB ingestion failed: {result['errors']}")
+            added += result["added"]
+            skipped += result["skipped"]
+            state["ingested"] += result["added"]
+            batch.clear()
+        # Le checkpoint n'avance qu'une fois les pages écrites dans la KB
+        state["start"] = batch_end
+        _save_checkpoint(checkpoint_path, checkpoint)
+
+    def collect(wait_all: bool) -> None:
+        nonlocal batch_end
+        # Dans l'ordre des pages : le checkpoint reste un offset contigu
+        while pending and (wait_all or pending[0][2].done() or len(pending) > _MAX_PENDING):
+            page_start, entries, fut = pending.popleft()
+            batch.extend(fut.result())
+            batch_end = page_start + entries
+            if len(batch) >= batch_size:
+                flush()
+
+    while limit is None or next_start < limit:
+        size = page_size if limit is None else min(page_size, limit - next_start)
+        body = fetcher.get(_page_url(category, next_start, size))
+
+        match = _TOTAL_RE.search(body)
+        if match:
+            total = int(match.group(1))
+        entries = body.count(b"<entry>") + body.count(b"<entry ")
+        if entries == 0:
+            # arXiv renvoie parfois une page vide à tort : on réessaie si le total annonce plus
+            if total is not None and next_start < total and empty_retries < _MAX_RETRIES:
+                empty_retries += 1
+                continue
+            state["done"] = True
+            break
+        empty_retries = 0
+
+        pending.append((next_start, entries, pool.submit(_parse_page, body, theme)))
+        next_start += entries
+        collect(wait_all=False)
+
+        if total is not None and next_start >= total:
+            state["done"] = True
+            break
+
+    collect(wait_all=True)
+    flush()
+    logger.info(f"harvest {category}: +{added} items ({skipped} already in KB), next start {state['start']}")
+    return {"category": category, "added": added, "skipped": skipped, "resumed_at": resumed_at, "done": state["done"]}
+
+
+def harvest(
+    themes: Optional[List[str]] = None,
+    max_items: Optional[int] = None,
+    delay_s: float = _POLITENESS_DELAY_S,
+    page_size: int = _PAGE_SIZE,
+    batch_size: int = _BATCH_SIZE,
+    workers: int = 2,
+    checkpoint_path: Optional[Path] = None,
+) -> Dict[str, Any]:
+    checkpoint_path = checkpoint_path or _checkpoint_path()
+    checkpoint = load_checkpoint(checkpoint_path)
+    fetcher = _Fetcher(delay_s)
+    results = []
+    errors = []
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for theme in themes or list(_THEME_TO_ARXIV_CAT):
+            category = _THEME_TO_ARXIV_CAT.get(theme)
+            if category is None:
+                errors.append(f"UNKNOWN_THEME: {theme}")
+                continue
+            try:
+                results.append(harvest_category(
+                    theme, category, fetcher, pool, checkpoint, checkpoint_path,
+                    max_items=max_items, page_size=page_size, batch_size=batch_size,
+                ))
+            except RuntimeError as e:
+                logger.error(f"harvest {category} stopped: {e}")
+                errors.append(f"{category}: {e}")
+
+    return {"ok": not errors, "errors": errors, "categories": results}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Harvest arXiv categories into the KB (resumable).")
+    parser.add_argument("--theme", action="append", choices=sorted(_THEME_TO_ARXIV_CAT), help="thème (répétable), défaut : tous")
+    parser.add_argument("--max-items", type=int, default=None, help="items max par catégorie pour cette exécution")
+    parser.add_argument("--delay", type=float, default=_POLITENESS_DELAY_S, help="secondes entre deux appels arXiv")
+    parser.add_argument("--page-size", type=int, default=_PAGE_SIZE)
+    parser.add_argument("--batch-size", type=int, default=_BATCH_SIZE, help="items par segment KB écrit")
+    parser.add_argument("--workers", type=int, default=2, help="process de parsing")
+    parser.add_argument("--checkpoint", type=Path, default=None)
+    parser.add_argument("--reset", action="store_true", help="ignore le checkpoint existant")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    checkpoint_path = args.checkpoint or _checkpoint_path()
+    if args.reset:
+        checkpoint_path.unlink(missing_ok=True)
+
+    result = harvest(
+        themes=args.theme,
+        max_items=args.max_items,
+        delay_s=args.delay,
+        page_size=args.page_size,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        checkpoint_path=checkpoint_path,
+    )
+    print(json.dumps(result, indent=2))
+    # Laisse finir les embeddings / compactions lancés par l'ingestion
+    ingest_service.wait_background_tasks()
+
+
+if __name__ == "__main__":
+    main()
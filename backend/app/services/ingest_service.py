@@ -0,0 +1,279 @@
+from __future__ import annotations
+
+import gzip
+import json
+import logging
+import os
+import sys
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, List
+
+from app.services import dedup_service
+from app.services.kb_index import get_kb_index
+from app.services.kb_service import _kb_path
+from app.services.kb_store import (
+    append_segment,
+    convert_kb_json,
+    kb_signature,
+    passage_id,
+    replace_segments,
+    segment_paths,
+    write_lock,
+)
+from app.services.vector_store import append_vectors, resync_vector_signature
+
+logger = logging.getLogger(__name__)
+
+# Au-delà, les segments d'ingestion (tous sauf le premier) sont fusionnés en un seul
+_MAX_SEGMENTS = 32
+
+# DEDUP=0 : pas de détection de quasi-doublons (seul l'arxiv_id exact est dédoublonné)
+_DEDUP = os.getenv("DEDUP", "1") != "0"
+
+# Les embeddings des nouveaux items sont calculés hors du thread de requête
+_vector_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kb-vectors")
+
+# Ingestion des résultats de /ask : hors du chemin de la réponse, lots traités dans l'ordre
+_ingest_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kb-ingest")
+
+
+def item_arxiv_id(item: Dict[str, Any]) -> str:
+    """arXiv id of a scraped item, taken from abs_url when arxiv_id is empty."""
+    arxiv_id = (item.get("arxiv_id") or "").strip()
+    if not arxiv_id and item.get("abs_url"):
+        # Certains anciens fichiers raw ont un arxiv_id vide mais une abs_url valide
+        arxiv_id = item["abs_url"].rstrip("/").split("/")[-1]
+    return arxiv_id
+
+
+def ingest_arxiv_items(items: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Appends scraped arXiv items to the KB as a new segment, deduplicated on
+    arxiv_id (against the KB and within the batch), then on content: another
+    version of the same paper or a MinHash near-duplicate (see dedup_service)
+    is dropped. The BM25 index is extended incrementally on the next
+    search_kb; vectors (if a vector store exists) are filled in the background.
+    """
+    kb_file = _kb_path()
+    # Verrou inter-process : avec app.serve, chaque worker ingère ses propres résultats
+    with write_lock(kb_file):
+        if not _ensure_segments(kb_file):
+            return {"ok": False, "errors": ["KB_FILE_NOT_FOUND"], "added": 0, "skipped": 0}
+
+        # Index relu sous le verrou : il voit les segments ajoutés par les autres workers
+        store = get_kb_index(kb_file).store
+        seen = set()
+        new_items: List[Dict[str, Any]] = []
+        skipped = 0
+        for item in items:
+            arxiv_id = item_arxiv_id(item)
+            if not arxiv_id or arxiv_id in seen or store.find(arxiv_id) is not None:
+                skipped += 1
+                continue
+            seen.add(arxiv_id)
+            new_items.append({**item, "id": arxiv_id, "arxiv_id": arxiv_id})
+
+        near_duplicates = 0
+        sketch = None
+        if _DEDUP and new_items:
+            new_items, near_duplicates, sketch = _drop_near_duplicates(kb_file, store, new_items)
+
+        if not new_items:
+            return {"ok": True, "errors": [], "added": 0, "skipped": skipped, "near_duplicates": near_duplicates}
+
+        out_path = _append(kb_file, new_items)
+        if sketch is not None:
+            # Signatures déjà calculées : le sketch du nouveau segment est écrit tout de suite
+            dedup_service.save_items_sketch(kb_file, out_path, *sketch)
+    return {
+        "ok": True,
+        "errors": [],
+        "added": len(new_items),
+        "skipped": skipped,
+        "near_duplicates": near_duplicates,
+        "saved_to": str(out_path),
+    }
+
+
+def submit_arxiv_items(items: List[Dict[str, Any]]) -> Future:
+    """
+    Background ingest_arxiv_items, for the request path: converting kb.json,
+    sketching for MinHash and waiting for the lock do not delay the response.
+    Errors are logged; the Future returns the result (or None).
+    """
+    return _ingest_executor.submit(_ingest_logged, items)
+
+
+def _ingest_logged(items: List[Dict[str, Any]]) -> Dict[str, Any] | None:
+    try:
+        result = ingest_arxiv_items(items)
+    except Exception as e:
+        logger.error(f"KB ingestion of arXiv results failed: {e}")
+        return None
+    if not result["ok"]:
+        logger.warning(f"KB ingestion of arXiv results skipped: {result['errors']}")
+    return result
+
+
+def _drop_near_duplicates(kb_file: Path, store, items: List[Dict[str, Any]]):
+    """
+    Items that are neither another version of a KB / batch paper nor a MinHash
+    near-duplicate of one. Returns (kept, dropped count, (signatures, valid) of kept).
+    """
+    sigs, valid = dedup_service.minhash_signatures([dedup_service.item_text(it) for it in items])
+    try:
+        hits = dedup_service.get_dedup_index(kb_file).find(sigs)
+    except Exception as e:
+        # Sans index (sketch illisible...), l'ingestion continue sans détection contre la KB
+        logger.error(f"KB near-duplicate lookup failed: {e}")
+        hits = [None] * len(items)
+    in_batch = dedup_service.batch_duplicates(sigs, valid)
+
+    kept: List[int] = []
+    bases = set()
+    for i, item in enumerate(items):
+        base = dedup_service.arxiv_base_id(item["arxiv_id"])
+        duplicate_of = None
+        if base in bases:
+            duplicate_of = base
+        else:
+            duplicate_of = dedup_service.known_version(store, item["arxiv_id"])
+        if duplicate_of is None and hits[i] is not None:
+            duplicate_of = store.get_field(hits[i][0], "id")
+        if duplicate_of is None and in_batch[i] is not None:
+            duplicate_of = items[in_batch[i]]["arxiv_id"]
+        if duplicate_of is not None:
+            logger.info(f"KB near-duplicate dropped: {item['arxiv_id']} ~ {duplicate_of}")
+            continue
+        bases.add(base)
+        kept.append(i)
+    return [items[i] for i in kept], len(items) - len(kept), (sigs[kept], valid[kept])
+
+
+def ingest_passages(papers: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Appends the full-text passages of papers (see pdf_service) as a new
+    segment: one record per passage, id "<arxiv_id>#p<n>", with the paper's
+    title and url. A paper whose passage 0 is already in the KB is skipped.
+    """
+    kb_file = _kb_path()
+    with write_lock(kb_file):
+        if not _ensure_segments(kb_file):
+            return {"ok": False, "errors": ["KB_FILE_NOT_FOUND"], "added": 0, "skipped": 0}
+
+        store = get_kb_index(kb_file).store
+        records: List[Dict[str, Any]] = []
+        papers_added = skipped = 0
+        for paper in papers:
+            arxiv_id = paper["arxiv_id"]
+            if not paper["passages"] or store.find(passage_id(arxiv_id, 0)) is not None:
+                skipped += 1
+                continue
+            papers_added += 1
+            for n, text in enumerate(paper["passages"]):
+                records.append({
+                    "id": passage_id(arxiv_id, n),
+                    "title": paper.get("title") or "",
+                    "abstract": text,
+                    "url": paper.get("url") or "",
+                    "kind": "passage",
+                    "parent_id": arxiv_id,
+                    "theme": paper.get("theme"),
+                })
+
+        if not records:
+            return {"ok": True, "errors": [], "added": 0, "skipped": skipped}
+
+        out_path = _append(kb_file, records)
+    return {
+        "ok": True,
+        "errors": [],
+        "added": papers_added,
+        "passages": len(records),
+        "skipped": skipped,
+        "saved_to": str(out_path),
+    }
+
+
+def _ensure_segments(kb_file: Path) -> bool:
+    """Converts kb.json to segments on first ingestion; False when there is no KB at all."""
+    if not segment_paths(kb_file):
+        if not kb_file.exists():
+            return False
+        convert_kb_json(kb_file)
+    return True
+
+
+def _append(kb_file: Path, records: List[Dict[str, Any]]) -> Path:
+    """New segment (caller holds write_lock); vectors and compaction run in the background."""
+    out_path = append_segment(kb_file, records)
+    index = get_kb_index(kb_file)
+    _vector_executor.submit(_append_vectors, kb_file, index.store, index.signature)
+    if len(segment_paths(kb_file)) > _MAX_SEGMENTS:
+        _vector_executor.submit(_compact_segments, kb_file)
+    return out_path
+
+
+def _append_vectors(kb_file: Path, store, signature) -> None:
+    try:
+        result = append_vectors(kb_file, store, signature)
+    except Exception as e:
+        logger.error(f"KB vector append failed: {e}")
+        return
+    if not result["ok"] and result["errors"] != ["NO_VECTOR_STORE"]:
+        logger.warning(f"KB vector append skipped: {result['errors']}")
+
+
+def _compact_segments(kb_file: Path) -> None:
+    """
+    Merges every ingestion segment (seg 1..N) into one, keeping doc order.
+    Vectors stay aligned; their signature is updated if they covered the
+    whole KB, otherwise they become stale (a rebuild is needed).
+    """
+    with write_lock(kb_file):
+        paths = segment_paths(kb_file)
+        if len(paths) <= _MAX_SEGMENTS:
+            return
+        store = get_kb_index(kb_file).store
+        tail = store.segments[1:]
+        replace_segments(kb_file, [seg.path for seg in tail], (seg.get(doc) for seg in tail for doc in range(len(seg))))
+        try:
+            resync_vector_signature(kb_file, len(store), kb_signature(kb_file))
+        except Exception as e:
+            logger.error(f"KB vector signature update failed after compaction: {e}")
+
+
+def wait_background_tasks() -> None:
+    """
+    Waits for the queued background work (ingestion, vectors, compaction) at
+    the end of a CLI run. Nothing can be submitted afterwards.
+    """
+    _ingest_executor.shutdown(wait=True)
+    _vector_executor.shutdown(wait=True)
+
+
+def ingest_raw_files(paths: Iterable[Path]) -> Dict[str, Any]:
+    """
+    Backfill: ingests the items of raw scrape files, either the old
+    arxiv_raw_*.json or the raw_*.jsonl.gz segments of raw_log.
+    """
+    items: List[Dict[str, Any]] = []
+    for p in paths:
+        p = Path(p)
+        if p.name.endswith(".jsonl.gz"):
+            with gzip.open(p, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        items.extend(json.loads(line).get("items", []))
+        else:
+            data = json.loads(p.read_text(encoding="utf-8"))
+            items.extend(data.get("items", []))
+    return ingest_arxiv_items(items)
+
+
+if __name__ == "__main__":
+    # Usage : python -m app.services.ingest_service data_lake/raw/cache/raw_log/raw_*.jsonl.gz
+    #         python -m app.services.ingest_service data_lake/raw/arxiv_raw_*.json
+    print(json.dumps(ingest_raw_files(Path(p) for p in sys.argv[1:]), indent=2))
+    wait_background_tasks()
@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.paths import data_lake_dir
+
+# Classifieur local d'intention (social / metier), avant tout appel LLM :
+#   1. lexique : question faite uniquement de salutations / remerciements, ou mot-clé métier
+#   2. régression logistique sur des n-grammes de caractères hachés,
+#      entraînée au chargement depuis data_lake/intent_labels.jsonl
+# Seuls les cas sous le seuil de confiance partent au LLM.
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# Salutations, remerciements et formules d'au revoir uniquement : un mot
+# interrogatif ou de contenu ("comment", "qui", "faire"...) laisse trancher le modèle / le LLM
+_SOCIAL_WORDS = frozenset(
+    "bonjour salut bonsoir coucou hello hi hey yo merci remercie thanks thank you beaucoup "
+    "au revoir bye goodbye à bientôt plus tard see bonne journée soirée nuit".split()
+)
+_METIER_WORDS = frozenset(
+    "article articles paper papers publication publications survey état art arxiv recherche "
+    "research résume résumer compare comparer modèle modèles model models algorithme algorithmes "
+    "algorithm algorithms réseau réseaux network networks learning apprentissage transformer "
+    "transformers llm llms nlp rag diffusion neural neurones".split()
+)
+
+_DIM = 1 << 16
+_NGRAMS = (2, 3, 4)
+
+
+def _labels_path() -> Path:
+    return data_lake_dir() / "intent_labels.jsonl"
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(_WORD_RE.findall((question or "").lower()))
+
+
+def _features(text: str) -> np.ndarray:
+    padded = f" {text} "
+    idx = {
+        zlib.crc32(padded[i:i + n].encode("utf-8")) & (_DIM - 1)
+        for n in _NGRAMS
+        for i in range(len(padded) - n + 1)
+    }
+    return np.fromiter(idx, dtype=np.int64, count=len(idx))
+
+
+class IntentClassifier:
+    """Logistic regression over hashed character n-grams (1 = social)."""
+
+    def __init__(self, examples: List[Tuple[str, str]], epochs: int = 60, lr: float = 0.5, l2: float = 1e-4) -> None:
+        self.w = np.zeros(_DIM, dtype=np.float64)
+        self.b = 0.0
+        data = [(_features(normalize_question(t)), 1.0 if label == "social" else 0.0) for t, label in examples]
+        rng = np.random.default_rng(0)
+        for _ in range(epochs):
+            for i in rng.permutation(len(data)):
+                feats, y = data[i]
+                if feats.size == 0:
+                    continue
+                v = 1.0 / np.sqrt(feats.size)
+                p = 1.0 / (1.0 + np.exp(-(self.w[feats].sum() * v + self.b)))
+                g = p - y
+                self.w[feats] -= lr * (g * v + l2 * self.w[feats])
+                self.b -= lr * g
+
+    def prob_social(self, normalized: str) -> float:
+        feats = _features(normalized)
+        if feats.size == 0:
+            return 0.5
+        z = self.w[feats].sum() / np.sqrt(feats.size) + self.b
+        return float(1.0 / (1.0 + np.exp(-z)))
+
+
+def _load_examples(path: Path) -> List[Tuple[str, str]]:
+    examples = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                examples.append((row["text"], row["label"]))
+    return examples
+
+
+_model_lock = threading.Lock()
+_model: Optional[IntentClassifier] = None
+
+
+def get_model() -> Optional[IntentClassifier]:
+    """Model trained once per process, or None when the labelled file is missing."""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None and _labels_path().exists():
+                _model = IntentClassifier(_load_examples(_labels_path()))
+    return _model
+
+
+def classify_local(question: str, min_confidence: Optional[float] = None) -> Optional[Tuple[str, str]]:
+    """
+    (intent, tier) from the lexicon or the local model, or None when
+    neither is confident enough (the LLM has to decide).
+    """
+    if min_confidence is None:
+        min_confidence = float(os.getenv("INTENT_MIN_CONFIDENCE", "0.8"))
+    normalized = normalize_question(question)
+    words = normalized.split()
+
+    if words and all(w in _SOCIAL_WORDS for w in words):
+        return "social", "lexicon"
+    if any(w in _METIER_WORDS for w in words):
+        return "metier", "lexicon"
+
+    model = get_model()
+    if model is None:
+        return None
+    p = model.prob_social(normalized)
+    if p >= min_confidence:
+        return "social", "model"
+    if 1.0 - p >= min_confidence:
+        return "metier", "model"
+    return None
+
+
+class VerdictCache:
+    """LRU of intent verdicts per normalized question, with per-tier counters."""
+
+    def __init__(self, max_entries: int = 4096) -> None:
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {"cache": 0, "lexicon": 0, "model": 0, "llm": 0, "fallback": 0}
+
+    def get(self, question: str) -> Optional[str]:
+        key = normalize_question(question)
+        with self._lock:
+            intent = self._entries.get(key)
+            if intent is not None:
+                self._entries.move_to_end(key)
+                self.counters["cache"] += 1
+            return intent
+
+    def put(self, question: str, intent: str, tier: str) -> None:
+        key = normalize_question(question)
+        with self._lock:
+            self.counters[tier] += 1
+            if tier == "fallback":
+                return  # un échec LLM ne doit pas figer le verdict
+            self._entries[key] = intent
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counters)
+
+
+verdict_cache = VerdictCache()
@@ -0,0 +1,312 @@
+from __future__ import annotations
+
+import copy
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.services.kb_store import KBStore, Signature, kb_signature, open_kb, split_passage_id
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Mots trop fréquents pour discriminer (FR + EN), ignorés à l'indexation et en requête
+_STOPWORDS = frozenset(
+    "a an and are as at be by de des du en et for from in is it la le les of on or "
+    "the to un une with sur pour par dans au aux ce ces est que qui".split()
+)
+
+# Paramètres BM25 standards
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens, without stopwords and one-letter tokens."""
+    return [
+        t for t in _TOKEN_RE.findall((text or "").lower())
+        if len(t) > 1 and t not in _STOPWORDS
+    ]
+
+
+# Au-delà de ce nombre de parts (une par ingestion incrémentale), on les fusionne
+_MAX_PARTS = 8
+
+# Snapshot de l'index sur disque (data_lake/kb_bm25/) : tableaux .npy ouverts
+# en mmap read-only, les workers d'app.serve partagent les mêmes pages
+SNAPSHOT_DIRNAME = "kb_bm25"
+_SNAPSHOT_ARRAYS = ("indptr", "indices", "weights", "df")
+
+
+class _Part:
+    """
+    Per-term CSR over a range of docs: indptr[t]:indptr[t+1] -> indices
+    (global doc ids) and weights (BM25 tf component). nrows = vocabulary size
+    when the part was built.
+    """
+
+    def __init__(self, term_ids: np.ndarray, doc_ids: np.ndarray, weights: np.ndarray, nrows: int) -> None:
+        order = np.argsort(term_ids, kind="stable")
+        self.nrows = nrows
+        self.indptr = np.zeros(nrows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=nrows), out=self.indptr[1:])
+        self.indices = doc_ids[order].astype(np.int32)
+        self.weights = weights[order].astype(np.float32)
+
+    @classmethod
+    def from_arrays(cls, indptr: np.ndarray, indices: np.ndarray, weights: np.ndarray) -> "_Part":
+        part = cls.__new__(cls)
+        part.nrows = len(indptr) - 1
+        part.indptr, part.indices, part.weights = indptr, indices, weights
+        return part
+
+    def df(self) -> np.ndarray:
+        return np.diff(self.indptr)
+
+    def term_ids(self) -> np.ndarray:
+        return np.repeat(np.arange(self.nrows, dtype=np.int64), self.df())
+
+
+class KBIndex:
+    """
+    BM25 index over title + abstract of the KB records (store = KBStore or
+    JsonKB); for a full-text passage, the abstract is the passage.
+
+    The term-document matrix is stored as per-term CSR, split into parts:
+    the initial part + one small part per ingestion (incremental append,
+    without re-tokenizing the KB). A query is one sparse product q · M computed
+    in a single np.bincount, then a partial sort (argpartition) for the top-k.
+    """
+
+    def __init__(self, store, signature: Signature = ()) -> None:
+        self.store = store
+        self.signature = signature
+        self.vocab: Dict[str, int] = {}
+        self.df = np.zeros(0, dtype=np.int64)
+        self.parts: List[_Part] = []
+        self._total_len = 0.0
+        self._add_docs(0, len(store))
+
+    def _add_docs(self, start: int, stop: int) -> None:
+        term_ids: List[int] = []
+        doc_ids: List[int] = []
+        tfs: List[int] = []
+        doc_len = np.zeros(stop - start, dtype=np.float32)
+        for doc in range(start, stop):
+            tokens = tokenize(f"{self.store.get_field(doc, 'title')} {self.store.get_field(doc, 'abstract')}")
+            doc_len[doc - start] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                term_ids.append(self.vocab.setdefault(term, len(self.vocab)))
+                doc_ids.append(doc)
+                tfs.append(tf)
+
+        # avgdl sur tous les docs indexés jusqu'ici ; les parts plus anciennes
+        # gardent le leur jusqu'à la prochaine reconstruction complète
+        self._total_len += float(doc_len.sum())
+        avgdl = self._total_len / stop if stop and self._total_len > 0 else 1.0
+        d = np.asarray(doc_ids, dtype=np.int64)
+        tf = np.asarray(tfs, dtype=np.float32)
+        norm = BM25_K1 * (1.0 - BM25_B + BM25_B * doc_len[d - start] / avgdl)
+        part = _Part(np.asarray(term_ids, dtype=np.int64), d, tf * (BM25_K1 + 1.0) / (tf + norm), len(self.vocab))
+
+        df = np.zeros(len(self.vocab), dtype=np.int64)
+        df[:len(self.df)] = self.df
+        df[:part.nrows] += part.df()
+        self.df = df
+        self.parts = self.parts + [part]
+        if len(self.parts) > _MAX_PARTS:
+            self.parts = [self._merged_parts()]
+
+    def _merged_parts(self) -> _Part:
+        return _Part(
+            np.concatenate([p.term_ids() for p in self.parts]),
+            np.concatenate([p.indices for p in self.parts]),
+            np.concatenate([p.weights for p in self.parts]),
+            len(self.vocab),
+        )
+
+    @classmethod
+    def from_snapshot(cls, store, snapshot_dir: Path) -> "KBIndex":
+        """Index over `store` from a save_snapshot() directory, arrays memory-mapped."""
+        meta = json.loads((snapshot_dir / "meta.json").read_text(encoding="utf-8"))
+        arrays = {name: np.load(snapshot_dir / f"{name}.npy", mmap_mode="r") for name in _SNAPSHOT_ARRAYS}
+        index = cls.__new__(cls)
+        index.store = store
+        index.signature = tuple(tuple(entry) for entry in meta["signature"])
+        index.vocab = {term: i for i, term in enumerate(meta["vocab"])}
+        index.df = arrays["df"]
+        index.parts = [_Part.from_arrays(arrays["indptr"], arrays["indices"], arrays["weights"])]
+        index._total_len = meta["total_len"]
+        return index
+
+    def save_snapshot(self, snapshot_dir: Path) -> None:
+        """Writes the index as one merged part (replaces an existing snapshot)."""
+        part = self.parts[0] if len(self.parts) == 1 else self._merged_parts()
+        tmp = snapshot_dir.with_name(snapshot_dir.name + ".tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        arrays = {"indptr": part.indptr, "indices": part.indices, "weights": part.weights, "df": self.df}
+        for name, array in arrays.items():
+            np.save(tmp / f"{name}.npy", np.ascontiguousarray(array))
+        vocab = sorted(self.vocab, key=self.vocab.__getitem__)
+        meta = {"signature": [list(e) for e in self.signature], "total_len": self._total_len, "vocab": vocab}
+        (tmp / "meta.json").write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+        os.replace(tmp, snapshot_dir)
+
+    def extended(self, store, signature: Signature) -> "KBIndex":
+        """
+        New index over a store that appended docs to this one's (new
+        segments). Only the new docs are tokenized; this instance stays usable
+        as is by in-flight searches.
+        """
+        new = copy.copy(self)
+        new.store = store
+        new.signature = signature
+        new._add_docs(len(self.store), len(store))
+        return new
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def score(self, query: str) -> np.ndarray:
+        """
+        Normalized BM25 score of every document for the query, in [0, 1]
+        (1.0 = every term present with a saturated tf).
+        """
+        n = len(self.store)
+        terms = list(dict.fromkeys(tokenize(query)))
+        # Le vocabulaire est partagé avec les index étendus : on ignore les
+        # termes ajoutés après la construction de celui-ci
+        rows = [self.vocab[t] for t in terms if self.vocab.get(t, len(self.df)) < len(self.df)]
+        if not rows or n == 0:
+            return np.zeros(n, dtype=np.float32)
+
+        df = self.df[rows].astype(np.float64)
+        idf = np.log(1.0 + (n - df + 0.5) / (df + 0.5))
+
+        docs, weights = [], []
+        for part in self.parts:
+            prow = np.asarray([r for r in rows if r < part.nrows], dtype=np.int64)
+            pidf = idf[[i for i, r in enumerate(rows) if r < part.nrows]]
+            if prow.size == 0:
+                continue
+            starts, ends = part.indptr[prow], part.indptr[prow + 1]
+            sel = np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)])
+            docs.append(part.indices[sel])
+            weights.append(part.weights[sel] * np.repeat(pidf, ends - starts))
+        scores = np.bincount(np.concatenate(docs), weights=np.concatenate(weights), minlength=n)
+
+        # Normalisation par le score maximal atteignable pour cette requête.
+        # Un terme absent du vocabulaire ("what", "explique"...) compte comme un
+        # terme moyen de la requête, pas comme le plus rare possible, et
+        # l'ensemble des termes inconnus pèse au plus autant que les termes connus :
+        # une question en langage naturel bien couverte reste au-dessus de kb_min_score
+        known_idf = float(idf.sum())
+        unknown = len(terms) - len(rows)
+        max_idf = known_idf + min(known_idf / len(rows) * unknown, known_idf)
+        return (scores / (max_idf * (BM25_K1 + 1.0))).astype(np.float32)
+
+    def search(self, query: str, top_k: int = 5, min_score: float = 0.1) -> List[Dict[str, Any]]:
+        scores = self.score(query)
+        candidates = np.flatnonzero((scores >= min_score) & (scores > 0))
+        if candidates.size == 0:
+            return []
+
+        if candidates.size > top_k:
+            part = np.argpartition(-scores[candidates], top_k - 1)[:top_k]
+            candidates = candidates[part]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+
+        return [self.result(doc, float(scores[doc])) for doc in candidates.tolist()]
+
+    def result(self, doc: int, score: float) -> Dict[str, Any]:
+        """search_kb result for one doc; only this record is decoded from the store."""
+        item_id = self.store.get_field(doc, "id")
+        title = self.store.get_field(doc, "title")
+        abstract = self.store.get_field(doc, "abstract")
+        result = {
+            "id": item_id or None,
+            "title": title,
+            "url": self.store.get_field(doc, "url"),
+            "text": f"Title: {title}\nAbstract: {abstract}",
+            "score": round(score, 4),
+        }
+        parent_id, passage = split_passage_id(item_id)
+        if passage is not None:
+            # Passage du texte intégral : le champ abstract porte le passage
+            result.update(parent_id=parent_id, passage=passage, text=f"Title: {title}\nPassage: {abstract}")
+        return result
+
+
+_lock = threading.Lock()
+_index: Optional[KBIndex] = None
+
+
+def snapshot_dir(kb_file: Path) -> Path:
+    return kb_file.parent / SNAPSHOT_DIRNAME
+
+
+def _load_snapshot(kb_file: Path, sig: Signature) -> Optional[KBIndex]:
+    """Snapshot index if it covers the KB or a prefix of its segments, else None."""
+    d = snapshot_dir(kb_file)
+    if not (d / "meta.json").exists():
+        return None
+    try:
+        store = open_kb(kb_file)
+        index = KBIndex.from_snapshot(store, d)
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"KB index snapshot unreadable, rebuilding: {e}")
+        return None
+    if index.signature == sig:
+        return index
+    if isinstance(store, KBStore) and sig[:len(index.signature)] == index.signature:
+        # Segments ingérés depuis le snapshot : seuls ceux-là sont tokenisés
+        index.store = KBStore([seg.path for seg in store.segments[:len(index.signature)]])
+        return index.extended(store, sig)
+    return None
+
+
+def get_kb_index(kb_file: Path) -> KBIndex:
+    """
+    Process-level index, refreshed only when the mtime or size of a file
+    backing the KB (kb.json or segments) changes. When segments were only
+    appended, the index is extended instead of rebuilt. On first load, the
+    data_lake/kb_bm25/ snapshot is used if it is up to date.
+    """
+    global _index
+    sig = kb_signature(kb_file)
+    if _index is not None and _index.signature == sig:
+        return _index
+    with _lock:
+        if _index is None or _index.signature != sig:
+            old = _index
+            if old is not None and isinstance(old.store, KBStore) and sig[:len(old.signature)] == old.signature:
+                # Segments ajoutés (ingestion) : mise à jour incrémentale
+                _index = old.extended(old.store.extended(kb_file), sig)
+            else:
+                _index = (old is None and _load_snapshot(kb_file, sig)) or KBIndex(open_kb(kb_file), sig)
+        return _index
+
+
+def save_kb_snapshot(kb_file: Path) -> Dict[str, Any]:
+    """Builds (or reloads) the index of the current KB and writes its snapshot."""
+    index = get_kb_index(kb_file)
+    d = snapshot_dir(kb_file)
+    try:
+        meta = json.loads((d / "meta.json").read_text(encoding="utf-8"))
+        if tuple(tuple(e) for e in meta["signature"]) == index.signature:
+            return {"ok": True, "docs": len(index), "written": False, "path": str(d)}
+    except (OSError, ValueError, KeyError):
+        pass
+    index.save_snapshot(d)
+    return {"ok": True, "docs": len(index), "written": True, "path": str(d)}
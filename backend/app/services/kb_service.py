@@ -1,44 +1,98 @@
+import asyncio
+import logging
 from typing import Any, Dict, List, Optional
-import json
 from pathlib import Path
 
+import numpy as np
+
+from app.core.paths import data_lake_dir
+from app.services.kb_index import get_kb_index
+from app.services.kb_store import segment_paths
+from app.services.vector_store import embed_query, embed_query_async, get_vector_store
+
+logger = logging.getLogger(__name__)
+
 def _kb_path() -> Path:
-    return Path(__file__).resolve().parents[2] / "data_lake" / "kb.json"
+    return data_lake_dir() / "kb.json"
+
+def _dense_store(index):
+    """Vector store utilisable avec cet index, ou None (pas construit, périmé, en retard sur la KB)."""
+    store = get_vector_store(_kb_path(), index.signature)
+    if store is None or len(store) > len(index):
+        return None
+    return store
+
+def _dense_results(
+    index, query: str, top_k: int, min_score: float, qvec: Optional[np.ndarray] = None
+) -> Optional[List[Dict[str, Any]]]:
+    """Résultats par similarité cosinus, ou None si les vecteurs ne sont pas disponibles."""
+    store = _dense_store(index)
+    if store is None:
+        return None
+    if qvec is None:
+        qvec = embed_query(query, model=store.meta.get("model"))
+    return [
+        index.result(doc, max(sim, 0.0))
+        for doc, sim in store.search(qvec, top_k=top_k)
+        if max(sim, 0.0) >= min_score
+    ]
 
-def search_kb(query: str, top_k: int = 5, min_score: float = 0.1) -> Dict[str, Any]:
+def search_kb(
+    query: str,
+    top_k: int = 5,
+    min_score: float = 0.1,
+    mode: str = "lexical",
+    qvec: Optional[np.ndarray] = None,
+) -> Dict[str, Any]:
     """
-    Simule une recherche dans kb.json.
-    En vrai, utilise un embedding ou un index (ex: FAISS, ChromaDB).
-    Ici, recherche simple par mots-clés.
+    Recherche dans la KB (segments mmap de kb_segments/, ou kb.json à défaut)
+    via un index chargé une seule fois par process et rechargé quand la KB change.
+    mode="lexical" : BM25 sur title + abstract.
+    mode="dense"   : embeddings Ollama + index IVF (cf. vector_store) ; repli
+                     sur BM25 si les vecteurs n'ont pas été construits.
+    qvec : embedding de la question déjà calculé (cf. search_kb_async).
     """
     kb_file = _kb_path()
-    if not kb_file.exists():
+    if not kb_file.exists() and not segment_paths(kb_file):
         return {"ok": False, "errors": ["KB_FILE_NOT_FOUND"], "results": []}
 
     try:
-        with open(kb_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        index = get_kb_index(kb_file)
     except Exception as e:
         return {"ok": False, "errors": [f"KB_LOAD_ERROR: {str(e)}"], "results": []}
 
-    if isinstance(data, dict):
-        items = data.get("items", [])
-    elif isinstance(data, list):
-        items = data
-    else:
-        items = []
-
-    # Simule une recherche : filtre par query dans title ou abstract
-    results = []
-    query_lower = query.lower()
-    for item in items:
-        title = (item.get("title") or "").lower()
-        abstract = (item.get("abstract") or "").lower()
-        if query_lower in title or query_lower in abstract:
-            score = 0.8  # Score fictif
-            text = f"Title: {item.get('title')}\nAbstract: {item.get('abstract')}"
-            if score >= min_score:
-                results.append({"id": item.get("id"), "text": text, "score": score})
-
-    results = sorted(results, key=lambda x: x["score"], reverse=True)[:top_k]
-    return {"ok": True, "results": results}
\ No newline at end of file
+    if mode == "dense":
+        try:
+            results = _dense_results(index, query, top_k, min_score, qvec)
+        except Exception as e:
+            logger.error(f"Dense KB search failed, falling back to lexical: {e}")
+            results = None
+        if results is not None:
+            return {"ok": True, "results": results}
+
+    results = index.search(query, top_k=top_k, min_score=min_score)
+    return {"ok": True, "results": results}
+
+def _dense_model() -> Optional[str]:
+    # Modèle d'embedding des vecteurs de la KB, ou None si la recherche dense est indisponible
+    store = _dense_store(get_kb_index(_kb_path()))
+    return store.meta.get("model") if store is not None else None
+
+async def search_kb_async(query: str, top_k: int = 5, min_score: float = 0.1, mode: str = "lexical") -> Dict[str, Any]:
+    """
+    search_kb pour les routes async. En mode dense, l'embedding de la question
+    passe par AsyncOllamaClient (slot PRIORITY_EMBED du scheduler partagé) ;
+    le calcul NumPy tourne dans un thread.
+    """
+    qvec = None
+    if mode == "dense":
+        try:
+            model = await asyncio.to_thread(_dense_model)
+            if model is not None:
+                qvec = await embed_query_async(query, model=model)
+        except Exception as e:
+            logger.error(f"Dense KB search failed, falling back to lexical: {e}")
+        if qvec is None:
+            # Pas de vecteurs (ou embedding en échec) : BM25, sans appel Ollama synchrone
+            mode = "lexical"
+    return await asyncio.to_thread(search_kb, query, top_k, min_score, mode, qvec)
@@ -0,0 +1,322 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.file_lock import FileLock, file_lock
+
+# Format d'un segment KB (.kbs), little-endian :
+#   header   : magic "DXKB", version, count, nfields, ids_offset, heap_offset
+#   offsets  : count * nfields entrées fixes (u64 offset, u32 length) dans le heap
+#   ids      : count entrées (u64 hash de l'id, u32 doc) triées par hash
+#   heap     : chaînes UTF-8 concaténées
+# Un record se lit sans décoder les autres ; le fichier est ouvert en mmap
+# read-only, donc plusieurs workers partagent les mêmes pages (page cache).
+MAGIC = b"DXKB"
+VERSION = 1
+FIELDS = ("id", "title", "abstract", "url", "meta")
+
+_HEADER = struct.Struct("<4sIIIQQ")
+_OFFSET_DTYPE = np.dtype([("off", "<u8"), ("len", "<u4")])
+_ID_DTYPE = np.dtype([("h", "<u8"), ("doc", "<u4")])
+
+SEGMENTS_DIRNAME = "kb_segments"
+SEGMENT_SUFFIX = ".kbs"
+MANIFEST_NAME = "MANIFEST.json"
+# Verrou des écritures (nouveau segment, MANIFEST), partagé par les workers
+LOCK_NAME = ".lock"
+
+Signature = Tuple[Tuple[str, int, int], ...]
+
+
+# Passages de texte intégral (pdf_service) : id "<arxiv_id>#p<n>"
+PASSAGE_SEP = "#p"
+
+
+def passage_id(parent_id: str, n: int) -> str:
+    return f"{parent_id}{PASSAGE_SEP}{n}"
+
+
+def split_passage_id(item_id: str) -> Tuple[str, Optional[int]]:
+    """(paper id, passage number) for a passage id, (item_id, None) otherwise."""
+    parent, sep, n = item_id.rpartition(PASSAGE_SEP)
+    if sep and parent and n.isdigit():
+        return parent, int(n)
+    return item_id, None
+
+
+def id_hash(item_id: str) -> int:
+    return int.from_bytes(hashlib.blake2b(item_id.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def record_from_item(item: Dict[str, Any]) -> Tuple[str, ...]:
+    """Maps a kb.json / arXiv item onto the fixed FIELDS of a segment record."""
+    item_id = item.get("id") or item.get("arxiv_id") or ""
+    url = item.get("url") or item.get("abs_url") or ""
+    extra = {k: v for k, v in item.items() if k not in ("id", "title", "abstract", "url")}
+    return (
+        str(item_id),
+        item.get("title") or "",
+        item.get("abstract") or "",
+        url,
+        json.dumps(extra, ensure_ascii=False, separators=(",", ":")) if extra else "",
+    )
+
+
+def write_segment(path: Path, items: Iterable[Dict[str, Any]]) -> int:
+    """Writes items as one segment file (atomic replace). Returns the record count."""
+    records = [record_from_item(it) for it in items]
+    count, nfields = len(records), len(FIELDS)
+
+    offsets = np.zeros(count * nfields, dtype=_OFFSET_DTYPE)
+    heap = bytearray()
+    for i, rec in enumerate(records):
+        for f, value in enumerate(rec):
+            data = value.encode("utf-8")
+            offsets[i * nfields + f] = (len(heap), len(data))
+            heap += data
+
+    ids = np.zeros(count, dtype=_ID_DTYPE)
+    ids["h"] = [id_hash(rec[0]) for rec in records]
+    ids["doc"] = np.arange(count, dtype=np.uint32)
+    ids = ids[np.argsort(ids["h"], kind="stable")]
+
+    ids_offset = _HEADER.size + offsets.nbytes
+    heap_offset = ids_offset + ids.nbytes
+
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, count, nfields, ids_offset, heap_offset))
+        f.write(offsets.tobytes())
+        f.write(ids.tobytes())
+        f.write(heap)
+    os.replace(tmp, path)
+    return count
+
+
+class Segment:
+    """Read-only, memory-mapped view on one segment file."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        with open(path, "rb") as f:
+            # mmap refuse les fichiers vides : un segment a toujours au moins un header
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, nfields, ids_offset, heap_offset = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION or nfields != len(FIELDS):
+            raise ValueError(f"Not a KB segment (v{VERSION}): {path}")
+        self.count = count
+        self._offsets = np.frombuffer(self._mm, dtype=_OFFSET_DTYPE, count=count * nfields, offset=_HEADER.size)
+        self._ids = np.frombuffer(self._mm, dtype=_ID_DTYPE, count=count, offset=ids_offset)
+        self._heap_offset = heap_offset
+
+    def __len__(self) -> int:
+        return self.count
+
+    def get_field(self, doc: int, name: str) -> str:
+        off, length = self._offsets[doc * len(FIELDS) + FIELDS.index(name)]
+        start = self._heap_offset + int(off)
+        return self._mm[start:start + int(length)].decode("utf-8")
+
+    def get(self, doc: int) -> Dict[str, Any]:
+        rec = {name: self.get_field(doc, name) for name in FIELDS}
+        meta = rec.pop("meta")
+        out: Dict[str, Any] = json.loads(meta) if meta else {}
+        out.update(rec)
+        out["id"] = rec["id"] or None
+        return out
+
+    def find(self, item_id: str) -> Optional[int]:
+        """Local doc number for an id (binary search on the hash table), or None."""
+        h = id_hash(item_id)
+        pos = int(np.searchsorted(self._ids["h"], h))
+        while pos < self.count and int(self._ids["h"][pos]) == h:
+            doc = int(self._ids["doc"][pos])
+            if self.get_field(doc, "id") == item_id:
+                return doc
+            pos += 1
+        return None
+
+
+class KBStore:
+    """Concatenation of segments; doc numbers are global across segments."""
+
+    def __init__(self, paths: List[Path]) -> None:
+        self.segments = [Segment(p) for p in paths]
+        self._starts = np.cumsum([0] + [len(s) for s in self.segments])
+
+    def __len__(self) -> int:
+        return int(self._starts[-1])
+
+    def extended(self, kb_file: Path) -> "KBStore":
+        """New store with the segments added since this one was opened (the old mmaps are reused)."""
+        known = {seg.path.name: seg for seg in self.segments}
+        store = KBStore([])
+        store.segments = [known.get(p.name) or Segment(p) for p in segment_paths(kb_file)]
+        store._starts = np.cumsum([0] + [len(s) for s in store.segments])
+        return store
+
+    def _locate(self, doc: int) -> Tuple[Segment, int]:
+        seg = int(np.searchsorted(self._starts, doc, side="right")) - 1
+        return self.segments[seg], doc - int(self._starts[seg])
+
+    def get_field(self, doc: int, name: str) -> str:
+        seg, local = self._locate(doc)
+        return seg.get_field(local, name)
+
+    def get(self, doc: int) -> Dict[str, Any]:
+        seg, local = self._locate(doc)
+        return seg.get(local)
+
+    def find(self, item_id: str) -> Optional[int]:
+        for start, seg in zip(self._starts, self.segments):
+            local = seg.find(item_id)
+            if local is not None:
+                return int(start) + local
+        return None
+
+
+class JsonKB:
+    """Same interface as KBStore over the legacy kb.json ({"items": [...]} or list)."""
+
+    def __init__(self, kb_file: Path) -> None:
+        with open(kb_file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            self.items = data.get("items", [])
+        elif isinstance(data, list):
+            self.items = data
+        else:
+            self.items = []
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def get_field(self, doc: int, name: str) -> str:
+        return record_from_item(self.items[doc])[FIELDS.index(name)]
+
+    def get(self, doc: int) -> Dict[str, Any]:
+        return self.items[doc]
+
+    def find(self, item_id: str) -> Optional[int]:
+        for doc in range(len(self.items)):
+            if self.get_field(doc, "id") == item_id:
+                return doc
+        return None
+
+
+def segments_dir(kb_file: Path) -> Path:
+    return kb_file.parent / SEGMENTS_DIRNAME
+
+
+def segment_paths(kb_file: Path) -> List[Path]:
+    """Active segments in doc order (the MANIFEST list, or every .kbs without one)."""
+    d = segments_dir(kb_file)
+    manifest = d / MANIFEST_NAME
+    if manifest.exists():
+        names = json.loads(manifest.read_text(encoding="utf-8")).get("segments", [])
+        return [d / name for name in names]
+    if not d.is_dir():
+        return []
+    return sorted(p for p in d.iterdir() if p.suffix == SEGMENT_SUFFIX)
+
+
+def write_lock(kb_file: Path) -> FileLock:
+    """
+    Inter-process lock of the KB writers: segment numbering and writing, the
+    MANIFEST, and every read-then-write on top of them (ingestion, compaction).
+    """
+    return file_lock(segments_dir(kb_file) / LOCK_NAME)
+
+
+def _write_manifest(kb_file: Path, paths: List[Path]) -> None:
+    d = segments_dir(kb_file)
+    tmp = d / (MANIFEST_NAME + ".tmp")
+    tmp.write_text(json.dumps({"segments": [p.name for p in paths]}, indent=2), encoding="utf-8")
+    os.replace(tmp, d / MANIFEST_NAME)
+
+
+def _next_segment_path(kb_file: Path) -> Path:
+    d = segments_dir(kb_file)
+    numbers = [int(p.stem.split("_")[-1]) for p in d.glob(f"seg_*{SEGMENT_SUFFIX}")]
+    return d / f"seg_{max(numbers, default=-1) + 1:06d}{SEGMENT_SUFFIX}"
+
+
+def _remove_orphans(kb_file: Path) -> None:
+    # Sous Windows un segment encore mappé ne peut pas être supprimé :
+    # il reste hors MANIFEST et sera retiré à un prochain passage
+    active = {p.name for p in segment_paths(kb_file)}
+    for p in segments_dir(kb_file).glob(f"*{SEGMENT_SUFFIX}"):
+        if p.name not in active:
+            try:
+                p.unlink()
+            except OSError:
+                pass
+
+
+def append_segment(kb_file: Path, items: Iterable[Dict[str, Any]]) -> Path:
+    """Writes items as a new segment at the end of the KB."""
+    with write_lock(kb_file):
+        out_path = _next_segment_path(kb_file)
+        write_segment(out_path, items)
+        # Sans MANIFEST, segment_paths() liste le dossier, qui contient déjà out_path
+        _write_manifest(kb_file, [p for p in segment_paths(kb_file) if p != out_path] + [out_path])
+    return out_path
+
+
+def replace_segments(kb_file: Path, old: List[Path], items: Iterable[Dict[str, Any]]) -> Path:
+    """
+    Replaces consecutive segments `old` by one segment holding `items`, at
+    the same position (doc order is kept if items follows that order).
+    """
+    with write_lock(kb_file):
+        out_path = _next_segment_path(kb_file)
+        write_segment(out_path, items)
+        paths = segment_paths(kb_file)
+        pos = paths.index(old[0])
+        _write_manifest(kb_file, paths[:pos] + [out_path] + [p for p in paths[pos:] if p not in old])
+        _remove_orphans(kb_file)
+    return out_path
+
+
+def kb_signature(kb_file: Path) -> Signature:
+    """(name, mtime_ns, size) of every file backing the KB, in doc order."""
+    paths = segment_paths(kb_file) or [kb_file]
+    sig = []
+    for p in paths:
+        st = os.stat(p)
+        sig.append((p.name, st.st_mtime_ns, st.st_size))
+    return tuple(sig)
+
+
+def open_kb(kb_file: Path):
+    """Segmented store when kb_segments/ exists, legacy kb.json otherwise."""
+    paths = segment_paths(kb_file)
+    if paths:
+        return KBStore(paths)
+    return JsonKB(kb_file)
+
+
+def convert_kb_json(kb_file: Path) -> Dict[str, Any]:
+    """Converts kb.json into the first segment of kb_segments/ (replaces existing segments)."""
+    items = JsonKB(kb_file).items
+    segments_dir(kb_file).mkdir(parents=True, exist_ok=True)
+    with write_lock(kb_file):
+        out_path = _next_segment_path(kb_file)
+        count = write_segment(out_path, items)
+        _write_manifest(kb_file, [out_path])
+        _remove_orphans(kb_file)
+    return {"ok": True, "count": count, "saved_to": str(out_path)}
+
+
+if __name__ == "__main__":
+    from app.services.kb_service import _kb_path
+
+    print(json.dumps(convert_kb_json(_kb_path()), indent=2))
@@ -0,0 +1,361 @@
+"""
+Full text of the KB papers: PDF download, extraction, passages.
+
+Usage:
+    cd backend
+    python -m app.services.pdf_service --limit 200          # KB papers without passages
+    PDF_BASE_URL=http://127.0.0.1:8000 python -m app.services.pdf_service   # local file server
+
+PDFs are downloaded with a bounded number of in-flight requests
+(PDF_DOWNLOAD_CONCURRENCY) and a maximum size (PDF_MAX_BYTES). Text is
+extracted in a ProcessPoolExecutor (pypdf, optional), so parsing does not hold
+the API's GIL. It is split into overlapping passages, appended to the KB in
+batches (ingest_service.ingest_passages) and indexed incrementally like the
+rest: search_kb then returns passage-level hits.
+With PDF_INGEST=1, papers found by scrape_arxiv are processed in the
+background by the API.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import io
+import json
+import logging
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Iterable, List, Optional, Set
+from urllib.parse import urlsplit
+
+from app.core import metrics
+from app.core.http_pool import get_async_client
+from app.services import ingest_service
+from app.services.kb_index import get_kb_index
+from app.services.kb_service import _kb_path
+from app.services.kb_store import passage_id, segment_paths, split_passage_id
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # dépendance optionnelle : sans elle, le pipeline ne fait rien
+    PdfReader = None
+
+logger = logging.getLogger(__name__)
+
+_CONCURRENCY = int(os.getenv("PDF_DOWNLOAD_CONCURRENCY", "2"))
+_WORKERS = int(os.getenv("PDF_WORKERS", "1"))
+_MAX_BYTES = int(os.getenv("PDF_MAX_BYTES", str(20 * 1024 * 1024)))
+_TIMEOUT_S = 60.0
+# Passages de ~PASSAGE_WORDS mots, chacun reprend les PASSAGE_OVERLAP derniers mots du précédent
+PASSAGE_WORDS = int(os.getenv("PDF_PASSAGE_WORDS", "180"))
+PASSAGE_OVERLAP = int(os.getenv("PDF_PASSAGE_OVERLAP", "40"))
+_MAX_PASSAGES = 400
+# Papiers par segment KB écrit
+_BATCH_PAPERS = 20
+_MAX_QUEUE = 1000
+
+_HYPHEN_RE = re.compile(r"(\w)-\n(\w)")
+_SPACE_RE = re.compile(r"\s+")
+_REFERENCES_RE = re.compile(r"\n\s*(?:references|bibliography)\s*\n", re.IGNORECASE)
+
+
+def pdf_url(paper: Dict[str, Any]) -> str:
+    """PDF url of a paper; PDF_BASE_URL replaces scheme and host (local server, mirror)."""
+    url = paper.get("pdf_url") or f"https://arxiv.org/pdf/{paper['arxiv_id']}"
+    base = os.getenv("PDF_BASE_URL")
+    if base:
+        parts = urlsplit(url)
+        url = base.rstrip("/") + parts.path + (f"?{parts.query}" if parts.query else "")
+    return url
+
+
+def split_passages(text: str, size: int = PASSAGE_WORDS, overlap: int = PASSAGE_OVERLAP) -> List[str]:
+    """Overlapping word windows over the cleaned text (bibliography excluded)."""
+    text = _HYPHEN_RE.sub(r"\1\2", text)
+    refs = list(_REFERENCES_RE.finditer(text))
+    if refs and refs[-1].start() > len(text) // 2:
+        text = text[:refs[-1].start()]
+    words = _SPACE_RE.sub(" ", text).split()
+    step = max(1, size - overlap)
+    passages = []
+    for start in range(0, max(len(words) - overlap, 1), step):
+        chunk = words[start:start + size]
+        if chunk:
+            passages.append(" ".join(chunk))
+        if len(passages) >= _MAX_PASSAGES:
+            break
+    return passages
+
+
+def extract_passages(data: bytes) -> List[str]:
+    """Worker process: PDF bytes -> passages."""
+    if PdfReader is None:
+        raise RuntimeError("PYPDF_NOT_INSTALLED")
+    reader = PdfReader(io.BytesIO(data))
+    text = "\n".join((page.extract_text() or "") for page in reader.pages)
+    return split_passages(text)
+
+
+def _paper(item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Paper to process from a KB record or an arXiv item, or None (not an arXiv paper)."""
+    arxiv_id = ingest_service.item_arxiv_id(item) or (item.get("id") or "")
+    if not arxiv_id or split_passage_id(arxiv_id)[1] is not None:
+        return None
+    return {
+        "arxiv_id": arxiv_id,
+        "title": item.get("title") or "",
+        "url": item.get("abs_url") or item.get("url") or "",
+        "pdf_url": item.get("pdf_url") or "",
+        "theme": item.get("theme"),
+    }
+
+
+async def _download(url: str) -> bytes:
+    """GET with a size cap, streamed: an oversized file is cut off without being held in memory."""
+    async with get_async_client().stream("GET", url, timeout=_TIMEOUT_S, follow_redirects=True) as r:
+        if r.status_code != 200:
+            raise RuntimeError(f"PDF_HTTP_{r.status_code}")
+        if int(r.headers.get("content-length") or 0) > _MAX_BYTES:
+            raise RuntimeError("PDF_TOO_LARGE")
+        chunks: List[bytes] = []
+        size = 0
+        async for chunk in r.aiter_bytes():
+            size += len(chunk)
+            if size > _MAX_BYTES:
+                raise RuntimeError("PDF_TOO_LARGE")
+            chunks.append(chunk)
+    data = b"".join(chunks)
+    if not data.startswith(b"%PDF"):
+        raise RuntimeError("NOT_A_PDF")
+    return data
+
+
+class PdfPipeline:
+    """
+    Download -> extraction (process pool) -> passages -> KB, by batches.
+    Used by the CLI (process()) and by the API as a background task (start / enqueue).
+    """
+
+    def __init__(
+        self,
+        concurrency: int = _CONCURRENCY,
+        workers: int = _WORKERS,
+        batch_papers: int = _BATCH_PAPERS,
+    ) -> None:
+        self.concurrency = concurrency
+        self.workers = workers
+        self.batch_papers = batch_papers
+        self.counters = {"queued": 0, "dropped": 0, "indexed": 0, "skipped": 0, "failed": 0, "passages": 0, "bytes": 0}
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional["asyncio.Queue[Dict[str, Any]]"] = None
+        self._task: Optional["asyncio.Task[None]"] = None
+        # Échecs (404, PDF illisible...) : pas de nouvel essai dans ce process
+        self._failed: Set[str] = set()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn : le process de l'API a des threads, un fork pourrait hériter d'un verrou pris
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    async def _fetch(self, paper: Dict[str, Any], sem: asyncio.Semaphore) -> Dict[str, Any]:
+        # Le sémaphore couvre aussi l'extraction : les PDF en mémoire restent bornés
+        async with sem:
+            with metrics.timed("pdf_stage_latency_ms", stage="download"):
+                data = await _download(pdf_url(paper))
+            self.counters["bytes"] += len(data)
+            pool = self._get_pool()
+            try:
+                with metrics.timed("pdf_stage_latency_ms", stage="extract"):
+                    passages = await asyncio.get_running_loop().run_in_executor(pool, extract_passages, data)
+            except BrokenProcessPool:
+                # Worker tué (PDF pathologique, OOM) : pool recréé pour les suivants
+                if self._pool is pool:
+                    self._pool = None
+                raise
+        return {**paper, "passages": passages}
+
+    async def _index(self, ready: List[Dict[str, Any]]) -> None:
+        with metrics.timed("pdf_stage_latency_ms", stage="index"):
+            result = await asyncio.to_thread(ingest_service.ingest_passages, ready)
+        if not result["ok"]:
+            logger.error(f"PDF passages ingestion failed: {result['errors']}")
+            self.counters["failed"] += len(ready)
+            return
+        self.counters["indexed"] += result["added"]
+        self.counters["skipped"] += result["skipped"]
+        self.counters["passages"] += result.get("passages", 0)
+
+    def _pending(self, papers: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Papers not yet in the KB as passages (nor already failed)."""
+        kb_file = _kb_path()
+        if not kb_file.exists() and not segment_paths(kb_file):
+            return []
+        store = get_kb_index(kb_file).store
+        out, seen = [], set()
+        for paper in papers:
+            arxiv_id = paper["arxiv_id"]
+            if arxiv_id in seen or arxiv_id in self._failed or store.find(passage_id(arxiv_id, 0)) is not None:
+                self.counters["skipped"] += 1
+                continue
+            seen.add(arxiv_id)
+            out.append(paper)
+        return out
+
+    async def process(self, papers: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        """Processes papers, writing passages to the KB every batch_papers papers."""
+        t0 = time.perf_counter()
+        todo = await asyncio.to_thread(self._pending, list(papers))
+        sem = asyncio.Semaphore(self.concurrency)
+        errors: List[str] = []
+
+        async def one(paper: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+            try:
+                return await self._fetch(paper, sem)
+            except Exception as e:
+                logger.warning(f"PDF {paper['arxiv_id']} skipped: {e}")
+                self._failed.add(paper["arxiv_id"])
+                self.counters["failed"] += 1
+                errors.append(f"{paper['arxiv_id']}: {e}")
+                return None
+
+        ready: List[Dict[str, Any]] = []
+        for fut in asyncio.as_completed([one(p) for p in todo]):
+            paper = await fut
+            if paper is None:
+                continue
+            ready.append(paper)
+            if len(ready) >= self.batch_papers:
+                await self._index(ready)
+                ready = []
+        if ready:
+            await self._index(ready)
+
+        return {
+            "ok": not errors,
+            "errors": errors,
+            "papers": len(todo),
+            "elapsed_s": round(time.perf_counter() - t0, 1),
+            **self.counters,
+        }
+
+    # ---- Tâche de fond de l'API ----
+
+    def start(self) -> None:
+        """Starts the background worker (PDF_INGEST=1), from the API's event loop."""
+        if os.getenv("PDF_INGEST", "0") != "1" or self._task is not None:
+            return
+        if PdfReader is None:
+            logger.warning("PDF_INGEST=1 but pypdf is not installed, PDF pipeline disabled")
+            return
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=_MAX_QUEUE)
+        self._task = asyncio.create_task(self._worker())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._loop = None
+        if self._pool is not None:
+            await asyncio.to_thread(self._pool.shutdown, True, cancel_futures=True)
+            self._pool = None
+
+    def enqueue(self, items: Iterable[Dict[str, Any]]) -> None:
+        """Queues papers for the background worker; callable from a thread (ingestion)."""
+        loop = self._loop
+        if loop is None:
+            return
+        papers = [p for p in map(_paper, items) if p is not None]
+        try:
+            loop.call_soon_threadsafe(self._put, papers)
+        except RuntimeError:
+            pass  # boucle fermée (arrêt de l'API)
+
+    def _put(self, papers: List[Dict[str, Any]]) -> None:
+        for paper in papers:
+            try:
+                self._queue.put_nowait(paper)
+                self.counters["queued"] += 1
+            except asyncio.QueueFull:
+                self.counters["dropped"] += 1
+
+    async def _worker(self) -> None:
+        while True:
+            # Un lot = tout ce qui attend, dans la limite de batch_papers
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_papers and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                await self.process(batch)
+            except Exception as e:
+                logger.error(f"PDF pipeline batch failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self._task is not None,
+            "pending": self._queue.qsize() if self._queue is not None else 0,
+            **self.counters,
+        }
+
+
+pdf_pipeline = PdfPipeline()
+
+
+def papers_without_passages(limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """KB papers (arXiv records, not passages) that have no full-text passage yet."""
+    kb_file = _kb_path()
+    if not kb_file.exists() and not segment_paths(kb_file):
+        return []
+    store = get_kb_index(kb_file).store
+    out: List[Dict[str, Any]] = []
+    for doc in range(len(store)):
+        item_id = store.get_field(doc, "id")
+        if not item_id or split_passage_id(item_id)[1] is not None:
+            continue
+        if store.find(passage_id(item_id, 0)) is not None:
+            continue
+        paper = _paper(store.get(doc))
+        if paper is not None:
+            out.append(paper)
+            if limit is not None and len(out) >= limit:
+                break
+    return out
+
+
+async def _backfill(papers: List[Dict[str, Any]], pipeline: PdfPipeline) -> Dict[str, Any]:
+    try:
+        return await pipeline.process(papers)
+    finally:
+        await pipeline.stop()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Download, extract and index the PDFs of the KB papers.")
+    parser.add_argument("--limit", type=int, default=None, help="papiers max pour cette exécution")
+    parser.add_argument("--concurrency", type=int, default=_CONCURRENCY, help="téléchargements en vol")
+    parser.add_argument("--workers", type=int, default=_WORKERS, help="process d'extraction")
+    parser.add_argument("--batch-papers", type=int, default=_BATCH_PAPERS, help="papiers par segment KB écrit")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if PdfReader is None:
+        print(json.dumps({"ok": False, "errors": ["PYPDF_NOT_INSTALLED"]}, indent=2))
+        return
+    pipeline = PdfPipeline(concurrency=args.concurrency, workers=args.workers, batch_papers=args.batch_papers)
+    result = asyncio.run(_backfill(papers_without_passages(args.limit), pipeline))
+    print(json.dumps(result, indent=2))
+    # Laisse finir les embeddings / compactions lancés par l'ingestion
+    ingest_service.wait_background_tasks()
+
+
+if __name__ == "__main__":
+    main()
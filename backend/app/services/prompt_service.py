@@ -1,73 +1,188 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List
-
-
-def build_kb_context(results: List[Dict[str, Any]], max_chars: int = 12000) -> str:
-    chunks: List[str] = []
-    total = 0
-    for i, r in enumerate(results, start=1):
-        block = (
-            f"[KB {i}] id={r.get('id','')}\n"
-            f"score={r.get('score','')}\n"
-            f"text:\n{(r.get('text','') or '').strip()}\n"
-        )
-        if total + len(block) > max_chars:
-            break
-        chunks.append(block)
-        total += len(block)
-    return "\n".join(chunks)
-
-
-def build_arxiv_context(items: List[Dict[str, Any]], max_chars: int = 12000) -> str:
-    chunks: List[str] = []
-    total = 0
-    for i, it in enumerate(items, start=1):
-        block = (
-            f"[PAPER {i}]\n"
-            f"arxiv_id: {it.get('arxiv_id','')}\n"
-            f"title: {it.get('title','')}\n"
-            f"submitted_date: {it.get('submitted_date','')}\n"
-            f"abs_url: {it.get('abs_url','')}\n"
-            f"pdf_url: {it.get('pdf_url','')}\n"
-            f"abstract: {it.get('abstract','')}\n"
-        )
-        if total + len(block) > max_chars:
-            break
-        chunks.append(block)
-        total += len(block)
-    return "\n".join(chunks)
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.integrations.mcp.schemas import ArxivMetadataItem
+from app.services.dedup_service import DEDUP_THRESHOLD, minhash_signatures, similarity
+
+# Estimation de tokens sans tokenizer : un morceau de mot (<= 4 caractères)
+# ou un signe de ponctuation ~ un token BPE. Légèrement pessimiste, c'est voulu.
+_PIECE_RE = re.compile(r"\w{1,4}|[^\w\s]", re.UNICODE)
+_ARXIV_VERSION_RE = re.compile(r"v\d+$")
+_TITLE_RE = re.compile(r"\W+", re.UNICODE)
+
+# Budget de contexte (tokens) par modèle : num_ctx moins les instructions et num_predict
+_DEFAULT_CONTEXT_BUDGET = 2800
+MODEL_CONTEXT_BUDGETS: Dict[str, int] = {
+    "qwen3:1.7b": 2800,
+}
+
+# Préfixe statique, identique octet pour octet d'une requête à l'autre : Ollama
+# réutilise son cache KV sur ce préfixe. Rien de variable ne doit y entrer.
+_STRICT_PREFIX = (
+    "Tu es un assistant de recherche.\n"
+    "Tu dois répondre UNIQUEMENT à partir du CONTEXTE fourni.\n"
+    "Si une info n'est pas dans le contexte, dis: \"Je ne peux pas l'affirmer avec ce contexte\".\n"
+    "\n"
+    "Format demandé:\n"
+    "1) Réponse courte (3-6 lignes)\n"
+    "2) Points clés (5 bullets)\n"
+    "3) Sources (liste courte)\n"
+    "\n"
+)
+
+
+def estimate_tokens(text: str) -> int:
+    return len(_PIECE_RE.findall(text or ""))
+
+
+def context_budget(model: Optional[str]) -> int:
+    """Token budget for the packed context of `model` (CONTEXT_TOKEN_BUDGET overrides)."""
+    if os.getenv("CONTEXT_TOKEN_BUDGET"):
+        return int(os.getenv("CONTEXT_TOKEN_BUDGET"))
+    return MODEL_CONTEXT_BUDGETS.get(model or "", _DEFAULT_CONTEXT_BUDGET)
+
+
+def _kb_block(i: int, r: Dict[str, Any], with_title: bool = True) -> str:
+    text = (r.get('text', '') or '').strip()
+    if not with_title:
+        # Passage d'un papier déjà cité plus haut : sans la ligne "Title:"
+        text = text.partition("\n")[2]
+    return (
+        f"[KB {i}] id={r.get('id','')}\n"
+        f"score={r.get('score','')}\n"
+        f"text:\n{text}\n"
+    )
+
+
+def _arxiv_block(i: int, it: ArxivMetadataItem) -> str:
+    return (
+        f"[PAPER {i}]\n"
+        f"arxiv_id: {it.arxiv_id}\n"
+        f"title: {it.title}\n"
+        f"submitted_date: {it.submitted_date}\n"
+        f"abs_url: {it.abs_url}\n"
+        f"pdf_url: {it.pdf_url}\n"
+        f"abstract: {it.abstract}\n"
+    )
+
+
+def _dedup_keys(item_id: str, title: str) -> List[str]:
+    keys = []
+    item_id = _ARXIV_VERSION_RE.sub("", (item_id or "").strip().rsplit("/abs/", 1)[-1])
+    if item_id:
+        keys.append("id:" + item_id)
+    title = _TITLE_RE.sub(" ", (title or "").lower()).strip()
+    if title:
+        keys.append("title:" + title)
+    return keys
+
+
+def pack_context(
+    kb_results: List[Dict[str, Any]],
+    arxiv_items: List[ArxivMetadataItem],
+    budget_tokens: int,
+) -> Tuple[str, int]:
+    """
+    Context for build_strict_prompt within `budget_tokens`: KB hits by score,
+    then arXiv items in API order, each paper once (same id without version,
+    or same title). Full-text passages of one paper are all kept, the title
+    only repeated on the first. A near-duplicate (MinHash, other id:
+    cross-list, other version) of an item already kept is dropped.
+    Returns (context, estimated tokens).
+    """
+    seen = set()
+    titled = set()
+    kb_blocks: List[str] = []
+    arxiv_blocks: List[str] = []
+    used = 0
+
+    candidates = [("kb", r) for r in sorted(kb_results, key=lambda r: -float(r.get("score") or 0.0))]
+    candidates += [("arxiv", it) for it in arxiv_items]
+    sigs, valid = minhash_signatures([
+        item.get("text", "") if source == "kb" else f"Title: {item.title}\nAbstract: {item.abstract}"
+        for source, item in candidates
+    ])
+    packed: List[int] = []
+
+    for k, (source, item) in enumerate(candidates):
+        parent = item.get("parent_id") if source == "kb" else None
+        if parent:
+            paper_keys = _dedup_keys(parent, item.get("title", ""))
+            keys = ["passage:" + str(item.get("id"))]
+        elif source == "kb":
+            keys = paper_keys = _dedup_keys(str(item.get("id") or ""), item.get("title", ""))
+        else:
+            keys = paper_keys = _dedup_keys(item.arxiv_id, item.title)
+        if seen.intersection(keys):
+            continue
+        # Les passages d'un même papier se chevauchent par construction : hors comparaison
+        compare = bool(valid[k]) and not parent
+        if compare and any(similarity(sigs[k], sigs[j]) >= DEDUP_THRESHOLD for j in packed):
+            continue
+
+        if source == "kb":
+            block = _kb_block(len(kb_blocks) + 1, item, with_title=not (parent and parent in titled))
+        else:
+            block = _arxiv_block(len(arxiv_blocks) + 1, item)
+        cost = estimate_tokens(block)
+        if used + cost > budget_tokens:
+            continue  # trop long : un item suivant plus court peut encore tenir
+        (kb_blocks if source == "kb" else arxiv_blocks).append(block)
+        seen.update(keys)
+        seen.update(paper_keys)
+        if parent:
+            titled.add(parent)
+        if compare:
+            packed.append(k)
+        used += cost
+
+    context = "\n".join(kb_blocks)
+    if arxiv_blocks:
+        context += ("\n\n" if context else "") + "\n".join(arxiv_blocks)
+    return context, used
 
 
 def build_strict_prompt(question: str, context: str) -> str:
+    # Préfixe statique, puis contexte, puis question en dernier
     return (
-        "Tu es un assistant de recherche.\n"
-        "Tu dois répondre UNIQUEMENT à partir du CONTEXTE fourni.\n"
-        "Si une info n'est pas dans le contexte, dis: \"Je ne peux pas l'affirmer avec ce contexte\".\n"
-        "\n"
-        "Format demandé:\n"
-        "1) Réponse courte (3-6 lignes)\n"
-        "2) Points clés (5 bullets)\n"
-        "3) Sources (liste courte)\n"
-        "\n"
-        f"QUESTION:\n{question}\n\n"
-        f"CONTEXTE:\n{context}\n"
+        _STRICT_PREFIX
+        + f"CONTEXTE:\n{context}\n\n"
+        + f"QUESTION:\n{question}\n"
     )
 
 
-def normalize_sources(kb_results: List[Dict[str, Any]], arxiv_items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def build_followup_prompt(question: str) -> str:
+    # Tour suivant d'une session : consignes, CONTEXTE et échanges précédents
+    # sont déjà dans le contexte Ollama, seule la nouvelle question est préremplie
+    return f"QUESTION (suite de la conversation, même CONTEXTE, même format):\n{question}\n"
+
+
+def normalize_sources(kb_results: List[Dict[str, Any]], arxiv_items: List[ArxivMetadataItem]) -> List[Dict[str, Any]]:
     sources: List[Dict[str, Any]] = []
+    seen = set()
 
     for item in kb_results:
+        # Plusieurs passages d'un même papier : une seule source
+        keys = _dedup_keys(str(item.get("parent_id") or item.get("id") or ""), item.get("title", ""))
+        if seen.intersection(keys):
+            continue
+        seen.update(keys)
         sources.append({
             "title": item.get("title") or item.get("id"),
             "url": item.get("url") or "",
         })
 
     for item in arxiv_items:
+        keys = _dedup_keys(item.arxiv_id, item.title)
+        if seen.intersection(keys):
+            continue
+        seen.update(keys)
         sources.append({
-            "title": item["title"],
-            "url": item["abs_url"],
+            "title": item.title,
+            "url": item.abs_url,
         })
 
     return sources[:10]
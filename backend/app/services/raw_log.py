@@ -0,0 +1,284 @@
+"""
+Append-only compressed log for raw scrape results.
+
+Replaces the arxiv_raw_{ts}.json files (one per call, overwritten within the
+same second, millions of inodes) with rotating gzip JSONL segments under
+data_lake/raw/cache/raw_log/:
+  - one record = one gzip member (the segment stays a .jsonl.gz readable by zcat);
+  - writes happen on a background thread: the request only enqueues;
+  - index.tsv (query_hash, segment, offset, length, date) to read back the
+    latest result of a query without decompressing the whole log;
+  - retention: segments older than RAW_LOG_RETENTION_DAYS or beyond
+    RAW_LOG_MAX_SEGMENTS are deleted, then the index is rewritten without them.
+With several workers (app.serve), each process has its own writer: a batch of
+records is written under a file lock (raw_log/.lock), segment and index opened
+for the batch then closed, and retention rewrites the on-disk index (entries
+of every worker). A worker only reads its own entries and those present at
+its last index rewrite.
+"""
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.core.file_lock import FileLock, file_lock
+from app.core.paths import data_lake_dir
+
+logger = logging.getLogger(__name__)
+
+_SEGMENT_GLOB = "raw_*.jsonl.gz"
+_INDEX_NAME = "index.tsv"
+_LOCK_NAME = ".lock"
+
+# (segment, offset, longueur, stored_at)
+_IndexEntry = Tuple[str, int, int, float]
+
+
+def _log_dir() -> Path:
+    return data_lake_dir() / "raw" / "cache" / "raw_log"
+
+
+def query_key(search_url: str) -> str:
+    """Hash of the arXiv query URL (same query => same key)."""
+    return hashlib.sha256(search_url.encode("utf-8")).hexdigest()
+
+
+class RawLog:
+    def __init__(
+        self,
+        root: Optional[Path] = None,
+        segment_bytes: int = 64 * 1024 * 1024,
+        max_segments: int = 64,
+        retention_s: float = 30 * 24 * 3600,
+    ) -> None:
+        self._root = root
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        self.retention_s = retention_s
+
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._index_lock = threading.Lock()
+        self._index: Dict[str, _IndexEntry] = {}
+        self._loaded = False
+
+        self._segment: Optional[Path] = None
+        self._fh = None
+        self._index_fh = None
+        self._file_lock: Optional[FileLock] = None
+        self.counters = {"queued": 0, "written": 0, "bytes": 0, "rotations": 0, "segments_dropped": 0, "errors": 0}
+
+    def dir(self) -> Path:
+        if self._root is None:
+            self._root = _log_dir()
+        self._root.mkdir(parents=True, exist_ok=True)
+        return self._root
+
+    def segments(self) -> List[Path]:
+        return sorted(self.dir().glob(_SEGMENT_GLOB))
+
+    def _lock(self) -> FileLock:
+        if self._file_lock is None:
+            self._file_lock = file_lock(self.dir() / _LOCK_NAME)
+        return self._file_lock
+
+    # ---- écriture (thread de fond) ----
+
+    def append(self, record: Dict[str, Any]) -> str:
+        """Queues one record and returns its query key; never touches the disk."""
+        key = query_key(record.get("last_search_url", ""))
+        self._ensure_started()
+        self._queue.put({**record, "query_key": key, "stored_at": time.time()})
+        self.counters["queued"] += 1
+        return key
+
+    def _ensure_started(self) -> None:
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="raw-log-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        try:
+            with self._lock():
+                self._load_index()
+                self._rewrite_index()
+                self._apply_retention()
+        except Exception as e:
+            logger.error(f"raw log startup failed: {e}")
+        stopping = False
+        while not stopping:
+            # Un lot = tout ce qui attend : un seul passage sous le verrou
+            batch = [self._queue.get()]
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            if None in batch:
+                stopping = True
+                batch = [r for r in batch if r is not None]
+            if batch:
+                self._write_batch(batch)
+
+    def _write_batch(self, batch: List[Dict[str, Any]]) -> None:
+        # Fichiers ouverts pour le lot seulement : un autre worker peut avoir
+        # tourné de segment, réécrit l'index ou supprimé des segments entre deux lots
+        with self._lock():
+            try:
+                for record in batch:
+                    try:
+                        self._write(record)
+                    except Exception as e:
+                        self.counters["errors"] += 1
+                        logger.error(f"raw log write failed: {e}")
+            finally:
+                try:
+                    # Flush (sans fsync) en fin de lot : relisible par get()
+                    self._close_files(fsync=False)
+                except OSError as e:
+                    self.counters["errors"] += 1
+                    logger.error(f"raw log flush failed: {e}")
+
+    def _open_segment(self) -> None:
+        segments = self.segments()
+        last = int(segments[-1].name.split("_")[1].split(".")[0]) if segments else -1
+        if segments and segments[-1].stat().st_size < self.segment_bytes:
+            self._segment = segments[-1]
+        else:
+            self._segment = self.dir() / f"raw_{last + 1:06d}.jsonl.gz"
+        self._fh = open(self._segment, "ab")
+        self._index_fh = open(self.dir() / _INDEX_NAME, "a", encoding="utf-8")
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        if self._fh is None:
+            self._open_segment()
+        line = json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+        blob = gzip.compress(line, compresslevel=6)
+        # Fin réelle du fichier (mode append), même si un autre worker vient d'y écrire
+        self._fh.seek(0, os.SEEK_END)
+        offset = self._fh.tell()
+        self._fh.write(blob)
+
+        entry = (self._segment.name, offset, len(blob), record["stored_at"])
+        self._index_fh.write("\t".join([record["query_key"], *map(str, entry)]) + "\n")
+        with self._index_lock:
+            self._index[record["query_key"]] = entry
+        self.counters["written"] += 1
+        self.counters["bytes"] += len(blob)
+
+        if offset + len(blob) >= self.segment_bytes:
+            self._rotate()
+
+    def _rotate(self) -> None:
+        self._close_files()
+        self.counters["rotations"] += 1
+        self._apply_retention()
+        self._open_segment()
+
+    def _close_files(self, fsync: bool = True) -> None:
+        files, self._fh, self._index_fh = (self._fh, self._index_fh), None, None
+        for fh in files:
+            if fh is not None:
+                try:
+                    fh.flush()
+                    if fsync:
+                        os.fsync(fh.fileno())
+                finally:
+                    fh.close()
+
+    def _apply_retention(self) -> None:
+        now = time.time()
+        segments = self.segments()
+        doomed = [p for p in segments if now - p.stat().st_mtime > self.retention_s]
+        keep = [p for p in segments if p not in doomed]
+        # Appelé avant l'ouverture d'un nouveau segment : on lui garde une place
+        doomed += keep[:max(0, len(keep) - (self.max_segments - 1))]
+        if not doomed:
+            return
+
+        for p in doomed:
+            p.unlink(missing_ok=True)
+        self.counters["segments_dropped"] += len(doomed)
+        self._rewrite_index()
+
+    def _rewrite_index(self) -> None:
+        # Compaction de l'index (sous le verrou de fichier) : une ligne par clé encore
+        # lisible, à partir de l'index du disque qui contient les entrées de tous les workers
+        existing = {p.name for p in self.segments()}
+        index = {k: e for k, e in self._read_index().items() if e[0] in existing}
+        with self._index_lock:
+            self._index = index
+        tmp = self.dir() / (_INDEX_NAME + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            for key, entry in index.items():
+                f.write("\t".join([key, *map(str, entry)]) + "\n")
+        os.replace(tmp, self.dir() / _INDEX_NAME)
+
+    # ---- lecture ----
+
+    def _read_index(self) -> Dict[str, _IndexEntry]:
+        index: Dict[str, _IndexEntry] = {}
+        path = self.dir() / _INDEX_NAME
+        if path.exists():
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    parts = line.rstrip("\n").split("\t")
+                    if len(parts) == 5:
+                        index[parts[0]] = (parts[1], int(parts[2]), int(parts[3]), float(parts[4]))
+        return index
+
+    def _load_index(self) -> None:
+        with self._index_lock:
+            if self._loaded:
+                return
+            self._index.update(self._read_index())
+            self._loaded = True
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Latest logged record for a query key (records still queued are not visible yet)."""
+        self._load_index()
+        with self._index_lock:
+            entry = self._index.get(key)
+        if entry is None:
+            return None
+        segment, offset, length, _ = entry
+        try:
+            with open(self.dir() / segment, "rb") as f:
+                f.seek(offset)
+                record = json.loads(gzip.decompress(f.read(length)))
+        except (OSError, ValueError, EOFError, zlib.error):
+            return None
+        # Entrée périmée (segment supprimé puis renuméroté par un autre worker)
+        return record if record.get("query_key") == key else None
+
+    def iter_records(self) -> Iterator[Dict[str, Any]]:
+        """Every record of every segment, oldest first (backfill, export)."""
+        for path in self.segments():
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Drains the queue and closes the segment (called on app shutdown)."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counters, "pending": self._queue.qsize(), "index_entries": len(self._index)}
+
+
+raw_log = RawLog(
+    segment_bytes=int(os.getenv("RAW_LOG_SEGMENT_BYTES", 64 * 1024 * 1024)),
+    max_segments=int(os.getenv("RAW_LOG_MAX_SEGMENTS", 64)),
+    retention_s=float(os.getenv("RAW_LOG_RETENTION_DAYS", 30)) * 24 * 3600,
+)
@@ -1,21 +1,27 @@
 from __future__ import annotations
 
-import json
-import time
+import asyncio
+import logging
+import os
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional
 import urllib.parse
 import xml.etree.ElementTree as ET
 
-import requests
+from app.core.http_pool import get_async_client, get_session
+from app.core.paths import data_lake_dir
+from app.services.ingest_service import submit_arxiv_items
+from app.services.pdf_service import pdf_pipeline
+from app.services.raw_log import raw_log
 
+if TYPE_CHECKING:
+    from app.integrations.mcp.schemas import ArxivMetadataItem
 
-def _backend_dir() -> Path:
-    return Path(__file__).resolve().parents[2]
+logger = logging.getLogger(__name__)
 
 
 def _raw_cache_dir() -> Path:
-    p = _backend_dir() / "data_lake" / "raw" / "cache"
+    p = data_lake_dir() / "raw" / "cache"
     p.mkdir(parents=True, exist_ok=True)
     return p
 
@@ -34,6 +40,11 @@ def _clean(s: Optional[str]) -> str:
     return " ".join((s or "").strip().split())
 
 
+def arxiv_api_url() -> str:
+    """arXiv API endpoint; ARXIV_API_URL points to a local Atom server for tests."""
+    return os.getenv("ARXIV_API_URL") or "http://export.arxiv.org/api/query"
+
+
 def _build_arxiv_query_url(query: str, theme: Optional[str], max_results: int, sort: str) -> str:
     cat = _THEME_TO_ARXIV_CAT.get(theme or "", None)
     cleaned = query.translate(str.maketrans("", "", "?!:;"))
@@ -43,58 +54,124 @@ def _build_arxiv_query_url(query: str, theme: Optional[str], max_results: int, s
     search_query = "+AND+".join(parts)
     order_by = "relevance" if sort == "relevance" else "submittedDate"
     return (
-        "http://export.arxiv.org/api/query"
-        f"?search_query={search_query}"
+        arxiv_api_url()
+        + f"?search_query={search_query}"
         f"&start=0&max_results={max_results}"
         f"&sortBy={order_by}&sortOrder=descending"
     )
 
 
-def _fetch_arxiv_feed(url: str) -> ET.Element:
+_ATOM = "{http://www.w3.org/2005/Atom}"
+_CHUNK_SIZE = 16384
+
+
+def _entry_item(entry: ET.Element) -> ArxivMetadataItem:
+    """One pass over the children of an Atom <entry>."""
+    # Import local : le package app.integrations.mcp importe ce module
+    from app.integrations.mcp.schemas import ArxivMetadataItem
+
+    fields = {"arxiv_id": "", "title": "", "abstract": "", "submitted_date": "", "abs_url": "", "pdf_url": ""}
+    authors: List[str] = []
+    categories: List[str] = []
+
+    for child in entry:
+        tag = child.tag
+        if tag == _ATOM + "id":
+            fields["arxiv_id"] = _clean(child.text).split("/")[-1]
+        elif tag == _ATOM + "title":
+            fields["title"] = _clean(child.text)
+        elif tag == _ATOM + "summary":
+            fields["abstract"] = _clean(child.text)
+        elif tag == _ATOM + "published":
+            fields["submitted_date"] = _clean(child.text)
+        elif tag == _ATOM + "link":
+            href = child.get("href", "")
+            if child.get("rel", "") == "alternate" and href:
+                fields["abs_url"] = href
+            if child.get("type", "") == "application/pdf" and href:
+                fields["pdf_url"] = href
+        elif tag == _ATOM + "author":
+            name = _clean(child.findtext(_ATOM + "name"))
+            if name:
+                authors.append(name)
+        elif tag == _ATOM + "category":
+            term = child.get("term", "")
+            if term and term not in categories:
+                categories.append(term)
+
+    return ArxivMetadataItem(authors=authors, categories=categories, **fields)
+
+
+class AtomEntryParser:
+    """
+    Incremental arXiv Atom parser: feed() the response body chunk by chunk,
+    get an ArxivMetadataItem as soon as each </entry> closes (the element is
+    cleared right away, the document is never held whole).
+    """
+
+    def __init__(self) -> None:
+        self._parser = ET.XMLPullParser(events=("end",))
+
+    def feed(self, chunk: bytes) -> List[ArxivMetadataItem]:
+        try:
+            self._parser.feed(chunk)
+        except ET.ParseError as e:
+            raise RuntimeError(f"ARXIV_XML_PARSE_ERROR: {e}") from e
+        return self._drain()
+
+    def close(self) -> List[ArxivMetadataItem]:
+        try:
+            self._parser.close()
+        except ET.ParseError as e:
+            raise RuntimeError(f"ARXIV_XML_PARSE_ERROR: {e}") from e
+        return self._drain()
+
+    def _drain(self) -> List[ArxivMetadataItem]:
+        items = []
+        for _, elem in self._parser.read_events():
+            if elem.tag == _ATOM + "entry":
+                items.append(_entry_item(elem))
+                elem.clear()
+        return items
+
+
+def parse_arxiv_feed(chunks: Iterable[bytes]) -> Iterator[ArxivMetadataItem]:
+    """Yields the entries of an Atom feed given as a stream of byte chunks."""
+    parser = AtomEntryParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.close()
+
+
+def _fetch_arxiv_items(url: str) -> List[ArxivMetadataItem]:
+    items: List[ArxivMetadataItem] = []
     try:
-        r = requests.get(url, timeout=30)
-        r.raise_for_status()
+        with get_session().get(url, timeout=30, stream=True) as r:
+            r.raise_for_status()
+            items.extend(parse_arxiv_feed(r.iter_content(chunk_size=_CHUNK_SIZE)))
+    except RuntimeError:
+        raise
     except Exception as e:
         raise RuntimeError(f"ARXIV_HTTP_ERROR: {e}") from e
+    return items
+
+
+async def _fetch_arxiv_items_async(url: str) -> List[ArxivMetadataItem]:
+    """Same as _fetch_arxiv_items over the shared async connection pool."""
+    parser = AtomEntryParser()
+    items: List[ArxivMetadataItem] = []
     try:
-        return ET.fromstring(r.text)
+        # Comme requests sur le chemin synchrone : les 301/302 d'export.arxiv.org sont suivis
+        async with get_async_client().stream("GET", url, timeout=30, follow_redirects=True) as r:
+            r.raise_for_status()
+            async for chunk in r.aiter_bytes(_CHUNK_SIZE):
+                items.extend(parser.feed(chunk))
+    except RuntimeError:
+        raise
     except Exception as e:
-        raise RuntimeError(f"ARXIV_XML_PARSE_ERROR: {e}") from e
-
-
-def _parse_arxiv_entry(entry: ET.Element, ns: dict, theme: Optional[str]) -> Dict[str, Any]:
-    arxiv_id = _clean(entry.findtext("atom:id", default="", namespaces=ns)).split("/")[-1]
-    title = _clean(entry.findtext("atom:title", default="", namespaces=ns))
-    abstract = _clean(entry.findtext("atom:summary", default="", namespaces=ns))
-    published = _clean(entry.findtext("atom:published", default="", namespaces=ns))
-
-    abs_url = ""
-    pdf_url = ""
-    for link in entry.findall("atom:link", ns):
-        rel = link.attrib.get("rel", "")
-        href = link.attrib.get("href", "")
-        typ = link.attrib.get("type", "")
-        if rel == "alternate" and href:
-            abs_url = href
-        if typ == "application/pdf" and href:
-            pdf_url = href
-
-    authors = [
-        _clean(name_el.text)
-        for name_el in entry.findall("atom:author/atom:name", ns)
-        if _clean(name_el.text)
-    ]
-
-    return {
-        "arxiv_id": arxiv_id,
-        "title": title,
-        "authors": authors,
-        "submitted_date": published,
-        "abs_url": abs_url,
-        "pdf_url": pdf_url,
-        "abstract": abstract,
-        "theme": theme,
-    }
+        raise RuntimeError(f"ARXIV_HTTP_ERROR: {e}") from e
+    items.extend(parser.close())
+    return items
 
 
 def scrape_arxiv(
@@ -113,28 +190,57 @@ def scrape_arxiv(
     url = _build_arxiv_query_url(q, theme, max_results, sort)
 
     try:
-        root = _fetch_arxiv_feed(url)
+        items = _fetch_arxiv_items(url)
     except RuntimeError as e:
         return {"ok": False, "errors": [str(e)], "items": [], "last_search_url": url}
 
-    ns = {"atom": "http://www.w3.org/2005/Atom"}
+    return _store_results(items, q, theme, sort, url)
 
-    items: List[Dict[str, Any]] = []
-    for entry in root.findall("atom:entry", ns):
-        items.append(_parse_arxiv_entry(entry, ns, theme))
 
-    # save raw
-    ts = int(time.time())
-    out_path = _raw_cache_dir() / f"arxiv_raw_{ts}.json"
+async def scrape_arxiv_async(
+    query: str,
+    theme: Optional[str] = None,
+    max_results: int = 10,
+    sort: str = "relevance",
+) -> Dict[str, Any]:
+    """
+    Async scrape_arxiv: the body is parsed as it streams in through the
+    shared pool, the raw save runs in a thread and the KB ingestion in the
+    background (ingest_service.submit_arxiv_items).
+    """
+    q = _clean(query)
+    if not q:
+        return {"ok": False, "errors": ["EMPTY_QUERY"], "items": []}
+
+    url = _build_arxiv_query_url(q, theme, max_results, sort)
+
+    try:
+        items = await _fetch_arxiv_items_async(url)
+    except RuntimeError as e:
+        return {"ok": False, "errors": [str(e)], "items": [], "last_search_url": url}
+
+    return await asyncio.to_thread(_store_results, items, q, theme, sort, url)
+
+
+def _store_results(items: List[ArxivMetadataItem], q: str, theme: Optional[str], sort: str, url: str) -> Dict[str, Any]:
+    # Seule sérialisation du chemin : pour le fichier raw et la KB
+    records = [{**item.dict(), "theme": theme} for item in items]
+
     payload = {
         "ok": True,
         "query_used": q,
         "theme": theme,
         "sort": sort,
-        "count": len(items),
-        "items": items,
+        "count": len(records),
+        "items": records,
         "last_search_url": url,
     }
-    out_path.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+    # save raw : mis en file pour le writer de fond (segments gzip), pas d'I/O ici
+    raw_key = raw_log.append(payload)
+
+    # Les résultats alimentent la KB (en fond) : la même question n'aura plus besoin d'arXiv.
+    # Texte intégral ensuite (PDF_INGEST=1), une fois les papiers dans la KB
+    submit_arxiv_items(records).add_done_callback(lambda _: pdf_pipeline.enqueue(records))
 
-    return {**payload, "saved_to": str(out_path)}
+    # Les items typés continuent tels quels vers le tool / le cache / le prompt
+    return {**payload, "items": items, "raw_key": raw_key, "saved_to": str(raw_log.dir())}
@@ -0,0 +1,163 @@
+"""
+Server-side conversation sessions for /api/ask.
+
+Between two turns, a session keeps:
+  - the last turn's retrieval (KB / arXiv results), reused while the question
+    stays on the same topic (no new search and no arXiv fallback);
+  - the "context" tokens returned by Ollama, so that a follow-up turn only
+    sends the new question instead of the whole prompt (no re-prefill);
+  - the latest exchanges (question / answer).
+Stored in the worker's memory, bounded: LRU (SESSION_MAX_ENTRIES) + idle TTL
+(SESSION_TTL_S). A session only exists in the process that created it: with
+several workers (app.serve), the load balancer must route a session to the
+same worker every time (sticky routing), otherwise run a single worker.
+An id unknown to the worker simply opens a new session.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set
+
+from app.services.kb_index import tokenize
+
+# Mots de relance sans valeur de sujet ("et les limites ?", "explique plus")
+_FOLLOWUP_WORDS = frozenset(
+    "what about its their this that these those more why how explain detail details "
+    "quoi quel quelle quels quelles plus encore pourquoi comment explique detaille "
+    "cela ca ceci leur leurs son sa ses cette cet".split()
+)
+# Au-delà, le contexte Ollama dépasse la fenêtre du modèle : on repart d'un prompt complet
+_MAX_LLM_CONTEXT = int(os.getenv("SESSION_MAX_CONTEXT_TOKENS", "3400"))
+_TOPIC_OVERLAP = float(os.getenv("SESSION_TOPIC_OVERLAP", "0.5"))
+_MAX_TURNS = 20
+
+
+def _topic_terms(question: str) -> Set[str]:
+    return {t for t in tokenize(question) if t not in _FOLLOWUP_WORDS}
+
+
+class Session:
+    def __init__(self, session_id: str) -> None:
+        self.id = session_id
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.turns: List[Dict[str, str]] = []
+        self.topic: Set[str] = set()
+        self.retrieval: Optional[Dict[str, Any]] = None
+        self.llm_context: Optional[List[int]] = None
+        self.model: Optional[str] = None
+        # Les tours d'une même session s'exécutent l'un après l'autre
+        self.lock = asyncio.Lock()
+
+    def reusable_retrieval(self, question: str) -> Optional[Dict[str, Any]]:
+        """
+        Previous turn's retrieval when `question` stays on the same topic:
+        at least one term already seen, and at least SESSION_TOPIC_OVERLAP of the question's terms.
+        """
+        if self.retrieval is None:
+            return None
+        terms = _topic_terms(question)
+        common = terms & self.topic
+        if common and len(common) >= _TOPIC_OVERLAP * len(terms):
+            return self.retrieval
+        return None
+
+    def llm_context_for(self, model: str, retrieval_reused: bool) -> Optional[List[int]]:
+        """Ollama context to continue from, or None when the next prompt must be complete."""
+        if not retrieval_reused or model != self.model or not self.llm_context:
+            return None
+        if len(self.llm_context) > _MAX_LLM_CONTEXT:
+            return None
+        return self.llm_context
+
+    def record(
+        self,
+        question: str,
+        answer: str,
+        prepared: Dict[str, Any],
+        llm_context: Optional[List[int]],
+        model: str,
+    ) -> None:
+        # Un tour "social" (salutations...) ne change ni le sujet ni le contexte Ollama
+        if prepared["intent"] != "social":
+            terms = _topic_terms(question)
+            if prepared.get("retrieval_reused"):
+                self.topic |= terms
+            else:
+                # Nouveau sujet : la recherche de ce tour devient la référence
+                self.topic = terms
+                self.retrieval = {
+                    "kb_results": prepared["kb_results"],
+                    "arxiv_items": prepared["arxiv_items"],
+                    "used_arxiv": prepared["used_arxiv"],
+                }
+            self.llm_context = llm_context or None
+            self.model = model
+        self.turns = (self.turns + [{"question": question, "answer": answer}])[-_MAX_TURNS:]
+        self.last_used = time.time()
+
+
+class SessionStore:
+    def __init__(self, max_entries: int = 1000, ttl_s: float = 3600.0) -> None:
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"created": 0, "resumed": 0, "expired": 0, "evicted": 0}
+
+    def create(self) -> Session:
+        """New session (new id), for the first turn of a conversation."""
+        with self._lock:
+            return self._create(time.time())
+
+    def get_or_create(self, session_id: str) -> Session:
+        """Session `session_id`, or a new one (new id) when it is unknown or expired."""
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None and now - session.last_used > self.ttl_s:
+                del self._sessions[session.id]
+                self.counters["expired"] += 1
+                session = None
+            if session is not None:
+                self._sessions.move_to_end(session.id)
+                session.last_used = now
+                self.counters["resumed"] += 1
+                return session
+            return self._create(now)
+
+    def _create(self, now: float) -> Session:
+        # Appelant sous _lock. Ordre LRU = ordre d'inactivité : les sessions expirées sont en tête
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if now - oldest.last_used <= self.ttl_s:
+                break
+            self._sessions.popitem(last=False)
+            self.counters["expired"] += 1
+
+        session = Session(uuid.uuid4().hex)
+        self._sessions[session.id] = session
+        self.counters["created"] += 1
+        while len(self._sessions) > self.max_entries:
+            self._sessions.popitem(last=False)
+            self.counters["evicted"] += 1
+        return session
+
+    def drop(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.counters, "sessions": len(self._sessions)}
+
+
+session_store = SessionStore(
+    max_entries=int(os.getenv("SESSION_MAX_ENTRIES", 1000)),
+    ttl_s=float(os.getenv("SESSION_TTL_S", 3600)),
+)
@@ -0,0 +1,339 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.file_lock import FileLock, file_lock
+from app.core.ollama_client import AsyncOllamaClient, OllamaClient
+from app.services.kb_store import Signature
+
+logger = logging.getLogger(__name__)
+
+# Fichiers stockés à côté de kb.json
+_VECTORS_FILE = "kb_vectors.f32"
+_META_FILE = "kb_vectors.json"
+_IVF_FILE = "kb_vectors_ivf.npz"
+
+_QUERY_CACHE_SIZE = 1024
+
+
+def _paths(kb_file: Path) -> Tuple[Path, Path, Path]:
+    d = kb_file.parent
+    return d / _VECTORS_FILE, d / _META_FILE, d / _IVF_FILE
+
+
+def _write_lock(kb_file: Path) -> FileLock:
+    # Ajouts de vecteurs des différents workers (app.serve) : un seul à la fois
+    return file_lock(kb_file.parent / (_VECTORS_FILE + ".lock"))
+
+
+def _doc_text(store, doc: int) -> str:
+    return f"{store.get_field(doc, 'title')}\n{store.get_field(doc, 'abstract')}".strip()
+
+
+def _normalize_rows(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (x / norms).astype(np.float32)
+
+
+def _signature_json(signature: Signature) -> List[List[Any]]:
+    return [list(entry) for entry in signature]
+
+
+def train_ivf(vectors: np.ndarray, nlist: int, iters: int = 10, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Spherical k-means over L2-normalized vectors.
+    Returns (centroids [nlist, dim], assignment [n]).
+    """
+    rng = np.random.default_rng(seed)
+    n = vectors.shape[0]
+    nlist = max(1, min(nlist, n))
+    centroids = vectors[rng.choice(n, size=nlist, replace=False)].copy()
+    assign = np.zeros(n, dtype=np.int32)
+    for _ in range(iters):
+        assign = _nearest_centroid(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        counts = np.bincount(assign, minlength=nlist)
+        empty = counts == 0
+        if empty.any():
+            # Cluster vide : on le réinitialise sur un point tiré au hasard
+            sums[empty] = vectors[rng.choice(n, size=int(empty.sum()))]
+        centroids = _normalize_rows(sums)
+    return centroids, _nearest_centroid(vectors, centroids)
+
+
+def _nearest_centroid(vectors: np.ndarray, centroids: np.ndarray, chunk: int = 65536) -> np.ndarray:
+    out = np.empty(vectors.shape[0], dtype=np.int32)
+    for start in range(0, vectors.shape[0], chunk):
+        block = np.asarray(vectors[start:start + chunk])
+        out[start:start + chunk] = np.argmax(block @ centroids.T, axis=1)
+    return out
+
+
+def build_vector_store(
+    kb_file: Path,
+    store,
+    signature: Signature,
+    client: Optional[OllamaClient] = None,
+    batch_size: int = 32,
+) -> Dict[str, Any]:
+    """
+    Embeds every KB record in batches through Ollama and writes the float32
+    matrix + IVF index next to kb.json. Run at ingestion time, not per request.
+    signature = kb_signature() of the embedded store (used to detect stale vectors).
+    """
+    client = client or OllamaClient()
+    vectors_path, meta_path, ivf_path = _paths(kb_file)
+
+    texts = [_doc_text(store, doc) for doc in range(len(store))]
+    matrix: Optional[np.memmap] = None
+    for start in range(0, len(texts), batch_size):
+        batch = np.asarray(client.embed(texts[start:start + batch_size]), dtype=np.float32)
+        if matrix is None:
+            matrix = np.memmap(vectors_path, dtype=np.float32, mode="w+", shape=(len(texts), batch.shape[1]))
+        matrix[start:start + len(batch)] = _normalize_rows(batch)
+    if matrix is None:
+        return {"ok": False, "errors": ["EMPTY_KB"], "count": 0}
+    matrix.flush()
+
+    centroids, assign = train_ivf(np.asarray(matrix), nlist=int(np.sqrt(len(texts))) or 1)
+    _save_ivf(ivf_path, centroids, assign)
+
+    meta = {
+        "model": client.embed_model,
+        "dim": int(matrix.shape[1]),
+        "count": int(matrix.shape[0]),
+        "nlist": int(len(centroids)),
+        "kb_signature": _signature_json(signature),
+    }
+    _write_meta(meta_path, meta)
+    return {"ok": True, "errors": [], **meta}
+
+
+def append_vectors(
+    kb_file: Path,
+    store,
+    signature: Signature,
+    client: Optional[OllamaClient] = None,
+    batch_size: int = 32,
+) -> Dict[str, Any]:
+    """
+    Embeds only the records appended to the KB since the last build/append,
+    adds them at the end of the float32 matrix and to their nearest IVF list.
+    Centroids are not retrained (rerun build_vector_store from time to time).
+    """
+    with _write_lock(kb_file):
+        return _append_vectors(kb_file, store, signature, client, batch_size)
+
+
+def _append_vectors(
+    kb_file: Path,
+    store,
+    signature: Signature,
+    client: Optional[OllamaClient],
+    batch_size: int,
+) -> Dict[str, Any]:
+    vectors_path, meta_path, ivf_path = _paths(kb_file)
+    if not (vectors_path.exists() and meta_path.exists() and ivf_path.exists()):
+        return {"ok": False, "errors": ["NO_VECTOR_STORE"], "added": 0}
+
+    meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    built_on = meta.get("kb_signature") or []
+    if built_on != _signature_json(signature[:len(built_on)]):
+        return {"ok": False, "errors": ["STALE_VECTOR_STORE"], "added": 0}
+
+    start, stop = int(meta["count"]), len(store)
+    if stop <= start:
+        meta["kb_signature"] = _signature_json(signature)
+        _write_meta(meta_path, meta)
+        return {"ok": True, "errors": [], "added": 0}
+
+    client = client or OllamaClient()
+    texts = [_doc_text(store, doc) for doc in range(start, stop)]
+    batches = [
+        _normalize_rows(np.asarray(client.embed(texts[i:i + batch_size], model=meta["model"]), dtype=np.float32))
+        for i in range(0, len(texts), batch_size)
+    ]
+    added = np.concatenate(batches)
+
+    ivf = np.load(ivf_path)
+    centroids = ivf["centroids"]
+    assign = np.concatenate([ivf["assign"], _nearest_centroid(added, centroids)])
+    with open(vectors_path, "ab") as f:
+        f.write(added.tobytes())
+    _save_ivf(ivf_path, centroids, assign)
+
+    meta["count"] = stop
+    meta["kb_signature"] = _signature_json(signature)
+    _write_meta(meta_path, meta)
+    return {"ok": True, "errors": [], "added": int(added.shape[0])}
+
+
+def resync_vector_signature(kb_file: Path, count: int, signature: Signature) -> bool:
+    """
+    After a compaction that kept doc order: re-points the vectors to the new
+    segment signature when they covered all `count` docs. Returns True if updated.
+    """
+    _, meta_path, _ = _paths(kb_file)
+    with _write_lock(kb_file):
+        if not meta_path.exists():
+            return False
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        if int(meta["count"]) != count:
+            return False
+        meta["kb_signature"] = _signature_json(signature)
+        _write_meta(meta_path, meta)
+    return True
+
+
+def _save_ivf(ivf_path: Path, centroids: np.ndarray, assign: np.ndarray) -> None:
+    order = np.argsort(assign, kind="stable").astype(np.int32)
+    offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(assign, minlength=len(centroids)), out=offsets[1:])
+    tmp = ivf_path.with_suffix(".tmp")
+    with open(tmp, "wb") as f:
+        np.savez(f, centroids=centroids, assign=assign.astype(np.int32), order=order, offsets=offsets)
+    os.replace(tmp, ivf_path)
+
+
+def _write_meta(meta_path: Path, meta: Dict[str, Any]) -> None:
+    # Écrit en dernier : son mtime déclenche le rechargement du store dans les process
+    tmp = meta_path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    os.replace(tmp, meta_path)
+
+
+class VectorStore:
+    """
+    Read-only view on the embeddings (memory-mapped) + IVF inverted lists.
+    A query only compares the vectors of the nprobe nearest lists.
+    """
+
+    def __init__(self, kb_file: Path) -> None:
+        vectors_path, meta_path, ivf_path = _paths(kb_file)
+        self.meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        self.vectors = np.memmap(
+            vectors_path, dtype=np.float32, mode="r",
+            shape=(self.meta["count"], self.meta["dim"]),
+        )
+        ivf = np.load(ivf_path)
+        self.centroids = ivf["centroids"]
+        self.order = ivf["order"]
+        self.offsets = ivf["offsets"]
+
+    def __len__(self) -> int:
+        return int(self.meta["count"])
+
+    def search(self, qvec: np.ndarray, top_k: int = 5, nprobe: int = 8) -> List[Tuple[int, float]]:
+        q = qvec / (np.linalg.norm(qvec) or 1.0)
+        nprobe = min(nprobe, len(self.centroids))
+        lists = np.argpartition(-(self.centroids @ q), nprobe - 1)[:nprobe]
+        cand = np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in lists])
+        if cand.size == 0:
+            return []
+        cand.sort()  # accès séquentiel au memmap
+        sims = self.vectors[cand] @ q
+        k = min(top_k, cand.size)
+        best = np.argpartition(-sims, k - 1)[:k]
+        best = best[np.argsort(-sims[best], kind="stable")]
+        return [(int(cand[i]), float(sims[i])) for i in best]
+
+
+_lock = threading.Lock()
+_store: Optional[VectorStore] = None
+_store_sig: Optional[Tuple[str, int]] = None
+
+
+def get_vector_store(kb_file: Path, signature: Signature) -> Optional[VectorStore]:
+    """
+    Process-level store, or None when the vectors are missing or were built
+    from another version of the KB (build_vector_store must be rerun).
+    KB segments being append-only, vectors built over a prefix of the current
+    segments stay valid for those docs.
+    """
+    global _store, _store_sig
+    vectors_path, meta_path, ivf_path = _paths(kb_file)
+    if not (vectors_path.exists() and meta_path.exists() and ivf_path.exists()):
+        return None
+    sig = (str(meta_path), os.stat(meta_path).st_mtime_ns)
+    with _lock:
+        if _store is None or _store_sig != sig:
+            _store = VectorStore(kb_file)
+            _store_sig = sig
+        store = _store
+    built_on = store.meta.get("kb_signature") or []
+    if built_on != _signature_json(signature[:len(built_on)]):
+        logger.warning("KB vectors are stale (KB changed since build), dense search disabled")
+        return None
+    return store
+
+
+_query_cache: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+_query_cache_lock = threading.Lock()
+
+
+def _normalize_question(question: str) -> str:
+    return " ".join(question.lower().split())
+
+
+def _cached_query(key: Tuple[str, str]) -> Optional[np.ndarray]:
+    with _query_cache_lock:
+        vec = _query_cache.get(key)
+        if vec is not None:
+            _query_cache.move_to_end(key)
+        return vec
+
+
+def _remember_query(key: Tuple[str, str], embedding: List[float]) -> np.ndarray:
+    vec = np.asarray(embedding, dtype=np.float32)
+    with _query_cache_lock:
+        _query_cache[key] = vec
+        while len(_query_cache) > _QUERY_CACHE_SIZE:
+            _query_cache.popitem(last=False)
+    return vec
+
+
+def embed_query(question: str, model: Optional[str] = None, client: Optional[OllamaClient] = None) -> np.ndarray:
+    """Query embedding, cached (LRU) per normalized question and model."""
+    client = client or OllamaClient()
+    key = (model or client.embed_model, _normalize_question(question))
+    vec = _cached_query(key)
+    if vec is None:
+        vec = _remember_query(key, client.embed([key[1]], model=key[0])[0])
+    return vec
+
+
+async def embed_query_async(
+    question: str,
+    model: Optional[str] = None,
+    client: Optional[AsyncOllamaClient] = None,
+) -> np.ndarray:
+    """
+    embed_query for the request path: the call takes a PRIORITY_EMBED slot of
+    the process-wide scheduler, like every other Ollama call of /ask.
+    """
+    client = client or AsyncOllamaClient()
+    key = (model or client.embed_model, _normalize_question(question))
+    vec = _cached_query(key)
+    if vec is None:
+        vec = _remember_query(key, (await client.embed([key[1]], model=key[0]))[0])
+    return vec
+
+
+if __name__ == "__main__":
+    from app.services.kb_service import _kb_path
+    from app.services.kb_store import kb_signature, open_kb
+
+    kb = _kb_path()
+    signature = kb_signature(kb)
+    result = build_vector_store(kb, open_kb(kb), signature)
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,120 @@
+"""
+Startup warm-up of a worker: KB index, intent model and Ollama models.
+
+Started as a background task by the app.main lifespan: the worker accepts
+connections right away, but /api/health answers 503 "warming_up" until the
+warm-up is done (a deployment sends no traffic before that). The Ollama model
+is loaded with keep_alive (see ollama_client), so the first question does not
+pay for loading it.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from app.core.ollama_client import AsyncOllamaClient
+from app.services.intent_classifier import get_model
+from app.services.kb_index import get_kb_index
+from app.services.kb_service import _kb_path
+from app.services.kb_store import kb_signature, segment_paths
+from app.services.vector_store import get_vector_store
+
+logger = logging.getLogger(__name__)
+
+_WARMUP_TIMEOUT_S = float(os.getenv("WARMUP_TIMEOUT_S", "120"))
+_MAX_RETRY_DELAY_S = 10.0
+
+
+class Readiness:
+    """Warm-up state of this worker, reported by /api/health."""
+
+    def __init__(self) -> None:
+        self.ready = False
+        self.checks: Dict[str, Dict[str, Any]] = {}
+
+    @property
+    def degraded(self) -> bool:
+        return any(not c["ok"] for c in self.checks.values())
+
+    def stats(self) -> Dict[str, Any]:
+        return {"ready": self.ready, "checks": dict(self.checks)}
+
+
+readiness = Readiness()
+
+
+async def _check(name: str, fn: Callable[[], Awaitable[Any]], deadline: float) -> None:
+    """Runs one warm-up step, retrying with backoff until `deadline` (Ollama not started yet...)."""
+    t0 = time.perf_counter()
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            detail = await fn()
+        except Exception as e:
+            delay = min(_MAX_RETRY_DELAY_S, 2.0 ** attempt)
+            if time.monotonic() + delay > deadline:
+                logger.error(f"warm-up {name} failed after {attempt} attempts: {e}")
+                readiness.checks[name] = {"ok": False, "attempts": attempt, "error": str(e)}
+                return
+            logger.warning(f"warm-up {name} attempt {attempt} failed, retry in {delay:.0f}s: {e}")
+            await asyncio.sleep(delay)
+            continue
+        readiness.checks[name] = {
+            "ok": True,
+            "attempts": attempt,
+            "ms": round((time.perf_counter() - t0) * 1000, 1),
+            **(detail or {}),
+        }
+        return
+
+
+async def _kb_index() -> Dict[str, Any]:
+    kb_file = _kb_path()
+    if not kb_file.exists() and not segment_paths(kb_file):
+        return {"docs": 0}
+    index = await asyncio.to_thread(get_kb_index, kb_file)
+    return {"docs": len(index)}
+
+
+async def _intent_model() -> Dict[str, Any]:
+    model = await asyncio.to_thread(get_model)
+    return {"loaded": model is not None}
+
+
+async def _ollama_generate() -> Dict[str, Any]:
+    client = AsyncOllamaClient()
+    # Une génération d'un token : charge le modèle et le garde keep_alive
+    await client.generate("ok", num_predict=1, think=False)
+    return {"model": client.model, "keep_alive": client.keep_alive}
+
+
+async def _ollama_embed() -> Dict[str, Any]:
+    kb_file = _kb_path()
+    store = await asyncio.to_thread(lambda: get_vector_store(kb_file, kb_signature(kb_file)))
+    if store is None:
+        # Pas de vecteurs : la recherche dense n'est pas utilisée, inutile de charger le modèle
+        return {"skipped": True}
+    client = AsyncOllamaClient()
+    model = store.meta.get("model")
+    await client.embed(["ok"], model=model)
+    return {"model": model or client.embed_model}
+
+
+async def warm_up(timeout_s: float = _WARMUP_TIMEOUT_S) -> None:
+    """Warms every dependency of the request path, then marks the worker ready (even on failure)."""
+    deadline = time.monotonic() + timeout_s
+    try:
+        await _check("kb_index", _kb_index, deadline)
+        await _check("intent_model", _intent_model, deadline)
+        if os.getenv("OLLAMA_WARMUP", "1") != "0":
+            await asyncio.gather(
+                _check("ollama_generate", _ollama_generate, deadline),
+                _check("ollama_embed", _ollama_embed, deadline),
+            )
+    finally:
+        readiness.ready = True
+        logger.info(f"warm-up done: {readiness.checks}")
@@ -0,0 +1 @@
+"""Benchmarks: fake Ollama / arXiv servers, synthetic KBs and the load driver (python -m bench.run)."""
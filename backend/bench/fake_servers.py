@@ -0,0 +1,192 @@
+"""
+Local stand-ins for Ollama and the arXiv API (benchmarks, offline dev).
+
+    cd backend
+    python -m bench.fake_servers --ollama-port 18434 --arxiv-port 18435 --token-latency-ms 20
+
+Ollama: /api/generate (streamed or not, one token every token_latency_ms),
+/api/embed (deterministic vectors), /api/tags. arXiv: /api/query returns an
+Atom feed of max_results entries derived from the query (same ids for the
+same query), after arxiv_latency_ms.
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import escape
+
+_WORDS = (
+    "model attention graph learning network data neural retrieval training "
+    "benchmark transformer optimization latency robust sparse embedding"
+).split()
+
+_ENTRY = (
+    "<entry>"
+    "<id>http://arxiv.org/abs/{arxiv_id}v1</id>"
+    "<published>2024-01-01T00:00:00Z</published>"
+    "<title>{title}</title>"
+    "<summary>{abstract}</summary>"
+    "<author><name>A. Author</name></author><author><name>B. Author</name></author>"
+    '<link href="http://arxiv.org/abs/{arxiv_id}v1" rel="alternate" type="text/html"/>'
+    '<link title="pdf" href="http://arxiv.org/pdf/{arxiv_id}v1" rel="related" type="application/pdf"/>'
+    '<category term="cs.AI" scheme="http://arxiv.org/schemas/atom"/>'
+    "</entry>"
+)
+
+
+def _seed(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=4).digest(), "little")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+    def _send_json(self, data: Dict[str, Any]) -> None:
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeOllamaHandler(_Handler):
+    token_latency_s = 0.02
+    tokens = 64
+    embed_dim = 64
+
+    def do_GET(self) -> None:
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": "qwen3:1.7b"}, {"name": "nomic-embed-text"}]})
+        else:
+            self.send_error(404)
+
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        if self.path == "/api/embed":
+            self._send_json({"embeddings": [self._vector(t) for t in body.get("input") or []]})
+        elif self.path == "/api/generate":
+            self._generate(body)
+        else:
+            self.send_error(404)
+
+    def _vector(self, text: str) -> List[float]:
+        seed = _seed(text)
+        return [((seed >> (i % 24)) % 97) / 97.0 - 0.5 for i in range(self.embed_dim)]
+
+    def _generate(self, body: Dict[str, Any]) -> None:
+        # Classification d'intention (decision_service) : un seul mot
+        if "Classify" in (body.get("system") or ""):
+            words = ["metier"]
+        else:
+            words = [" " + _WORDS[(i * 7) % len(_WORDS)] for i in range(self.tokens)]
+
+        if not body.get("stream"):
+            time.sleep(self.token_latency_s * len(words))
+            self._send_json({"response": "".join(words), "done": True, "context": [1, 2, 3], "eval_count": len(words)})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for word in words + [None]:
+            time.sleep(self.token_latency_s if word is not None else 0)
+            data = {"response": word or "", "done": word is None}
+            if word is None:
+                data.update({"context": [1, 2, 3], "eval_count": len(words)})
+            line = json.dumps(data).encode("utf-8") + b"\n"
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class FakeArxivHandler(_Handler):
+    latency_s = 0.2
+    total_results = 1000
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        if url.path != "/api/query":
+            self.send_error(404)
+            return
+        qs = parse_qs(url.query)
+        query = qs.get("search_query", [""])[0]
+        start = int(qs.get("start", ["0"])[0])
+        count = max(0, min(int(qs.get("max_results", ["10"])[0]), self.total_results - start))
+
+        seed = _seed(query)
+        entries = []
+        for i in range(start, start + count):
+            words = " ".join(_WORDS[(seed + i * k) % len(_WORDS)] for k in range(1, 9))
+            entries.append(_ENTRY.format(
+                arxiv_id=f"{2400 + seed % 100}.{(seed + i) % 100000:05d}",
+                title=escape(f"{query} {words}"),
+                abstract=escape(f"We study {query}. " + words * 6),
+            ))
+        body = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<feed xmlns="http://www.w3.org/2005/Atom" xmlns:opensearch="http://a9.com/-/spec/opensearch/1.1/">'
+            f"<opensearch:totalResults>{self.total_results}</opensearch:totalResults>"
+            + "".join(entries)
+            + "</feed>"
+        ).encode("utf-8")
+
+        time.sleep(self.latency_s)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/atom+xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_servers(
+    ollama_port: int,
+    arxiv_port: int,
+    token_latency_ms: float = 20.0,
+    tokens: int = 64,
+    arxiv_latency_ms: float = 200.0,
+) -> List[ThreadingHTTPServer]:
+    """Starts both stand-ins on 127.0.0.1 in daemon threads; call shutdown() on each to stop."""
+    ollama = type("Ollama", (FakeOllamaHandler,), {"token_latency_s": token_latency_ms / 1000, "tokens": tokens})
+    arxiv = type("Arxiv", (FakeArxivHandler,), {"latency_s": arxiv_latency_ms / 1000})
+
+    servers = []
+    for port, handler in ((ollama_port, ollama), (arxiv_port, arxiv)):
+        server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    return servers
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fake Ollama + arXiv servers for local benchmarks.")
+    parser.add_argument("--ollama-port", type=int, default=18434)
+    parser.add_argument("--arxiv-port", type=int, default=18435)
+    parser.add_argument("--token-latency-ms", type=float, default=20.0, help="délai entre deux tokens générés")
+    parser.add_argument("--tokens", type=int, default=64, help="tokens par réponse")
+    parser.add_argument("--arxiv-latency-ms", type=float, default=200.0)
+    args = parser.parse_args()
+
+    servers = start_servers(args.ollama_port, args.arxiv_port, args.token_latency_ms, args.tokens, args.arxiv_latency_ms)
+    print(f"fake Ollama on :{args.ollama_port}, fake arXiv on :{args.arxiv_port} (Ctrl-C pour arrêter)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for server in servers:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""
+Latency / throughput benchmark of the backend against local stand-ins.
+
+    cd backend
+    python -m bench.run                                   # KB 1k and 100k, concurrency 1,8,32
+    python -m bench.run --sizes 1k,100k,1m --concurrency 1,16 --requests 300 --out bench_results.json
+    python -m bench.run --compare old.json new.json       # deltas between two runs
+
+Three processes: the fake Ollama / arXiv servers (bench.fake_servers), the
+API (uvicorn app.main:app, DATA_LAKE_DIR on a copy of the synthetic KB) and
+this driver. For each KB size:
+  - search_kb: direct calls in a dedicated process (bench.search_kb);
+  - ask / arxiv: POST /api/ask and /api/arxiv at each concurrency level,
+    a different question per request (no answer-cache hit).
+The output JSON (p50/p95/p99, throughput, peak RSS, config) can be compared
+from one commit to the next.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from bench.stats import process_peak_rss_mb, summarize
+from bench.synthetic_kb import build_kb, clone_kb, parse_size, questions
+
+_BACKEND_DIR = Path(__file__).resolve().parents[1]
+_SCENARIOS = ("search_kb", "ask", "arxiv")
+_FALLBACK_METRIC = "ask_arxiv_fallbacks_total "
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_http(url: str, timeout_s: float = 120.0) -> None:
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=2).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"BENCH_SERVER_TIMEOUT: {url}")
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=_BACKEND_DIR, capture_output=True, text=True)
+    except OSError:
+        return None
+    return out.stdout.strip() or None
+
+
+def _child_env(data_lake: Path, ports: Dict[str, int]) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        "DATA_LAKE_DIR": str(data_lake),
+        "OLLAMA_BASE_URL": f"http://127.0.0.1:{ports['ollama']}",
+        "ARXIV_API_URL": f"http://127.0.0.1:{ports['arxiv']}/api/query",
+        "PYTHONPATH": str(_BACKEND_DIR),
+        # Questions toutes différentes : le cache disque n'apporterait que des écritures
+        "ANSWER_CACHE_DISK": "0",
+    })
+    # Le faux Ollama n'a pas besoin d'être protégé : on mesure l'API, pas le débit autorisé
+    env.setdefault("OLLAMA_RATE_PER_S", "1000")
+    env.setdefault("OLLAMA_MAX_CONCURRENCY", "8")
+    return env
+
+
+async def _drive(url: str, payloads: List[Dict[str, Any]], concurrency: int) -> Dict[str, Any]:
+    """POSTs every payload with `concurrency` requests in flight."""
+    latencies: List[float] = []
+    errors = 0
+    pending = iter(payloads)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(timeout=300, limits=limits) as client:
+        async def worker() -> None:
+            nonlocal errors
+            for payload in pending:
+                t0 = time.perf_counter()
+                try:
+                    ok = (await client.post(url, json=payload)).status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies.append((time.perf_counter() - t0) * 1000)
+                else:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall_s = time.perf_counter() - start
+    return summarize(latencies, errors, wall_s)
+
+
+def _fallbacks(base_url: str) -> int:
+    text = httpx.get(f"{base_url}/api/metrics", timeout=10).text
+    for line in text.splitlines():
+        if line.startswith(_FALLBACK_METRIC):
+            return int(float(line.split()[1]))
+    return 0
+
+
+def _payload(scenario: str, question: str, args: argparse.Namespace) -> Dict[str, Any]:
+    if scenario == "ask":
+        return {"question": question, "pipeline": args.pipeline}
+    return {"query": question, "max_results": 8}
+
+
+def _bench_api(size: int, data_lake: Path, ports: Dict[str, int], args: argparse.Namespace) -> List[Dict[str, Any]]:
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=_BACKEND_DIR,
+        env=_child_env(data_lake, ports),
+    )
+    results = []
+    try:
+        _wait_http(f"{base_url}/api/health")
+        seed = 100
+        for scenario in [s for s in args.scenarios if s in ("ask", "arxiv")]:
+            url = f"{base_url}/api/{scenario}"
+            # Requête de chauffe (chargement de l'index KB, connexions) hors mesure
+            httpx.post(url, json=_payload(scenario, "warm up", args), timeout=300)
+            for concurrency in args.concurrency:
+                seed += 1
+                payloads = [_payload(scenario, q, args) for q in questions(args.requests, seed=seed)]
+                before = _fallbacks(base_url) if scenario == "ask" else 0
+                stats = asyncio.run(_drive(url, payloads, concurrency))
+                row = {"kb_size": size, "scenario": scenario, "concurrency": concurrency, **stats}
+                if scenario == "ask":
+                    row["arxiv_fallbacks"] = _fallbacks(base_url) - before
+                row["peak_rss_mb"] = process_peak_rss_mb(server.pid)
+                results.append(row)
+                _print_row(row)
+    finally:
+        server.terminate()
+        try:
+            server.wait(30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+    return results
+
+
+def _bench_search_kb(size: int, data_lake: Path, ports: Dict[str, int], args: argparse.Namespace) -> List[Dict[str, Any]]:
+    out = subprocess.run(
+        [sys.executable, "-m", "bench.search_kb", "--requests", str(args.requests),
+         "--concurrency", ",".join(map(str, args.concurrency))],
+        cwd=_BACKEND_DIR,
+        env=_child_env(data_lake, ports),
+        capture_output=True,
+        text=True,
+    )
+    if out.returncode != 0:
+        raise RuntimeError(f"search_kb bench failed: {out.stderr.strip()}")
+    data = json.loads(out.stdout.strip().splitlines()[-1])
+    if not data["ok"]:
+        raise RuntimeError(f"search_kb bench failed: {data['errors']}")
+    rows = [{"kb_size": size, **r, "index_load_ms": data["index_load_ms"]} for r in data["results"]]
+    for row in rows:
+        _print_row(row)
+    return rows
+
+
+def _print_row(row: Dict[str, Any]) -> None:
+    print(
+        f"  kb={row['kb_size']:>8} {row['scenario']:<9} c={row['concurrency']:<3} "
+        f"p50={row.get('p50_ms', '-')}ms p95={row.get('p95_ms', '-')}ms p99={row.get('p99_ms', '-')}ms "
+        f"{row['throughput_rps']} req/s errors={row['errors']} rss={row.get('peak_rss_mb')}MB",
+        flush=True,
+    )
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    work_dir: Path = args.work_dir
+    work_dir.mkdir(parents=True, exist_ok=True)
+    ports = {"ollama": _free_port(), "arxiv": _free_port()}
+    fakes = subprocess.Popen(
+        [sys.executable, "-m", "bench.fake_servers",
+         "--ollama-port", str(ports["ollama"]), "--arxiv-port", str(ports["arxiv"]),
+         "--token-latency-ms", str(args.token_latency_ms), "--tokens", str(args.tokens),
+         "--arxiv-latency-ms", str(args.arxiv_latency_ms)],
+        cwd=_BACKEND_DIR,
+        stdout=subprocess.DEVNULL,
+    )
+    results: List[Dict[str, Any]] = []
+    kbs = {}
+    try:
+        _wait_http(f"http://127.0.0.1:{ports['ollama']}/api/tags")
+        for size_text in args.sizes:
+            size = parse_size(size_text)
+            kb_dir = work_dir / f"kb_{size_text}"
+            print(f"KB {size_text}: building / reusing {kb_dir}", flush=True)
+            kbs[size_text] = build_kb(kb_dir, size)
+
+            if "search_kb" in args.scenarios:
+                clone_kb(kb_dir, work_dir / "run")
+                results += _bench_search_kb(size, work_dir / "run", ports, args)
+            if {"ask", "arxiv"} & set(args.scenarios):
+                clone_kb(kb_dir, work_dir / "run")
+                results += _bench_api(size, work_dir / "run", ports, args)
+    finally:
+        fakes.terminate()
+        fakes.wait(10)
+
+    return {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "config": {
+                "requests": args.requests,
+                "concurrency": args.concurrency,
+                "scenarios": args.scenarios,
+                "pipeline": args.pipeline,
+                "token_latency_ms": args.token_latency_ms,
+                "tokens": args.tokens,
+                "arxiv_latency_ms": args.arxiv_latency_ms,
+                "ollama_rate_per_s": os.getenv("OLLAMA_RATE_PER_S", "1000"),
+                "ollama_max_concurrency": os.getenv("OLLAMA_MAX_CONCURRENCY", "8"),
+            },
+            "kbs": kbs,
+        },
+        "results": results,
+    }
+
+
+def _row_key(row: Dict[str, Any]) -> Tuple[int, str, int]:
+    return row["kb_size"], row["scenario"], row["concurrency"]
+
+
+def compare(old_path: Path, new_path: Path) -> None:
+    """Prints p50 / p95 / p99 / throughput deltas between two result files."""
+    old = {_row_key(r): r for r in json.loads(old_path.read_text(encoding="utf-8"))["results"]}
+    new = json.loads(new_path.read_text(encoding="utf-8"))["results"]
+    for row in new:
+        before = old.get(_row_key(row))
+        if before is None:
+            continue
+        parts = []
+        for metric in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps", "peak_rss_mb"):
+            a, b = before.get(metric), row.get(metric)
+            if a and b is not None:
+                parts.append(f"{metric}={a}->{b} ({(b - a) / a * 100:+.1f}%)")
+        print(f"kb={row['kb_size']} {row['scenario']} c={row['concurrency']}: " + " ".join(parts))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark /api/ask, /api/arxiv and search_kb against fake Ollama/arXiv.")
+    parser.add_argument("--sizes", default="1k,100k", help="tailles de KB synthétiques (1k,100k,1m)")
+    parser.add_argument("--concurrency", default="1,8,32", help="requêtes simultanées, séparées par des virgules")
+    parser.add_argument("--requests", type=int, default=200, help="requêtes par scénario et par niveau de concurrence")
+    parser.add_argument("--scenarios", default=",".join(_SCENARIOS))
+    parser.add_argument("--pipeline", default="sequential", help="pipeline de /api/ask (sequential|parallel)")
+    parser.add_argument("--token-latency-ms", type=float, default=20.0)
+    parser.add_argument("--tokens", type=int, default=64, help="tokens par réponse du faux Ollama")
+    parser.add_argument("--arxiv-latency-ms", type=float, default=200.0)
+    parser.add_argument("--work-dir", type=Path, default=_BACKEND_DIR / "bench" / ".work")
+    parser.add_argument("--out", type=Path, default=Path("bench_results.json"))
+    parser.add_argument("--compare", nargs=2, type=Path, metavar=("OLD", "NEW"))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    args.sizes = [s.strip() for s in args.sizes.split(",") if s.strip()]
+    args.concurrency = [int(c) for c in args.concurrency.split(",")]
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip() in _SCENARIOS]
+
+    report = run(args)
+    args.out.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
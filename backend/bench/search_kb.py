@@ -0,0 +1,69 @@
+"""
+search_kb benchmark, in-process (called by bench.run in a dedicated process).
+
+    cd backend
+    DATA_LAKE_DIR=bench/.work/run_100k python -m bench.search_kb --requests 500 --concurrency 4
+
+Prints a JSON: index loading (first query), then latencies of the
+following queries, throughput and the process's peak RSS.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+from app.services.kb_service import search_kb
+from bench.stats import peak_rss_mb, summarize
+from bench.synthetic_kb import questions
+
+
+def run(requests: int, concurrencies: List[int], top_k: int = 5, min_score: float = 0.12) -> Dict[str, Any]:
+    pool = questions(requests)
+
+    t0 = time.perf_counter()
+    warmup = search_kb(pool[0], top_k, min_score)
+    index_load_ms = (time.perf_counter() - t0) * 1000
+    if not warmup["ok"]:
+        return {"ok": False, "errors": warmup["errors"]}
+
+    def one(question: str) -> float:
+        start = time.perf_counter()
+        result = search_kb(question, top_k, min_score)
+        if not result["ok"]:
+            raise RuntimeError(result["errors"])
+        return (time.perf_counter() - start) * 1000
+
+    results = []
+    for concurrency in concurrencies:
+        errors = 0
+        latencies: List[float] = []
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for fut in [executor.submit(one, q) for q in pool]:
+                try:
+                    latencies.append(fut.result())
+                except RuntimeError:
+                    errors += 1
+        wall_s = time.perf_counter() - start
+        results.append({
+            "scenario": "search_kb",
+            "concurrency": concurrency,
+            **summarize(latencies, errors, wall_s),
+            "peak_rss_mb": peak_rss_mb(),
+        })
+    return {"ok": True, "index_load_ms": round(index_load_ms, 1), "results": results}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark search_kb on the KB of DATA_LAKE_DIR.")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", default="1,4", help="liste séparée par des virgules")
+    args = parser.parse_args()
+    print(json.dumps(run(args.requests, [int(c) for c in args.concurrency.split(",")])))
+
+
+if __name__ == "__main__":
+    main()
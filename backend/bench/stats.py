@@ -0,0 +1,51 @@
+"""Latency summaries and memory readings shared by the benchmark scripts."""
+from __future__ import annotations
+
+import sys
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+def summarize(latencies_ms: List[float], errors: int, wall_s: float) -> Dict[str, Any]:
+    done = len(latencies_ms)
+    out: Dict[str, Any] = {
+        "requests": done + errors,
+        "errors": errors,
+        "wall_s": round(wall_s, 3),
+        "throughput_rps": round(done / wall_s, 2) if wall_s > 0 else 0.0,
+    }
+    if done:
+        arr = np.asarray(latencies_ms)
+        p50, p95, p99 = np.percentile(arr, [50, 95, 99])
+        out.update({
+            "p50_ms": round(float(p50), 1),
+            "p95_ms": round(float(p95), 1),
+            "p99_ms": round(float(p99), 1),
+            "mean_ms": round(float(arr.mean()), 1),
+            "max_ms": round(float(arr.max()), 1),
+        })
+    return out
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak RSS of the current process (resource: missing on Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss : Ko sous Linux, octets sous macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def process_peak_rss_mb(pid: int) -> Optional[float]:
+    """Peak RSS (VmHWM) of another process, Linux only."""
+    try:
+        with open(f"/proc/{pid}/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
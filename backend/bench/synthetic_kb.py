@@ -0,0 +1,135 @@
+"""
+Synthetic KBs for benchmarks (1k / 100k / 1M items).
+
+    cd backend
+    python -m bench.synthetic_kb --size 100k --out bench/.work/kb_100k
+
+Items are drawn from a pseudo-random vocabulary with a Zipf-like frequency
+(a few very frequent words, a long tail), with a fixed seed: same size =>
+same KB, byte for byte. The KB is written as the first mmap segment of
+<out>/kb_segments/, as after `python -m app.services.kb_store`.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+import numpy as np
+
+from app.services.kb_store import MANIFEST_NAME, append_segment, segments_dir
+
+_SEED = 1234
+_VOCAB_SIZE = 30000
+_TITLE_WORDS = 8
+_ABSTRACT_WORDS = 60
+_CHUNK = 50000
+_META_NAME = "bench_kb.json"
+_SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "ta", "vo", "zi", "ph", "qu", "st", "tr", "ex", "on", "al", "en"]
+
+
+def parse_size(text: str) -> int:
+    """"1k" -> 1000, "1m" -> 1000000."""
+    text = text.strip().lower()
+    scale = {"k": 1000, "m": 1000000}.get(text[-1:], 1)
+    return int(float(text.rstrip("km")) * scale)
+
+
+def vocabulary(size: int = _VOCAB_SIZE) -> List[str]:
+    rng = np.random.default_rng(_SEED)
+    words = set()
+    while len(words) < size:
+        n = int(rng.integers(2, 5))
+        words.add("".join(_SYLLABLES[i] for i in rng.integers(0, len(_SYLLABLES), n)))
+    return sorted(words)
+
+
+def _word_probs(size: int) -> np.ndarray:
+    ranks = np.arange(1, size + 1, dtype=np.float64)
+    p = 1.0 / ranks
+    return p / p.sum()
+
+
+def iter_items(count: int, seed: int = _SEED) -> Iterator[Dict[str, Any]]:
+    vocab = vocabulary()
+    probs = _word_probs(len(vocab))
+    rng = np.random.default_rng(seed)
+    for start in range(0, count, _CHUNK):
+        n = min(_CHUNK, count - start)
+        titles = rng.choice(len(vocab), size=(n, _TITLE_WORDS), p=probs)
+        abstracts = rng.choice(len(vocab), size=(n, _ABSTRACT_WORDS), p=probs)
+        for i in range(n):
+            doc = start + i
+            yield {
+                "id": f"synth-{doc:07d}",
+                "title": " ".join(vocab[w] for w in titles[i]),
+                "abstract": " ".join(vocab[w] for w in abstracts[i]),
+                "url": f"https://example.org/synth/{doc}",
+                "theme": "ai_ml",
+            }
+
+
+def questions(count: int, seed: int = _SEED + 1) -> List[str]:
+    """
+    Questions built from the same vocabulary, with a flattened distribution:
+    mostly common words (KB hits), sometimes rare ones (arXiv fallback).
+    """
+    vocab = vocabulary()
+    probs = np.sqrt(_word_probs(len(vocab)))
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(vocab), size=(count, 4), p=probs / probs.sum())
+    return [f"{' '.join(vocab[w] for w in row)} {i}" for i, row in enumerate(picks)]
+
+
+def build_kb(data_lake: Path, count: int) -> Dict[str, Any]:
+    """Writes a `count`-item KB under data_lake/ unless an identical one is already there."""
+    meta_path = data_lake / _META_NAME
+    meta = {"count": count, "seed": _SEED, "abstract_words": _ABSTRACT_WORDS}
+    try:
+        if json.loads(meta_path.read_text(encoding="utf-8")) == meta:
+            return {"ok": True, "built": False, **meta}
+    except (OSError, ValueError):
+        pass
+
+    kb_file = data_lake / "kb.json"
+    shutil.rmtree(segments_dir(kb_file), ignore_errors=True)
+    segments_dir(kb_file).mkdir(parents=True)
+    t0 = time.perf_counter()
+    # Un seul segment : l'ingestion ne compacte que les segments suivants
+    append_segment(kb_file, iter_items(count))
+    meta_path.write_text(json.dumps(meta), encoding="utf-8")
+    return {"ok": True, "built": True, "build_s": round(time.perf_counter() - t0, 1), **meta}
+
+
+def clone_kb(source: Path, target: Path) -> None:
+    """
+    Fresh data lake sharing the base KB segment (hard link, or a copy):
+    what ingestion appends during a run does not touch the reference KB.
+    """
+    shutil.rmtree(target, ignore_errors=True)
+    src_dir, dst_dir = segments_dir(source / "kb.json"), segments_dir(target / "kb.json")
+    dst_dir.mkdir(parents=True)
+    for path in src_dir.iterdir():
+        if path.name == MANIFEST_NAME:
+            shutil.copy2(path, dst_dir / path.name)
+            continue
+        try:
+            os.link(path, dst_dir / path.name)
+        except OSError:
+            shutil.copy2(path, dst_dir / path.name)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build a synthetic KB for benchmarks.")
+    parser.add_argument("--size", default="1k", help="1k, 100k, 1m...")
+    parser.add_argument("--out", type=Path, required=True, help="dossier data_lake cible")
+    args = parser.parse_args()
+    print(json.dumps(build_kb(args.out, parse_size(args.size)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
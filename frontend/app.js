@@ -20,6 +20,9 @@ let chatHistory = [
   },
 ];
 
+// Session de conversation côté backend ("" = nouvelle session au prochain envoi)
+let sessionId = "";
+
 function scrollToBottom() {
   messagesEl.scrollTop = messagesEl.scrollHeight;
 }
@@ -70,7 +73,10 @@ async function handleSend(text) {
     res = await fetch(API_URL, {
       method: "POST",
       headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ question: userText }),
+      // Premier tour : le serveur ouvre la session (réponse en cache possible), puis on renvoie son id
+      body: JSON.stringify(
+        sessionId ? { question: userText, session_id: sessionId } : { question: userText, new_session: true }
+      ),
     });
   } catch (networkErr) {
     addMessage({
@@ -99,6 +105,7 @@ async function handleSend(text) {
     if (!reply || typeof reply !== "string") {
       throw new Error("Réponse backend invalide (champ answer/reply/message/output manquant).");
     }
+    if (typeof data.session_id === "string" && data.session_id) sessionId = data.session_id;
     addMessage({ role: "bot", text: reply });
     setLoading(false, "");
   } catch (parseErr) {
@@ -173,8 +180,9 @@ async function handleSendHistoryByEmail() {
   };
 
   try {
+    // 202 : l'email est en file, le backend l'envoie en arrière-plan
     await sendEmailToBackend(payload);
-    addMessage({ role: "bot", text: "Email envoyé avec succès." });
+    addMessage({ role: "bot", text: "Email mis en file d'envoi." });
   } catch (err) {
     addMessage({
       role: "bot",
@@ -193,6 +201,7 @@ clearBtn.addEventListener("click", () => {
   children.slice(1).forEach((node) => node.remove());
 
   chatHistory = [chatHistory[0]];
+  sessionId = "";
   statusEl.textContent = "";
   input.focus();
 });